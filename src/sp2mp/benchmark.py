@@ -0,0 +1,452 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from typing import Optional
+
+from PyQt6.QtCore import QCoreApplication, QObject, QTimer, pyqtSignal
+from PyQt6.QtGui import QImage
+
+from sp2mp import stats
+from sp2mp.broadcaster import Broadcaster
+from sp2mp.buffer_pool import BufferPool, FrameBuffer
+from sp2mp.frame_source import SyntheticFrameSource
+from sp2mp.protocol import FrameHeader, FrameType, unpack_tiles
+from sp2mp.receiver import Receiver
+from sp2mp.shm_transport import SharedFrameReader
+
+RESULTS_VERSION = 1
+
+
+@dataclass
+class BenchmarkCase:
+    width: int
+    height: int
+    clients: int
+    fps: int
+    duration: float
+    change_rate: float = 1.0
+    delta_mode: bool = False
+    input_rate: float = 0.0
+    input_channel: bool = True
+    encode_workers: int = 0
+    shared_memory: bool = False
+    instrument: bool = False
+    buffer_pool: bool = True
+    output_size: Optional[tuple[int, int]] = None
+    trace_allocations: bool = False
+
+
+@dataclass
+class BenchmarkResult:
+    case: BenchmarkCase
+    frames: int
+    achieved_fps: float
+    latency_p50_ms: float
+    latency_p95_ms: float
+    latency_p99_ms: float
+    bytes_per_frame: float
+    skip_ratio: float
+    cpu_ms_per_frame: dict[str, float] = field(default_factory=dict)
+    input_events: int = 0
+    input_latency_p50_ms: float = 0.0
+    input_latency_p95_ms: float = 0.0
+    input_latency_p99_ms: float = 0.0
+    input_to_photon_events: int = 0
+    input_to_photon_p50_ms: float = 0.0
+    input_to_photon_p95_ms: float = 0.0
+    input_to_photon_p99_ms: float = 0.0
+    # Allocation across the whole process in the steady state (see run_case). The heap figures are only measured when
+    # the case traces allocations.
+    page_faults_per_s: float = 0.0
+    heap_growth_bytes_per_s: float = 0.0
+    heap_peak_bytes: float = 0.0
+    buffer_reuse_ratio: float = 0.0
+
+
+@dataclass
+class StartupResult:
+    # Medians over every run, each in a fresh interpreter. The process time includes starting the interpreter.
+    runs: int
+    process_ms: float
+    import_ms: float
+    window_ms: float
+    headless_import_ms: float
+
+
+# Runs in a fresh interpreter, timing the steps from importing the GUI to it being ready to show.
+_STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import sp2mp.ui
+imported = time.perf_counter()
+from PyQt6.QtWidgets import QApplication
+app = QApplication([])
+ui = sp2mp.ui.UI()
+shown = time.perf_counter()
+print(json.dumps({"import": imported - start, "window": shown - imported}))
+"""
+
+_HEADLESS_STARTUP_SCRIPT = """
+import json, time
+start = time.perf_counter()
+import sp2mp.cli
+print(json.dumps({"import": time.perf_counter() - start}))
+"""
+
+
+class _ReceiverProbe(QObject):
+    # Decodes every frame received by one receiver, recording its glass-to-glass latency and size, and the latency of
+    # any input it shows. Frames are moved to the main thread (like a GUI client would), rather than being decoded on
+    # the network engine's loop.
+    _receiver: Receiver
+    _warmup_until: int
+    latencies: list[float]
+    frame_bytes: list[int]
+    timestamps: list[int]
+    decode_time: float
+    input_latencies: list[float]
+    _shared_frames: SharedFrameReader
+
+    frame_received = pyqtSignal(object, object)
+
+    def __init__(self, receiver: Receiver, warmup: float) -> None:
+        super().__init__()
+        self._receiver = receiver
+        self._warmup_until = time.time_ns() + int(warmup * 1e9)
+        self.latencies = []
+        self.frame_bytes = []
+        self.timestamps = []
+        self.decode_time = 0.0
+        self.input_latencies = []
+        self._shared_frames = SharedFrameReader()
+        self.frame_received.connect(self._on_frame)
+        receiver.frame_received.connect(self._queue_frame)
+
+    def _queue_frame(self, header: FrameHeader, data: FrameBuffer) -> None:
+        # The frame's buffer is held until it's been handled on the main thread.
+        data.retain()
+        self.frame_received.emit(header, data)
+
+    def _on_frame(self, header: FrameHeader, buffer: FrameBuffer) -> None:
+        try:
+            self._handle_frame(header, buffer.view)
+        finally:
+            buffer.release()
+
+    def _handle_frame(self, header: FrameHeader, data: memoryview) -> None:
+        if header.frame_type == FrameType.HEARTBEAT or header.timestamp < self._warmup_until:
+            return
+
+        # Decoding is part of the pipeline being measured (the tiles of a delta frame are decoded individually).
+        start = time.thread_time()
+        if header.frame_type == FrameType.IMAGE:
+            QImage.fromData(data)
+        elif header.frame_type == FrameType.TILES:
+            for _, _, tile_data in unpack_tiles(data)[2]:
+                QImage.fromData(tile_data.tobytes())
+        elif header.frame_type == FrameType.SHARED:
+            self._shared_frames.read(data)
+        self.decode_time += time.thread_time() - start
+        self.input_latencies += self._receiver.frame_displayed(header)
+
+        self.latencies.append((time.time_ns() - header.timestamp) / 1e6)
+        self.frame_bytes.append(FrameHeader.STRUCT.size + len(data))
+        self.timestamps.append(header.timestamp)
+
+    @property
+    def achieved_fps(self) -> float:
+        # Taken from the capture timestamps of the frames counted, as the warmup and the end of the run don't line up
+        # exactly with the first and last of them.
+        if len(self.timestamps) < 2:
+            return 0.0
+        return (len(self.timestamps) - 1) / ((self.timestamps[-1] - self.timestamps[0]) / 1e9)
+
+
+class _InputProbeSource(SyntheticFrameSource):
+    # Records when each key event reaches the source, to measure the client-to-source input latency.
+    sent: dict[int, float]
+    latencies: list[float]
+
+    def __init__(self, *args) -> None:
+        super().__init__(*args)
+        self.sent = {}
+        self.latencies = []
+
+    def send_key(self, key_code: int, key_down: bool) -> None:
+        super().send_key(key_code, key_down)
+        sent = self.sent.pop(key_code, None)
+        if sent is not None:
+            self.latencies.append((time.perf_counter() - sent) * 1000)
+
+
+class _InputGenerator:
+    # Sends key events from the first client at a fixed rate, cycling through the key codes so each is matched up.
+    _receiver: Receiver
+    _source: _InputProbeSource
+    _warmup_until: float
+    _key_code: int
+    _timer: QTimer
+
+    def __init__(self, receiver: Receiver, source: _InputProbeSource, rate: float, warmup: float) -> None:
+        self._receiver = receiver
+        self._source = source
+        self._warmup_until = time.perf_counter() + warmup
+        self._key_code = 0
+        self._timer = QTimer()
+        self._timer.timeout.connect(self._send)
+        self._timer.start(max(1, int(1000 / rate)))
+
+    def stop(self) -> None:
+        self._timer.stop()
+
+    def _send(self) -> None:
+        if time.perf_counter() < self._warmup_until:
+            return
+        self._key_code = (self._key_code + 1) % 256
+        self._source.sent[self._key_code] = time.perf_counter()
+        self._receiver.send_key_event(self._key_code, self._key_code % 2 == 0)
+
+
+def _percentile(values: list[float], percentile: int) -> float:
+    if len(values) < 2:
+        return values[0] if values else 0.0
+    return statistics.quantiles(values, n=100, method="inclusive")[percentile - 1]
+
+
+def _page_faults() -> int:
+    # Minor page faults count fresh memory being touched, which includes any large buffer allocated (and so mapped in)
+    # for each frame, by Python or by Qt. 0 where neither source is available.
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_minflt
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().num_page_faults
+    except ImportError:
+        return 0
+
+
+def run_case(app: QCoreApplication, case: BenchmarkCase, base_port: int, warmup: float = 1.0) -> BenchmarkResult:
+    # Tracing starts before anything is created, so frames freed in the steady state were traced when allocated.
+    if case.trace_allocations:
+        tracemalloc.start()
+
+    # Input-to-photon latency is measured with the frames' input echoes, which need instrumentation.
+    instrument = case.instrument or case.input_rate > 0
+    receivers = [Receiver(base_port + i, instrument) for i in range(case.clients)]
+    probes = [_ReceiverProbe(receiver, warmup) for receiver in receivers]
+
+    # Without the buffer pool, a pool that keeps nothing allocates every frame's buffer, for comparison.
+    source = _InputProbeSource(case.width, case.height, case.change_rate)
+    buffer_pool = BufferPool() if case.buffer_pool else BufferPool(max_free=0)
+    broadcaster = Broadcaster(
+        source, [], [], delta_mode=case.delta_mode, fps=case.fps, input_channel=case.input_channel,
+        encode_workers=case.encode_workers, instrument=instrument, buffer_pool=buffer_pool)
+    for i in range(case.clients):
+        broadcaster.add_new_client(
+            "127.0.0.1", base_port + i, output_size=case.output_size, shared_memory=case.shared_memory)
+
+    # Run the Qt event loop, so the receivers' signals are delivered, for the warmup and the measured duration.
+    # Allocation is measured from the end of the warmup, so only the steady state is measured.
+    broadcaster.broadcast()
+    generator = _InputGenerator(receivers[0], source, case.input_rate, warmup) if case.input_rate > 0 else None
+    warm = {}
+    QTimer.singleShot(int(warmup * 1000), lambda: warm.update(_allocation_snapshot(buffer_pool)))
+    QTimer.singleShot(int((warmup + case.duration) * 1000), app.quit)
+    app.exec()
+    end = _allocation_snapshot(buffer_pool)
+    tracemalloc.stop()
+
+    if generator:
+        generator.stop()
+    broadcaster.stop()
+    for receiver in receivers:
+        receiver.close()
+    app.processEvents()
+
+    # Combine the measurements from every client. CPU times are given per frame delivered to a client.
+    latencies = [latency for probe in probes for latency in probe.latencies]
+    frame_bytes = [size for probe in probes for size in probe.frame_bytes]
+    frames = len(latencies)
+
+    stage_times = broadcaster.stage_times.snapshot()
+    for receiver in receivers:
+        for stage, (total, count) in receiver.stage_times.snapshot().items():
+            previous_total, previous_count = stage_times.get(stage, (0.0, 0))
+            stage_times[stage] = previous_total + total, previous_count + count
+    stage_times["decode"] = sum(probe.decode_time for probe in probes), frames
+    acquired = end["allocations"] + end["reuses"] - warm["allocations"] - warm["reuses"]
+
+    return BenchmarkResult(
+        case=case,
+        frames=frames,
+        achieved_fps=statistics.fmean(probe.achieved_fps for probe in probes),
+        latency_p50_ms=_percentile(latencies, 50),
+        latency_p95_ms=_percentile(latencies, 95),
+        latency_p99_ms=_percentile(latencies, 99),
+        bytes_per_frame=statistics.fmean(frame_bytes) if frame_bytes else 0.0,
+        skip_ratio=broadcaster.skip_ratio,
+        cpu_ms_per_frame={stage: total * 1000 / frames if frames else 0.0 for stage, (total, _) in stage_times.items()},
+        input_events=len(source.latencies),
+        input_latency_p50_ms=_percentile(source.latencies, 50),
+        input_latency_p95_ms=_percentile(source.latencies, 95),
+        input_latency_p99_ms=_percentile(source.latencies, 99),
+        input_to_photon_events=len(probes[0].input_latencies),
+        input_to_photon_p50_ms=_percentile(probes[0].input_latencies, 50),
+        input_to_photon_p95_ms=_percentile(probes[0].input_latencies, 95),
+        input_to_photon_p99_ms=_percentile(probes[0].input_latencies, 99),
+        page_faults_per_s=(end["page_faults"] - warm["page_faults"]) / case.duration,
+        heap_growth_bytes_per_s=(end["heap"] - warm["heap"]) / case.duration,
+        heap_peak_bytes=end["heap_peak"] - warm["traced"],
+        buffer_reuse_ratio=(end["reuses"] - warm["reuses"]) / acquired if acquired else 0.0)
+
+
+_UNMEASURED_FILES = [tracemalloc.Filter(False, __file__), tracemalloc.Filter(False, stats.__file__)]
+
+
+def _allocation_snapshot(buffer_pool: BufferPool) -> dict:
+    # The buffer pool only sees its own frame buffers, so allocation is also measured across the whole process: page
+    # faults catch native allocations too (like a QImage copied for each frame), and tracemalloc, if it's tracing,
+    # follows everything Python allocates on any thread (like encoded frames' bytes). The heap leaves out what the
+    # probes record for every frame (and the stats' histograms), so its growth is only the pipeline's. The traced peak
+    # can't be filtered; it's reset, so the end's peak is the most the heap reached during the measured duration.
+    traced, heap_peak = tracemalloc.get_traced_memory()
+    tracemalloc.reset_peak()
+    heap = 0
+    if tracemalloc.is_tracing():
+        snapshot = tracemalloc.take_snapshot().filter_traces(_UNMEASURED_FILES)
+        heap = sum(stat.size for stat in snapshot.statistics("filename"))
+    return {
+        **buffer_pool.snapshot(), "page_faults": _page_faults(), "heap": heap, "traced": traced,
+        "heap_peak": heap_peak}
+
+
+def _run_startup_script(script: str) -> tuple[float, dict[str, float]]:
+    # The child process finds this package the same way this one did.
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, sys.path)))
+    start = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", script], env=env, capture_output=True, check=True, text=True).stdout
+    return time.perf_counter() - start, json.loads(output.splitlines()[-1])
+
+
+def measure_startup(runs: int) -> StartupResult:
+    process_times, import_times, window_times, headless_import_times = [], [], [], []
+    for _ in range(runs):
+        process_time, times = _run_startup_script(_STARTUP_SCRIPT)
+        process_times.append(process_time)
+        import_times.append(times["import"])
+        window_times.append(times["window"])
+        headless_import_times.append(_run_startup_script(_HEADLESS_STARTUP_SCRIPT)[1]["import"])
+
+    return StartupResult(
+        runs=runs,
+        process_ms=statistics.median(process_times) * 1000,
+        import_ms=statistics.median(import_times) * 1000,
+        window_ms=statistics.median(window_times) * 1000,
+        headless_import_ms=statistics.median(headless_import_times) * 1000)
+
+
+def _parse_resolution(text: str) -> tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def _parse_list(text: str, parse=int) -> list:
+    return [parse(item) for item in text.split(",") if item]
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser = argparse.ArgumentParser(description="Benchmark the capture, encode, send, receive and decode pipeline.")
+    parser.add_argument("--resolutions", default="1280x720,1920x1080", help="comma separated WIDTHxHEIGHT list")
+    parser.add_argument("--clients", default="1,4", help="comma separated client counts")
+    parser.add_argument("--fps", default="30,60", help="comma separated target frame rates")
+    parser.add_argument("--duration", type=float, default=5.0, help="measured seconds per case")
+    parser.add_argument("--change-rate", type=float, default=1.0, help="fraction of frames that change")
+    parser.add_argument("--delta", action="store_true", help="use tile-delta encoding")
+    parser.add_argument("--input-rate", type=float, default=0.0, help="key events per second sent by the first client")
+    parser.add_argument(
+        "--no-input-channel", action="store_true", help="send input over the frame connection, for comparison")
+    parser.add_argument("--encode-workers", type=int, default=0, help="encode on this many worker processes")
+    parser.add_argument("--shared-memory", action="store_true", help="send raw frames through shared memory")
+    parser.add_argument("--instrument", action="store_true", help="collect per-frame timings, to measure their cost")
+    parser.add_argument("--output-size", metavar="WIDTHxHEIGHT", help="every client's output resolution")
+    parser.add_argument(
+        "--no-buffer-pool", action="store_true", help="allocate a new buffer for every frame, for comparison")
+    parser.add_argument(
+        "--trace-allocations", action="store_true",
+        help="trace the heap's growth and peak with tracemalloc (which slows every allocation down)")
+    parser.add_argument(
+        "--startup", type=int, default=0, metavar="RUNS", help="also measure startup time over this many runs")
+    parser.add_argument("--port", type=int, default=21000, help="first loopback port to use")
+    parser.add_argument("--label", default="", help="label stored with the results, like a version or commit")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args(argv)
+
+    startup = None
+    if args.startup:
+        startup = measure_startup(args.startup)
+        print(
+            f"startup: {startup.process_ms:.0f} ms to a ready window (import {startup.import_ms:.0f} ms, window "
+            f"{startup.window_ms:.0f} ms), headless import {startup.headless_import_ms:.0f} ms")
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv[:1])
+    results = []
+    port = args.port
+
+    for width, height in _parse_list(args.resolutions, _parse_resolution):
+        for clients in _parse_list(args.clients):
+            for fps in _parse_list(args.fps):
+                case = BenchmarkCase(
+                    width, height, clients, fps, args.duration, args.change_rate, args.delta, args.input_rate,
+                    not args.no_input_channel, args.encode_workers, args.shared_memory, args.instrument,
+                    not args.no_buffer_pool, _parse_resolution(args.output_size) if args.output_size else None,
+                    args.trace_allocations)
+                result = run_case(app, case, port)
+                port += clients
+                results.append(result)
+
+                print(
+                    f"{width}x{height} clients={clients} fps={fps}: {result.achieved_fps:.1f} fps, "
+                    f"latency p50/p95/p99 {result.latency_p50_ms:.1f}/{result.latency_p95_ms:.1f}/"
+                    f"{result.latency_p99_ms:.1f} ms, {result.bytes_per_frame / 1024:.1f} KiB/frame, cpu ms/frame "
+                    + ", ".join(f"{stage}={ms:.2f}" for stage, ms in result.cpu_ms_per_frame.items()))
+                print(
+                    f"    steady state: {result.page_faults_per_s:.0f} page faults/s, "
+                    f"{result.buffer_reuse_ratio:.1%} of frame buffers reused")
+                if case.trace_allocations:
+                    print(
+                        f"    heap grew {result.heap_growth_bytes_per_s / 1024:.1f} KiB/s, and peaked "
+                        f"{result.heap_peak_bytes / 1024:.1f} KiB above where it started")
+                if result.input_events:
+                    print(
+                        f"    input latency p50/p95/p99 {result.input_latency_p50_ms:.2f}/"
+                        f"{result.input_latency_p95_ms:.2f}/{result.input_latency_p99_ms:.2f} ms "
+                        f"over {result.input_events} events")
+                    print(
+                        f"    input-to-photon p50/p95/p99 {result.input_to_photon_p50_ms:.2f}/"
+                        f"{result.input_to_photon_p95_ms:.2f}/{result.input_to_photon_p99_ms:.2f} ms "
+                        f"over {result.input_to_photon_events} events")
+
+    if args.output:
+        with open(args.output, "w") as fo:
+            json.dump({
+                "version": RESULTS_VERSION,
+                "label": args.label,
+                "timestamp": time.time(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "startup": asdict(startup) if startup else None,
+                "results": [asdict(result) for result in results]}, fo, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,141 +1,319 @@
+import asyncio
+import logging
 import time
-from dataclasses import dataclass, field
-from queue import Queue
-from socket import socket
-from threading import Lock, Thread
-import pickle
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Optional, Union
 
-import win32api
-import win32con
+from PyQt6.QtCore import QRect
+from PyQt6.QtGui import QImage, QPainter
 
-from PyQt6.QtCore import QBuffer
+from sp2mp.buffer_pool import BufferPool, FrameBuffer
+from sp2mp.encode_pool import EncodePool
+from sp2mp.encoder import DeltaEncoder, FrameChangeDetector, FrameEncoder, ScaledFrames, frame_checksum
+from sp2mp.frame_server import Client, FrameServer, Stream
+from sp2mp.frame_source import FrameSource
+from sp2mp.key_mapping import IDENTITY_KEY_TABLE, KEY_TABLE_SIZE
+from sp2mp.protocol import FrameFlag, FrameHeader, FrameType, Packet
+from sp2mp.quality import EncodeSettings
+from sp2mp.scheduler import FrameScheduler
+from sp2mp.shm_transport import SharedFrameRing, is_local_host
 
-from sp2mp.screenshotter import ScreenShotter
-
-from enum import Enum
-
-
-class EventProtocol(Enum):
-    KEYBOARD = b"\01"
-
-
-@dataclass
-class KeyboardEvent:
-    key_code: int
-    key_down: bool
+_logger = logging.getLogger(__name__)
 
 
 @dataclass
-class Client:
-    host: str
-    port: int
-    queue: Queue = field(default_factory=Queue)
-    sender_thread: Thread = field(init=False, default=None)
-    client_thread: Thread = field(init=False, default=None)
-    socket: socket = field(init=False, default=None)
-
-
-class Broadcaster:
-    _hwnd: int
-    _clients: list[Client]
-    _screenshot_thread: Thread
-    _lock: Lock
-    _fps: int
-
-    def __init__(self, hwnd: int, hosts: list[str], ports: list[int]) -> None:
-        self._hwnd = hwnd
-        self._clients = [Client(host, port) for host, port in zip(hosts, ports)]
-        self._lock = Lock()
-        self._fps = 60
-
-    def add_new_client(self, host: str, port: int, auto_broadcast: bool = False) -> None:
-        client = Client(host, port)
-        self._clients.append(client)
-        if auto_broadcast:
-            self._begin_client_thread(client)
-
-    def _begin_client_thread(self, client: Client) -> None:
-
-        # Thread to send screenshots to the client.
-        thread = Thread(target=self._send_screenshots, args=(client,))
-        thread.daemon = True
-        thread.start()
-        client.sender_thread = thread
-
-        # Thread to receive key and mouse events from the client.
-        thread = Thread(target=self._recv_events, args=(client,))
-        thread.daemon = True
-        thread.start()
-        client.client_thread = thread
-
-    def broadcast(self) -> None:
-        self._screenshot_thread = Thread(target=self._screenshot_loop, args=(self._fps,))
-        self._screenshot_thread.daemon = True
-        self._screenshot_thread.start()
-
-        for client in self._clients:
-            self._begin_client_thread(client)
-
-    def reset_hwnd(self, hwnd: int) -> None:
+class CaptureStream(Stream):
+    # Each stream is captured at its own rate, and keeps its own encoding state.
+    scheduler: FrameScheduler = field(init=False)
+    change_detector: FrameChangeDetector = field(default_factory=FrameChangeDetector)
+    delta_encoder: Optional[DeltaEncoder] = None
+    ring: Optional[SharedFrameRing] = None
+    last_sent: float = 0.0
+
+    def __post_init__(self) -> None:
+        self.scheduler = FrameScheduler(self.fps)
+
+    def request_keyframe(self) -> None:
+        # Force the next frame to be fully encoded, even if the window content hasn't changed.
+        self.change_detector.reset()
+        if self.delta_encoder:
+            self.delta_encoder.request_keyframe()
+
+
+# A frame for a stream, whose payload may still be being encoded by the encode pool (along with the encode's CPU time).
+PendingFrame = tuple[CaptureStream, FrameHeader, Union[bytes, FrameBuffer, Future[tuple[bytes, float]]]]
+
+
+class Broadcaster(FrameServer):
+    _source: FrameSource
+    _streams: dict[tuple[int, EncodeSettings, bool], CaptureStream]
+    _executor: ThreadPoolExecutor
+    _encode_pool: Optional[EncodePool]
+    _delivery: Optional[asyncio.Task]
+    _capture_source: Optional[FrameSource]
+    _encoder: FrameEncoder
+    _buffer_pool: BufferPool
+    _delta_mode: bool
+    _heartbeat_interval: float
+    _frames_captured: int
+    _frames_encoded: int
+    _encodes_skipped: int
+    _sequence: int
+    _key_table: bytes
+    _input_serial: int
+    _capture_region: Optional[tuple[int, int, int, int]]
+    _cropped: Optional[QImage]
+    _capture_failing: bool
+
+    def __init__(
+            self, source: FrameSource, hosts: list[str], ports: list[int], delta_mode: bool = False, fps: int = 60,
+            adaptive_quality: bool = False, input_channel: bool = True, encode_workers: int = 0,
+            instrument: bool = False, buffer_pool: Optional[BufferPool] = None) -> None:
+        self._source = source
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sp2mp-encode")
+        self._capture_source = None
+
+        # Full frames can be encoded on worker processes, in parallel. Delta frames depend on the previous frame, so are
+        # always encoded on the encode thread.
+        self._encode_pool = EncodePool(encode_workers) if encode_workers and not delta_mode else None
+        self._delivery = None
+        self._encoder = FrameEncoder()
+        self._buffer_pool = buffer_pool or BufferPool()
+        self._delta_mode = delta_mode
+        self._heartbeat_interval = 1.0
+        self._frames_captured = 0
+        self._frames_encoded = 0
+        self._encodes_skipped = 0
+        self._sequence = 0
+        self._key_table = IDENTITY_KEY_TABLE
+        self._input_serial = 0
+        self._capture_region = None
+        self._cropped = None
+        self._capture_failing = False
+        super().__init__(hosts, ports, fps, adaptive_quality, input_channel, instrument)
+
+    @property
+    def encode_count(self) -> int:
+        return self._encoder.encode_count + (self._encode_pool.encode_count if self._encode_pool else 0)
+
+    @property
+    def buffer_pool(self) -> BufferPool:
+        return self._buffer_pool
+
+    @property
+    def frames_captured(self) -> int:
+        return self._frames_captured
+
+    @property
+    def encodes_skipped(self) -> int:
+        return self._encodes_skipped
+
+    @property
+    def skip_ratio(self) -> float:
+        total = self._encodes_skipped + self._frames_encoded
+        return self._encodes_skipped / total if total else 0.0
+
+    def stats_snapshot(self) -> dict:
+        return {"buffer_pool": self._buffer_pool.snapshot(), **super().stats_snapshot()}
+
+    def stop(self) -> None:
+        super().stop()
+        self._executor.shutdown()
+        if self._encode_pool:
+            self._encode_pool.close()
+
+    def set_key_table(self, table: bytes) -> None:
+        # The table is swapped whole, so events on the network engine's loop see either the old table or the new one.
+        self._key_table = table
+
+    def set_capture_region(self, region: Optional[tuple[int, int, int, int]]) -> None:
+        # Only this (x, y, width, height) part of the source is broadcast, like a game's play area without the title bar.
+        # None broadcasts the whole source. The screenshot thread crops to the new region from its next frame.
+        self._capture_region = region
+
+    def reset_source(self, source: FrameSource) -> None:
+        # The screenshot thread switches to the new source on its next frame.
         with self._lock:
-            self._hwnd = hwnd
-
-        # Reset the screenshot thread to use the new hwnd.
-        if self._screenshot_thread and self._screenshot_thread.is_alive():
-            self._screenshot_thread.join(timeout=1)
-            self._screenshot_thread = Thread(target=self._screenshot_loop, args=(self._fps,))
-            self._screenshot_thread.daemon = True
-            self._screenshot_thread.start()
-
-    def _screenshot_loop(self, fps: int) -> None:
-        while True:
-            screenshot = ScreenShotter.take_screenshot(self._hwnd)
-            for client in self._clients:
-                client.queue.put(screenshot)
-
-            # Sleep to maintain the desired FPS
-            time.sleep(1 / fps)
-
-    def _send_screenshots(self, client: Client) -> None:
-        client.socket = socket()
-        client.socket.connect((client.host, client.port))
-
-        while True:
-            screenshot = client.queue.get()
-            if screenshot is None:
-                break
-
-            # Serialize the screenshot and send it over the socket.
-            buffer = QBuffer()
-            buffer.open(QBuffer.OpenModeFlag.WriteOnly)
-            screenshot.save(buffer, "JPG")
-            data = buffer.data() + b"\n"  # Append newline to indicate end of image data
-            client.socket.sendall(data.data())
-
-            # Close the buffer after sending, and mark the task as done.
-            buffer.close()
-            client.queue.task_done()
-
-    def _recv_events(self, client: Client) -> None:
-        # Wait for the server to create the socket.
-        while client.socket is None:
-            pass
-        time.sleep(1)
-
-        # Receive key and mouse events from the client.
-        while True:
-            data = client.socket.recv(1024)
-            if not data:
-                break
-
-            if data[0] == EventProtocol.KEYBOARD.value[0]:
-                self._handle_keyboard_event(data[1:])
-
-    def _handle_keyboard_event(self, data: bytes) -> None:
-        key_event = pickle.loads(data)
-
-        # Send key events to this machine.
-        if key_event.key_down:
-            win32api.PostMessage(self._hwnd, win32con.WM_KEYDOWN, key_event.key_code, 0)
-        else:
-            win32api.PostMessage(self._hwnd, win32con.WM_KEYUP, key_event.key_code, 0)
+            self._source = source
+
+    def _add_client(self, client: Client) -> None:
+        # Clients which asked for shared memory are sent raw frames through it (so there's no quality to adapt), as long
+        # as they're on this host; others are sent encoded frames.
+        client.shared_memory = client.shared_memory and is_local_host(client.host)
+        super()._add_client(client)
+
+    def _create_stream(self, fps: int, settings: EncodeSettings, shared_memory: bool) -> CaptureStream:
+        if shared_memory:
+            return CaptureStream(fps, settings, shared_memory, ring=SharedFrameRing())
+        delta_encoder = DeltaEncoder(self._encoder, settings) if self._delta_mode else None
+        return CaptureStream(fps, settings, shared_memory, delta_encoder=delta_encoder)
+
+    async def _shutdown(self) -> None:
+        if self._delivery:
+            await asyncio.gather(self._delivery, return_exceptions=True)
+        await super()._shutdown()
+
+        # The source is released on the thread it was used on.
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_source)
+        for stream in list(self._streams.values()):
+            if stream.ring:
+                stream.ring.close()
+
+    async def _produce_frames(self) -> None:
+        loop = asyncio.get_running_loop()
+        scheduler = FrameScheduler(self._fps)
+        for stream in list(self._streams.values()):
+            stream.scheduler.reset()
+            stream.request_keyframe()
+
+        while not self._stopped.is_set():
+            # Wait for the next deadline, which accounts for the time spent capturing and encoding the last frame.
+            deadline = await scheduler.wait_async()
+            due_streams = [s for s in list(self._streams.values()) if s.clients and s.scheduler.is_due(deadline)]
+            if not due_streams:
+                continue
+
+            # Frames being encoded by the pool each hold a slot; if they're all in use, the pool is behind, so this
+            # frame is skipped rather than queued.
+            if self._encode_pool and not self._encode_pool.has_free_slot:
+                continue
+
+            # Capturing and encoding are CPU heavy, so they run on the encode thread, leaving the loop free to send. Input
+            # is applied on the loop too, so everything applied up to here is reflected in the frame.
+            input_serial = self._input_serial
+            frames = await loop.run_in_executor(self._executor, self._capture_frame, due_streams)
+            if self._encode_pool:
+                self._delivery = asyncio.create_task(self._deliver_encoded(frames, input_serial, self._delivery))
+            else:
+                self._deliver_frames([(stream, Packet(header, data, input_serial)) for stream, header, data in frames])
+
+    async def _deliver_encoded(
+            self, frames: list[PendingFrame], input_serial: int, previous: Optional[asyncio.Task]) -> None:
+        # Wait for the worker processes to encode the frame, then wait for the previous frame to be delivered, so
+        # frames are always sent in sequence order, even if they finish encoding out of order. The workers' CPU time
+        # is counted as the encode stage too. A frame that failed to encode is skipped (its stream's next frame is a
+        # full frame anyway), as nothing else waits on this task to see the error.
+        packets = []
+        for stream, header, data in frames:
+            if isinstance(data, Future):
+                try:
+                    data, encode_time = await asyncio.wrap_future(data)
+                except Exception:
+                    _logger.exception("Encoding a frame on the encode pool failed")
+                    continue
+                self._stage_times.add("encode", encode_time)
+                header = replace(header, length=len(data), encoded=time.time_ns())
+            packets.append((stream, Packet(header, data, input_serial)))
+
+        if previous:
+            await asyncio.wait([previous])
+        self._deliver_frames(packets)
+
+    def _deliver_frames(self, packets: list[tuple[CaptureStream, Packet]]) -> None:
+        # The encode thread's reference to each pooled frame is dropped once the clients have their own.
+        self._deliver(packets)
+        for buffer in {packet.buffer for _, packet in packets if packet.buffer is not None}:
+            buffer.release()
+
+    def _capture_frame(self, streams: list[CaptureStream]) -> list[PendingFrame]:
+        timestamp = time.time_ns()
+        start = time.thread_time()
+        try:
+            # Switch to the new source if it has been reset, releasing the old one.
+            if self._capture_source is not self._source:
+                self._close_source()
+                self._capture_source = self._source
+            screenshot = self._crop(self._capture_source.capture())
+
+        # The source can fail, like when the captured window is closed. Frames are skipped (and the failure is only
+        # logged once) until it recovers, or is replaced, so the broadcast and its connections carry on.
+        except Exception:
+            if not self._capture_failing:
+                _logger.exception("Capturing a frame failed; skipping frames until the source recovers")
+            self._capture_failing = True
+            return []
+        self._capture_failing = False
+
+        checksum = frame_checksum(screenshot)
+        self._stage_times.add("capture", time.thread_time() - start)
+        self._frames_captured += 1
+
+        frames = []
+        changed = [stream for stream in streams if stream.change_detector.has_changed(checksum)]
+        scaled_frames = ScaledFrames(screenshot)
+
+        # Without deltas, the frame is scaled once per distinct output size, then encoded once per distinct settings, and
+        # shared with every client. The pool starts on every distinct settings straight away, from one copy of the frame.
+        shared_data = {}
+        if self._encode_pool and any(not stream.ring for stream in changed):
+            settings = list({stream.settings for stream in changed if not stream.ring})
+            shared_data = dict(zip(settings, self._encode_pool.submit(screenshot, settings)))
+
+        for stream in streams:
+            # Skip encoding and sending entirely if nothing has changed, only sending a heartbeat now and then.
+            if stream not in changed:
+                self._encodes_skipped += 1
+                if time.monotonic() - stream.last_sent < self._heartbeat_interval:
+                    continue
+
+                header = FrameHeader(FrameType.HEARTBEAT, FrameFlag.NONE, self._sequence, timestamp, 0)
+                frames.append((stream, header, b""))
+
+            else:
+                self._frames_encoded += 1
+                start = time.thread_time()
+                if stream.ring:
+                    data = stream.ring.write(scaled_frames.get(stream.settings))
+                    frame_type, flags = FrameType.SHARED, FrameFlag.KEYFRAME
+                elif stream.delta_encoder:
+                    frame_type, flags, data = stream.delta_encoder.encode(scaled_frames.get(stream.settings))
+                else:
+                    if stream.settings not in shared_data:
+                        shared_data[stream.settings] = self._encoder.encode_into(
+                            self._buffer_pool, scaled_frames.get(stream.settings), stream.settings.quality)
+                    frame_type, flags, data = FrameType.IMAGE, FrameFlag.KEYFRAME, shared_data[stream.settings]
+                self._stage_times.add("encode", time.thread_time() - start)
+
+                # Frames still being encoded by the pool have their length (and encode time) filled in when they're done.
+                length, encoded = (0, 0) if isinstance(data, Future) else (len(data), time.time_ns())
+                if self._instrument:
+                    flags |= FrameFlag.TIMINGS | FrameFlag.INPUT_ECHO
+                header = FrameHeader(frame_type, flags, self._sequence, timestamp, length, encoded)
+                frames.append((stream, header, data))
+
+            self._sequence = (self._sequence + 1) & 0xFFFFFFFF
+            stream.last_sent = time.monotonic()
+
+        return frames
+
+    def _crop(self, screenshot: QImage) -> QImage:
+        # The region is clipped to the frame, as the window may have shrunk since it was chosen.
+        if self._capture_region is None:
+            return screenshot
+        region = QRect(*self._capture_region).intersected(screenshot.rect())
+        if region.isEmpty() or region == screenshot.rect():
+            return screenshot
+
+        # The region is drawn into the same image every frame, rather than a new copy. Nothing keeps the cropped frame
+        # after it's captured: the pool and rings copy it, and scaling, tiling and encoding make images of their own.
+        if (self._cropped is None or self._cropped.size() != region.size()
+                or self._cropped.format() != screenshot.format()):
+            self._cropped = QImage(region.size(), screenshot.format())
+        painter = QPainter(self._cropped)
+        painter.setCompositionMode(QPainter.CompositionMode.CompositionMode_Source)
+        painter.drawImage(0, 0, screenshot, region.x(), region.y(), region.width(), region.height())
+        painter.end()
+        return self._cropped
+
+    def _close_source(self) -> None:
+        source, self._capture_source = self._capture_source, None
+        if source:
+            source.close()
+
+    def _handle_keyboard_event(self, key_code: int, key_down: bool) -> int:
+        # Map (or drop) the key with the current key table, and send it to the source being broadcast.
+        if key_code < KEY_TABLE_SIZE and (key_code := self._key_table[key_code]):
+            self._source.send_key(key_code, key_down)
+        self._input_serial = (self._input_serial + 1) & 0xFFFFFFFF
+        return self._input_serial
@@ -0,0 +1,131 @@
+from threading import Lock
+
+# Buffers come in a few sizes per power of two (at most 25% bigger than asked for), so frames of a similar size, like
+# successive encoded frames of the same window, share buffers.
+_MIN_CAPACITY = 4096
+
+
+def _capacity_for(size: int) -> int:
+    if size <= _MIN_CAPACITY:
+        return _MIN_CAPACITY
+    step = 1 << (size.bit_length() - 3)
+    return (size + step - 1) // step * step
+
+
+class FrameBuffer:
+    # A buffer from a pool, shared by every stage (and client) using the frame in it. Each holds a reference, and the
+    # buffer goes back to the pool once the last one is released.
+    _pool: "BufferPool"
+    _data: bytearray
+    _length: int
+    _references: int
+
+    def __init__(self, pool: "BufferPool", capacity: int) -> None:
+        self._pool = pool
+        self._data = bytearray(capacity)
+        self._length = 0
+        self._references = 0
+
+    def __len__(self) -> int:
+        return self._length
+
+    @property
+    def capacity(self) -> int:
+        return len(self._data)
+
+    @property
+    def data(self) -> bytearray:
+        # The whole buffer, for filling in place. It's never resized, so it can be wrapped (by a QImage, or ctypes).
+        return self._data
+
+    @property
+    def view(self) -> memoryview:
+        return memoryview(self._data)[:self._length]
+
+    def set_length(self, length: int) -> None:
+        if length > len(self._data):
+            raise ValueError(f"Length {length} is larger than the buffer's capacity {len(self._data)}")
+        self._length = length
+
+    def write(self, data: memoryview) -> None:
+        self.set_length(len(data))
+        self._data[:self._length] = data
+
+    def retain(self) -> None:
+        with self._pool.lock:
+            self._references += 1
+
+    def release(self) -> None:
+        with self._pool.lock:
+            self._references -= 1
+            if self._references == 0:
+                self._pool.recycle(self)
+
+
+class BufferPool:
+    # Preallocated (and then reused) buffers for raw and encoded frames, so frames don't churn the allocator at a steady
+    # frame rate. Up to "max_free" buffers of each size are kept once they're released; a pool with none keeps nothing,
+    # and allocates every buffer.
+    _free: dict[int, list[FrameBuffer]]
+    _max_free: int
+    _lock: Lock
+    _allocations: int
+    _allocated_bytes: int
+    _reuses: int
+
+    def __init__(self, max_free: int = 8) -> None:
+        self._free = {}
+        self._max_free = max_free
+        self._lock = Lock()
+        self._allocations = 0
+        self._allocated_bytes = 0
+        self._reuses = 0
+
+    @property
+    def lock(self) -> Lock:
+        return self._lock
+
+    @property
+    def allocations(self) -> int:
+        return self._allocations
+
+    @property
+    def allocated_bytes(self) -> int:
+        return self._allocated_bytes
+
+    @property
+    def reuses(self) -> int:
+        return self._reuses
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "allocations": self._allocations,
+                "allocated_bytes": self._allocated_bytes,
+                "reuses": self._reuses,
+                "free_bytes": sum(capacity * len(buffers) for capacity, buffers in self._free.items())}
+
+    def acquire(self, size: int) -> FrameBuffer:
+        # The caller holds the only reference to the buffer, of at least "size" bytes, and fills it in.
+        capacity = _capacity_for(size)
+        with self._lock:
+            free = self._free.get(capacity)
+            if free:
+                buffer = free.pop()
+                self._reuses += 1
+            else:
+                buffer = None
+                self._allocations += 1
+                self._allocated_bytes += capacity
+
+        if buffer is None:
+            buffer = FrameBuffer(self, capacity)
+        buffer.set_length(size)
+        buffer.retain()
+        return buffer
+
+    def recycle(self, buffer: FrameBuffer) -> None:
+        # Called (with the lock held) once the buffer's last reference is released.
+        free = self._free.setdefault(buffer.capacity, [])
+        if len(free) < self._max_free:
+            free.append(buffer)
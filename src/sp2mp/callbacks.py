@@ -0,0 +1,26 @@
+from threading import Lock
+from typing import Callable
+
+
+class Callbacks:
+    # A minimal stand-in for a Qt signal, so the networking code doesn't depend on Qt. Callbacks are called on the
+    # emitting thread (like a direct connection), so anything slow should be handed off to another thread.
+    _callbacks: list[Callable[..., None]]
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self._callbacks = []
+        self._lock = Lock()
+
+    def connect(self, callback: Callable[..., None]) -> None:
+        with self._lock:
+            self._callbacks = self._callbacks + [callback]
+
+    def disconnect(self, callback: Callable[..., None]) -> None:
+        with self._lock:
+            self._callbacks = [c for c in self._callbacks if c != callback]
+
+    def emit(self, *args) -> None:
+        # The list is replaced (not modified) on connect and disconnect, so it can be iterated without the lock.
+        for callback in self._callbacks:
+            callback(*args)
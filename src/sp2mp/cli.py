@@ -0,0 +1,219 @@
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import time
+from threading import Event
+from typing import TYPE_CHECKING, Optional
+
+from sp2mp.buffer_pool import FrameBuffer
+from sp2mp.protocol import FrameHeader, FrameType
+from sp2mp.receiver import Receiver
+from sp2mp.stats import StatsEndpoint
+
+if TYPE_CHECKING:
+    from sp2mp.frame_source import FrameSource
+
+
+def _parse_address(text: str) -> tuple[str, int]:
+    host, port = text.rsplit(":", 1)
+    return host, int(port)
+
+
+def _parse_resolution(text: str) -> tuple[int, int]:
+    width, height = text.lower().split("x")
+    return int(width), int(height)
+
+
+def _parse_client(text: str) -> tuple[str, int, Optional[tuple[int, int]]]:
+    # Clients can be given an output resolution, like "HOST:PORT@1280x720".
+    address, _, size = text.partition("@")
+    return *_parse_address(address), _parse_resolution(size) if size else None
+
+
+def _parse_region(text: str) -> tuple[int, int, int, int]:
+    x, y, width, height = map(int, text.split(","))
+    return x, y, width, height
+
+
+def _wait_until_interrupted() -> None:
+    try:
+        Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+def _create_source(args: argparse.Namespace) -> FrameSource:
+    if args.synthetic:
+        from sp2mp.frame_source import SyntheticFrameSource
+        return SyntheticFrameSource(*_parse_resolution(args.synthetic))
+
+    if args.replay:
+        from sp2mp.frame_source import FileFrameSource
+        return FileFrameSource(args.replay)
+
+    # Window capture is only available on Windows, so it's only imported when it's used.
+    import win32gui
+    from sp2mp.screenshotter import WindowCapturer
+
+    hwnd = args.hwnd or win32gui.FindWindow(None, args.window)
+    if not hwnd:
+        raise SystemExit(f"No window titled {args.window!r}")
+    return WindowCapturer(hwnd)
+
+
+def run_server(args: argparse.Namespace) -> None:
+    from sp2mp.broadcaster import Broadcaster
+
+    broadcaster = Broadcaster(
+        _create_source(args), [], [], delta_mode=args.delta, fps=args.fps, adaptive_quality=args.adaptive_quality,
+        input_channel=not args.no_input_channel, encode_workers=args.encode_workers,
+        instrument=args.stats_port is not None)
+    shared_memory = set(map(_parse_address, args.shared_memory))
+    for host, port, output_size in map(_parse_client, args.clients):
+        broadcaster.add_new_client(host, port, output_size=output_size, shared_memory=(host, port) in shared_memory)
+    if args.region:
+        broadcaster.set_capture_region(_parse_region(args.region))
+    endpoint = StatsEndpoint(broadcaster.stats_snapshot, args.stats_port) if args.stats_port is not None else None
+
+    broadcaster.broadcast()
+    _wait_until_interrupted()
+    broadcaster.stop()
+    if endpoint:
+        endpoint.close()
+
+
+class _FrameRecorder:
+    # Counts (and optionally saves) the frames received by a headless client.
+    _directory: Optional[str]
+    frames: int
+    bytes: int
+
+    def __init__(self, directory: Optional[str]) -> None:
+        self._directory = directory
+        self.frames = 0
+        self.bytes = 0
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def on_frame(self, header: FrameHeader, data: FrameBuffer) -> None:
+        if header.frame_type == FrameType.HEARTBEAT:
+            return
+        self.frames += 1
+        self.bytes += len(data)
+
+        # Full frames are already JPEG files, so they're saved without decoding them.
+        if self._directory and header.frame_type == FrameType.IMAGE:
+            with open(os.path.join(self._directory, f"frame_{header.sequence:08d}.jpg"), "wb") as fo:
+                fo.write(data.view)
+
+
+def run_client(args: argparse.Namespace) -> None:
+    receiver = Receiver(args.port, instrument=args.stats_port is not None)
+    recorder = _FrameRecorder(args.record)
+    receiver.frame_received.connect(recorder.on_frame)
+    endpoint = StatsEndpoint(receiver.stats.snapshot, args.stats_port) if args.stats_port is not None else None
+
+    # Without a window to show the frames in, the frame rate and bit rate are printed instead.
+    try:
+        while True:
+            frames, size = recorder.frames, recorder.bytes
+            time.sleep(args.stats_interval)
+            print(
+                f"{(recorder.frames - frames) / args.stats_interval:.1f} fps, "
+                f"{(recorder.bytes - size) * 8 / args.stats_interval / 1e6:.2f} Mbit/s", flush=True)
+    except KeyboardInterrupt:
+        pass
+    receiver.close()
+    if endpoint:
+        endpoint.close()
+
+
+def run_relay(args: argparse.Namespace) -> None:
+    from sp2mp.relay import Relay
+
+    hosts, ports = zip(*map(_parse_address, args.clients))
+    relay = Relay(args.port, list(hosts), list(ports), instrument=args.stats_port is not None)
+    endpoint = StatsEndpoint(relay.stats_snapshot, args.stats_port) if args.stats_port is not None else None
+
+    relay.broadcast()
+    _wait_until_interrupted()
+    relay.stop()
+    if endpoint:
+        endpoint.close()
+
+
+def _build_parser() -> tuple[argparse.ArgumentParser, dict[str, argparse.ArgumentParser]]:
+    parser = argparse.ArgumentParser(description="Run a broadcaster, client or relay without the GUI.")
+    parser.add_argument("--config", help="JSON file of option values (command line options take precedence)")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    server = commands.add_parser("server", help="capture a window and broadcast it")
+    server.add_argument("--window", help="title of the window to capture")
+    server.add_argument("--hwnd", type=int, help="handle of the window to capture")
+    server.add_argument("--synthetic", metavar="WIDTHxHEIGHT", help="broadcast generated test frames")
+    server.add_argument("--replay", nargs="+", metavar="FILE", help="broadcast these image files in a loop")
+    server.add_argument("--region", metavar="X,Y,WIDTH,HEIGHT", help="only broadcast this part of the source")
+    server.add_argument("--fps", type=int, default=60, help="capture frame rate")
+    server.add_argument("--delta", action="store_true", help="only send changed regions")
+    server.add_argument("--adaptive-quality", action="store_true", help="adapt quality to each client's connection")
+    server.add_argument("--encode-workers", type=int, default=0, help="encode on this many worker processes")
+    server.add_argument(
+        "--shared-memory", action="append", default=[], metavar="HOST:PORT",
+        help="send raw frames through shared memory to this client, which must be a viewer on this host")
+    server.add_argument("--no-input-channel", action="store_true", help="take input over the frame connection")
+    server.add_argument(
+        "clients", nargs="*", metavar="HOST:PORT[@WIDTHxHEIGHT]", help="clients to broadcast to, and their resolution")
+    server.add_argument("--stats-port", type=int, help="serve per-stage statistics as JSON on this local port")
+    server.set_defaults(run=run_server)
+
+    client = commands.add_parser("client", help="receive a broadcast")
+    client.add_argument("--port", type=int, help="port to receive the broadcast on")
+    client.add_argument("--record", metavar="DIR", help="save received full frames to this directory")
+    client.add_argument("--stats-interval", type=float, default=5.0, help="seconds between printed statistics")
+    client.add_argument("--stats-port", type=int, help="serve per-stage statistics as JSON on this local port")
+    client.set_defaults(run=run_client)
+
+    relay = commands.add_parser("relay", help="relay a broadcast to more clients")
+    relay.add_argument("--port", type=int, help="port the broadcaster sends the stream to")
+    relay.add_argument("clients", nargs="*", metavar="HOST:PORT", help="clients to send the stream on to")
+    relay.add_argument("--stats-port", type=int, help="serve per-stage statistics as JSON on this local port")
+    relay.set_defaults(run=run_relay)
+
+    return parser, {"server": server, "client": client, "relay": relay}
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    parser, commands = _build_parser()
+
+    # Options from the config file (keyed by their long names) become the defaults, so the command line overrides them.
+    config_parser = argparse.ArgumentParser(add_help=False)
+    config_parser.add_argument("--config")
+    known, _ = config_parser.parse_known_args(argv)
+    if known.config:
+        with open(known.config) as fi:
+            config = {name.replace("-", "_"): value for name, value in json.load(fi).items()}
+        for command in commands.values():
+            command.set_defaults(**config)
+
+    args = parser.parse_args(argv)
+    error = _check_args(args)
+    if error:
+        commands[args.command].error(error)
+    args.run(args)
+
+
+def _check_args(args: argparse.Namespace) -> Optional[str]:
+    # Options that can come from the config file can't be marked as required, so they're checked here instead.
+    if args.command == "server" and sum(map(bool, (args.window, args.hwnd, args.synthetic, args.replay))) != 1:
+        return "exactly one of --window, --hwnd, --synthetic or --replay is required"
+    if args.command in ("client", "relay") and args.port is None:
+        return "--port is required"
+    if args.command == "relay" and not args.clients:
+        return "at least one client is required"
+    return None
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import time
+from collections import deque
+from threading import Condition, Lock, Thread
+from typing import Optional
+
+from PyQt6.QtCore import QObject, QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QImage, QPainter
+
+from sp2mp.buffer_pool import FrameBuffer
+from sp2mp.protocol import FrameFlag, FrameHeader, FrameType, unpack_tiles
+from sp2mp.shm_transport import SharedFrameReader
+from sp2mp.stats import FrameStats
+
+
+class FrameDecoder(QObject):
+    _pending: deque[tuple[FrameHeader, FrameBuffer]]
+    _condition: Condition
+    _thread: Thread
+    _closed: bool
+    _canvas: Optional[QImage]
+    _latest: Optional[tuple[QImage, FrameHeader]]
+    _latest_lock: Lock
+    _notified: bool
+    _target_size: Optional[QSize]
+    _dropped_frames: int
+    _shared_frames: SharedFrameReader
+    _stats: Optional[FrameStats]
+
+    frame_decoded = pyqtSignal()
+
+    def __init__(self) -> None:
+        super().__init__()
+        self._pending = deque()
+        self._condition = Condition()
+        self._closed = False
+        self._canvas = None
+        self._latest = None
+        self._latest_lock = Lock()
+        self._notified = False
+        self._target_size = None
+        self._dropped_frames = 0
+        self._shared_frames = SharedFrameReader()
+        self._stats = None
+
+        self._thread = Thread(target=self._decode_loop)
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def dropped_frames(self) -> int:
+        return self._dropped_frames
+
+    def set_target_size(self, size: QSize) -> None:
+        # Frames are scaled to fit the display on the worker thread too.
+        self._target_size = QSize(size)
+
+    def set_stats(self, stats: Optional[FrameStats]) -> None:
+        # Decode times are added to the receiver's stats, if it's instrumented.
+        self._stats = stats
+
+    def submit(self, header: FrameHeader, data: FrameBuffer) -> None:
+        # Called on the receiver thread. A keyframe replaces the whole canvas, so anything still waiting to be decoded
+        # is stale; delta frames have to be applied in order though. Each frame's buffer is held until it's decoded.
+        if header.frame_type not in (FrameType.IMAGE, FrameType.TILES, FrameType.SHARED):
+            return
+
+        data.retain()
+        with self._condition:
+            if header.flags & FrameFlag.KEYFRAME:
+                self._dropped_frames += len(self._pending)
+                self._release_pending()
+            self._pending.append((header, data))
+            self._condition.notify()
+
+    def take_latest(self) -> Optional[tuple[QImage, FrameHeader]]:
+        # Called on the GUI thread, to get the newest decoded frame and its header (frames decoded in between are never
+        # painted).
+        with self._latest_lock:
+            latest, self._latest = self._latest, None
+            self._notified = False
+        return latest
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify()
+
+    def _decode_loop(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._pending or self._closed)
+                if self._closed:
+                    self._release_pending()
+                    self._shared_frames.close()
+                    return
+                header, data = self._pending.popleft()
+
+            start = time.perf_counter()
+            try:
+                decoded = self._decode(header, data.view)
+            finally:
+                data.release()
+            if not decoded:
+                continue
+
+            # Hand over a (shallow, copy-on-write) copy of the canvas, scaled to fit the display if needed.
+            image = QImage(self._canvas)
+            if self._target_size is not None and not self._target_size.isEmpty():
+                image = image.scaled(
+                    self._target_size, Qt.AspectRatioMode.KeepAspectRatio, Qt.TransformationMode.FastTransformation)
+            if self._stats:
+                self._stats.add("decode", (time.perf_counter() - start) * 1000)
+
+            # Only notify the GUI if it has taken the last frame; otherwise the last frame is just replaced.
+            with self._latest_lock:
+                if self._latest is not None:
+                    self._dropped_frames += 1
+                self._latest = image, header
+                notify, self._notified = not self._notified, True
+            if notify:
+                self.frame_decoded.emit()
+
+    def _release_pending(self) -> None:
+        # Called with the condition held.
+        while self._pending:
+            self._pending.popleft()[1].release()
+
+    def _decode(self, header: FrameHeader, data: memoryview) -> bool:
+        if header.frame_type == FrameType.IMAGE:
+            self._canvas = QImage.fromData(data)
+            return not self._canvas.isNull()
+
+        # Raw frames from a broadcaster on this host are copied straight out of shared memory.
+        if header.frame_type == FrameType.SHARED:
+            image = self._shared_frames.read(data)
+            if image is None:
+                return False
+            self._canvas = image
+            return True
+
+        # Changed tiles are painted over the persistent canvas (waiting for a keyframe if there isn't one yet).
+        width, height, tiles = unpack_tiles(data)
+        if self._canvas is None or (self._canvas.width(), self._canvas.height()) != (width, height):
+            return False
+
+        painter = QPainter(self._canvas)
+        for x, y, tile_data in tiles:
+            painter.drawImage(x, y, QImage.fromData(tile_data.tobytes()))
+        painter.end()
+        return True
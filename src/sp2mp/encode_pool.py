@@ -0,0 +1,122 @@
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from multiprocessing import shared_memory
+from threading import Lock
+from typing import Optional
+
+from PyQt6.QtGui import QImage
+
+from sp2mp.encoder import FrameEncoder, scale_image
+from sp2mp.quality import EncodeSettings
+
+# Shared memory blocks attached in a worker process, by name. Only a few are in use at once, but old ones are kept
+# around (up to a limit) as the parent reuses its blocks for every frame.
+_attached: OrderedDict[str, shared_memory.SharedMemory] = OrderedDict()
+_attached_limit = 32
+_worker_encoder: Optional[FrameEncoder] = None
+
+
+def _encode_shared(
+        name: str, width: int, height: int, bytes_per_line: int, image_format: int, settings: EncodeSettings,
+        output_format: str) -> tuple[bytes, float]:
+    # Runs in a worker process. The frame is read straight out of the shared memory block, rather than being pickled.
+    # The CPU time it took is returned with the encoded frame, as it isn't spent in the broadcaster's process.
+    global _worker_encoder
+    start = time.thread_time()
+    if _worker_encoder is None:
+        _worker_encoder = FrameEncoder(output_format)
+
+    block = _attached.get(name)
+    if block is None:
+        block = _attached[name] = shared_memory.SharedMemory(name)
+        if len(_attached) > _attached_limit:
+            _attached.popitem(last=False)[1].close()
+    _attached.move_to_end(name)
+
+    image = QImage(block.buf, width, height, bytes_per_line, QImage.Format(image_format))
+    data = _worker_encoder.encode(scale_image(image, settings), settings.quality)
+    return data, time.thread_time() - start
+
+
+class EncodePool:
+    # Encodes frames on a pool of worker processes, so encoding isn't limited to one core. Each captured frame is copied
+    # once into a free shared memory slot, which is shared by the frame's encodes and freed when they have all finished.
+    _executor: ProcessPoolExecutor
+    _output_format: str
+    _slots: list[Optional[shared_memory.SharedMemory]]
+    _free_slots: list[int]
+    _slot_users: dict[int, int]
+    _lock: Lock
+    _encode_count: int
+
+    def __init__(self, workers: Optional[int] = None, slots: Optional[int] = None, output_format: str = "JPG") -> None:
+        # Workers are always spawned, like they are on Windows, as forking a process running Qt threads isn't safe.
+        workers = workers or os.cpu_count() or 1
+        self._executor = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        self._output_format = output_format
+
+        # Two frames per worker keeps every worker busy, without letting frames queue up (and go stale).
+        slot_count = slots or workers * 2
+        self._slots = [None] * slot_count
+        self._free_slots = list(range(slot_count))
+        self._slot_users = {}
+        self._lock = Lock()
+        self._encode_count = 0
+
+    @property
+    def encode_count(self) -> int:
+        return self._encode_count
+
+    @property
+    def has_free_slot(self) -> bool:
+        return bool(self._free_slots)
+
+    def submit(self, image: QImage, settings: list[EncodeSettings]) -> Optional[list[Future[tuple[bytes, float]]]]:
+        # Start encoding the frame once per settings. None is returned if every slot is in use. Each future gives the
+        # encoded frame, and the worker's CPU time (in seconds).
+        with self._lock:
+            if not self._free_slots:
+                return None
+            slot = self._free_slots.pop()
+            self._slot_users[slot] = len(settings)
+
+        # Slots only grow, so they're reallocated rarely (like when the window is first captured, or resized).
+        size = image.sizeInBytes()
+        block = self._slots[slot]
+        if block is None or block.size < size:
+            if block is not None:
+                block.close()
+                block.unlink()
+            block = self._slots[slot] = shared_memory.SharedMemory(create=True, size=size)
+
+        bits = image.constBits()
+        bits.setsize(size)
+        block.buf[:size] = bits
+
+        futures = []
+        for frame_settings in settings:
+            future = self._executor.submit(
+                _encode_shared, block.name, image.width(), image.height(), image.bytesPerLine(), image.format().value,
+                frame_settings, self._output_format)
+            future.add_done_callback(lambda _: self._release(slot))
+            futures.append(future)
+        return futures
+
+    def close(self) -> None:
+        self._executor.shutdown(cancel_futures=True)
+        for block in self._slots:
+            if block is not None:
+                block.close()
+                block.unlink()
+        self._slots = [None] * len(self._slots)
+
+    def _release(self, slot: int) -> None:
+        with self._lock:
+            self._encode_count += 1
+            self._slot_users[slot] -= 1
+            if not self._slot_users[slot]:
+                del self._slot_users[slot]
+                self._free_slots.append(slot)
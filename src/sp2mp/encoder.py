@@ -0,0 +1,167 @@
+import zlib
+from threading import Lock, local
+from typing import Optional
+
+from PyQt6.QtCore import QBuffer, QByteArray, Qt
+from PyQt6.QtGui import QImage
+
+from sp2mp.buffer_pool import BufferPool, FrameBuffer
+from sp2mp.protocol import FrameFlag, FrameType, pack_tiles
+from sp2mp.quality import EncodeSettings
+
+
+def output_size(width: int, height: int, settings: EncodeSettings) -> tuple[int, int]:
+    # Frames are never scaled up, only down to fit the client's output resolution, and then by the quality's scale.
+    scale = min(settings.scale, 1.0)
+    if settings.output_size:
+        scale *= min(1.0, settings.output_size[0] / width, settings.output_size[1] / height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def scale_image(image: QImage, settings: EncodeSettings) -> QImage:
+    w, h = output_size(image.width(), image.height(), settings)
+    if (w, h) == (image.width(), image.height()):
+        return image
+    return image.scaled(w, h, Qt.AspectRatioMode.IgnoreAspectRatio, Qt.TransformationMode.SmoothTransformation)
+
+
+class ScaledFrames:
+    # One captured frame, scaled once per distinct output size, however many streams (at different qualities, or
+    # frame rates) are sent that size.
+    _image: QImage
+    _scaled: dict[tuple[int, int], QImage]
+
+    def __init__(self, image: QImage) -> None:
+        self._image = image
+        self._scaled = {}
+
+    def get(self, settings: EncodeSettings) -> QImage:
+        size = output_size(self._image.width(), self._image.height(), settings)
+        if size not in self._scaled:
+            self._scaled[size] = scale_image(self._image, settings)
+        return self._scaled[size]
+
+
+class FrameEncoder:
+    _image_format: str
+    _encode_count: int
+    _lock: Lock
+    _local: local
+
+    def __init__(self, image_format: str = "JPG") -> None:
+        self._image_format = image_format
+        self._encode_count = 0
+        self._lock = Lock()
+        self._local = local()
+
+    @property
+    def encode_count(self) -> int:
+        return self._encode_count
+
+    def encode(self, image: QImage, quality: int = -1) -> bytes:
+        with self._serialize(image, quality) as data:
+            return bytes(data)
+
+    def encode_into(self, pool: BufferPool, image: QImage, quality: int = -1) -> FrameBuffer:
+        # Serialize the image once, into a pooled buffer; the buffer is shared by every client the frame is sent to.
+        with self._serialize(image, quality) as data:
+            buffer = pool.acquire(len(data))
+            buffer.write(data)
+        return buffer
+
+    def _serialize(self, image: QImage, quality: int) -> memoryview:
+        # Each thread serializes into its own byte array, which keeps its capacity between frames. The view must be
+        # released before the thread's next encode, which may grow the array.
+        if not hasattr(self._local, "buffer"):
+            self._local.data = QByteArray()
+            self._local.buffer = QBuffer(self._local.data)
+            self._local.buffer.open(QBuffer.OpenModeFlag.WriteOnly)
+
+        buffer = self._local.buffer
+        buffer.seek(0)
+        image.save(buffer, self._image_format, quality)
+
+        with self._lock:
+            self._encode_count += 1
+        return memoryview(self._local.data)[:buffer.pos()]
+
+
+def frame_checksum(image: QImage) -> tuple[int, int, int]:
+    # A crc32 over the raw bitmap bits is far cheaper than encoding (and sending) an identical frame.
+    bits = image.constBits()
+    bits.setsize(image.sizeInBytes())
+    return image.width(), image.height(), zlib.crc32(bits)
+
+
+class FrameChangeDetector:
+    _previous_checksum: Optional[tuple[int, int, int]]
+
+    def __init__(self) -> None:
+        self._previous_checksum = None
+
+    def reset(self) -> None:
+        self._previous_checksum = None
+
+    def has_changed(self, checksum: tuple[int, int, int]) -> bool:
+        changed = checksum != self._previous_checksum
+        self._previous_checksum = checksum
+        return changed
+
+
+class DeltaEncoder:
+    _encoder: FrameEncoder
+    _settings: EncodeSettings
+    _tile_size: int
+    _keyframe_interval: int
+    _previous_tiles: dict[tuple[int, int], QImage]
+    _previous_size: Optional[tuple[int, int]]
+    _frames_since_keyframe: int
+    _keyframe_requested: bool
+
+    def __init__(
+            self, encoder: FrameEncoder, settings: EncodeSettings = EncodeSettings(), tile_size: int = 128,
+            keyframe_interval: int = 120) -> None:
+        self._encoder = encoder
+        self._settings = settings
+        self._tile_size = tile_size
+        self._keyframe_interval = keyframe_interval
+        self._previous_tiles = {}
+        self._previous_size = None
+        self._frames_since_keyframe = 0
+        self._keyframe_requested = True
+
+    def request_keyframe(self) -> None:
+        self._keyframe_requested = True
+
+    def encode(self, image: QImage) -> tuple[FrameType, FrameFlag, bytes]:
+        # The image has already been scaled to the stream's output size, so tiles line up with the receiver's canvas.
+        w, h = image.width(), image.height()
+
+        # Compare each tile against the same tile of the previous frame.
+        changed_tiles = []
+        tiles = {}
+        for y in range(0, h, self._tile_size):
+            for x in range(0, w, self._tile_size):
+                tile = image.copy(x, y, min(self._tile_size, w - x), min(self._tile_size, h - y))
+                tiles[x, y] = tile
+                if tile != self._previous_tiles.get((x, y)):
+                    changed_tiles.append((x, y, tile))
+        self._previous_tiles = tiles
+
+        # Send a full keyframe periodically, on request, on resize, or when most of the frame has changed anyway.
+        keyframe = (
+            self._keyframe_requested
+            or self._previous_size != (w, h)
+            or self._frames_since_keyframe >= self._keyframe_interval
+            or len(changed_tiles) * 2 > len(tiles))
+        self._previous_size = w, h
+
+        if keyframe:
+            self._keyframe_requested = False
+            self._frames_since_keyframe = 0
+            return FrameType.IMAGE, FrameFlag.KEYFRAME, self._encoder.encode(image, self._settings.quality)
+
+        # Otherwise, only send the tiles that have changed.
+        self._frames_since_keyframe += 1
+        encoded_tiles = [(x, y, self._encoder.encode(tile, self._settings.quality)) for x, y, tile in changed_tiles]
+        return FrameType.TILES, FrameFlag.NONE, pack_tiles(w, h, encoded_tiles)
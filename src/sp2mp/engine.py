@@ -0,0 +1,51 @@
+import asyncio
+from concurrent.futures import Future
+from threading import Lock, Thread
+from typing import Any, Coroutine, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class NetworkEngine:
+    # One asyncio event loop, on its own thread, runs the networking for every broadcaster, receiver and client in the
+    # process, so the number of threads doesn't grow with the number of connections.
+    _loop: asyncio.AbstractEventLoop
+    _thread: Thread
+
+    def __init__(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._thread = Thread(target=self._run, name="sp2mp-network")
+        self._thread.daemon = True
+        self._thread.start()
+
+    @property
+    def loop(self) -> asyncio.AbstractEventLoop:
+        return self._loop
+
+    def submit(self, coroutine: Coroutine[Any, Any, T]) -> Future[T]:
+        # Run a coroutine on the engine's loop, from any other thread.
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop)
+
+    def run(self, coroutine: Coroutine[Any, Any, T], timeout: Optional[float] = None) -> T:
+        # Run a coroutine on the engine's loop, and block the calling (non-engine) thread until it has finished.
+        return self.submit(coroutine).result(timeout)
+
+    def call_soon(self, callback, *args) -> None:
+        self._loop.call_soon_threadsafe(callback, *args)
+
+    def _run(self) -> None:
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+
+_engine: Optional[NetworkEngine] = None
+_engine_lock = Lock()
+
+
+def get_engine() -> NetworkEngine:
+    # The engine is started the first time it's needed, and shared from then on.
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = NetworkEngine()
+        return _engine
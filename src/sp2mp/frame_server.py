@@ -0,0 +1,367 @@
+import asyncio
+import logging
+import secrets
+import time
+from collections import deque
+from concurrent.futures import Future
+from dataclasses import dataclass, field, replace
+from threading import Event, Lock
+from typing import Optional
+
+from sp2mp.engine import NetworkEngine, get_engine
+from sp2mp.frame_slot import FrameSlot
+from sp2mp.input_channel import InputChannelServer
+from sp2mp.protocol import FRAME_TIMINGS, INPUT_CHANNEL, INPUT_ECHO, EventFlag, EventProtocol, EventRecord, FrameFlag, FrameHeader, \
+    FrameType, Packet, read_event_records
+from sp2mp.quality import EncodeSettings, QualityController
+from sp2mp.stats import FrameStats, StageTimes
+
+_logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Client:
+    host: str
+    port: int
+    frame_depth: int = 1
+    fps: Optional[int] = None
+    settings: EncodeSettings = field(default_factory=EncodeSettings)
+    shared_memory: bool = False
+    queue: FrameSlot[Packet] = field(init=False)
+    controller: Optional[QualityController] = field(init=False, default=None)
+    frames_sent: int = field(init=False, default=0)
+    frames_acked: int = field(init=False, default=0)
+    client_id: int = field(init=False, default_factory=lambda: secrets.randbits(32))
+    last_input_sequence: Optional[int] = field(init=False, default=None)
+    stats: Optional[FrameStats] = field(init=False, default=None)
+    applied_inputs: deque[tuple[int, int]] = field(init=False, default_factory=deque)
+    input_echo: int = field(init=False, default=0)
+    bytes_written: int = field(init=False, default=0)
+    unflushed: deque[tuple[int, Packet]] = field(init=False, default_factory=deque)
+    wakeup: Optional[asyncio.Event] = field(init=False, default=None)
+    writer: Optional[asyncio.StreamWriter] = field(init=False, default=None)
+    task: Optional[asyncio.Task] = field(init=False, default=None)
+
+    def __post_init__(self) -> None:
+        # Only the newest "frame_depth" frames are kept, so slow clients can't grow memory without bound.
+        self.queue = FrameSlot(self.frame_depth, Packet.release)
+
+    def release_flushed(self) -> None:
+        # The transport may still be sending from a packet's buffer after it's written, so each packet is only released
+        # once everything up to its end has gone.
+        flushed = self.bytes_written - self.writer.transport.get_write_buffer_size()
+        while self.unflushed and self.unflushed[0][0] <= flushed:
+            self.unflushed.popleft()[1].release()
+
+    @property
+    def dropped_frames(self) -> int:
+        return self.queue.dropped_frames
+
+
+@dataclass
+class Stream:
+    # Clients sharing a frame rate, encode settings and transport are sent the same frames.
+    fps: int
+    settings: EncodeSettings
+    shared_memory: bool = False
+    clients: list[Client] = field(default_factory=list)
+
+    def request_keyframe(self) -> None:
+        pass
+
+
+class FrameServer:
+    # Sends frames to clients, and handles their acknowledgements and input, all on the network engine's loop. Where the
+    # frames come from (capturing and encoding, or another server) is up to the subclass. Nothing here depends on Qt.
+    _clients: list[Client]
+    _clients_by_id: dict[int, Client]
+    _streams: dict[tuple[int, EncodeSettings, bool], Stream]
+    _engine: NetworkEngine
+    _broadcast_future: Optional[Future]
+    _lock: Lock
+    _fps: int
+    _adaptive_quality: bool
+    _stage_times: StageTimes
+    _stopped: Event
+    _use_input_channel: bool
+    _input_server: Optional[InputChannelServer]
+    _instrument: bool
+
+    def __init__(
+            self, hosts: list[str], ports: list[int], fps: int = 60, adaptive_quality: bool = False,
+            input_channel: bool = True, instrument: bool = False) -> None:
+        self._clients = []
+        self._clients_by_id = {}
+        self._streams = {}
+        self._engine = get_engine()
+        self._broadcast_future = None
+        self._lock = Lock()
+        self._fps = fps
+        self._adaptive_quality = adaptive_quality
+        self._stage_times = StageTimes()
+        self._stopped = Event()
+        self._use_input_channel = input_channel
+        self._input_server = None
+        self._instrument = instrument
+
+        for host, port in zip(hosts, ports):
+            self._add_client(Client(host, port))
+
+    @property
+    def stage_times(self) -> StageTimes:
+        return self._stage_times
+
+    def stats_snapshot(self) -> dict:
+        # Per-client counters and stage histograms (if instrumented), for the stats endpoint.
+        clients = {}
+        for client in list(self._clients):
+            clients[f"{client.host}:{client.port}"] = {
+                "frames_sent": client.frames_sent,
+                "frames_acked": client.frames_acked,
+                "dropped_frames": client.dropped_frames,
+                "quality": client.settings.quality,
+                "scale": client.settings.scale,
+                "output_size": client.settings.output_size,
+                **(client.stats.snapshot() if client.stats else {})}
+        return {"clients": clients}
+
+    def add_new_client(
+            self, host: str, port: int, auto_broadcast: bool = False, frame_depth: int = 1, fps: Optional[int] = None,
+            output_size: Optional[tuple[int, int]] = None, shared_memory: bool = False) -> None:
+        # Clients with a smaller output size (like spectators on small screens) are sent downscaled frames. Clients on
+        # this host that can read shared memory (like a viewer, but not a relay or a recorder) can opt in to it.
+        client = Client(host, port, frame_depth, fps, EncodeSettings(output_size=output_size), shared_memory)
+        self._add_client(client)
+        if auto_broadcast:
+            self._engine.call_soon(self._start_client, client)
+
+    def broadcast(self) -> None:
+        self._broadcast_future = self._engine.submit(self._broadcast())
+        self._broadcast_future.add_done_callback(self._broadcast_finished)
+
+    def stop(self) -> None:
+        # The broadcast loop notices on its next tick, and closes every connection before finishing.
+        self._stopped.set()
+        if self._broadcast_future:
+            self._broadcast_future.result()
+
+    @staticmethod
+    def _broadcast_finished(future: Future) -> None:
+        # Log a broadcast that failed straight away, rather than only when it's stopped.
+        if not future.cancelled() and (error := future.exception()):
+            _logger.error("Broadcasting failed", exc_info=error)
+
+    def _add_client(self, client: Client) -> None:
+        # Adaptive clients start part way down the quality ladder, and are moved as their connection allows.
+        if self._adaptive_quality and not client.shared_memory:
+            client.controller = QualityController(self._client_fps(client))
+            client.settings = replace(client.controller.settings, output_size=client.settings.output_size)
+        if self._instrument:
+            client.stats = FrameStats()
+
+        self._clients.append(client)
+        self._clients_by_id[client.client_id] = client
+        self._stream_for(client).clients.append(client)
+
+    def _move_client(self, client: Client, settings: EncodeSettings) -> None:
+        # The quality ladder doesn't change the client's output size.
+        self._stream_for(client).clients.remove(client)
+        client.settings = replace(settings, output_size=client.settings.output_size)
+
+        stream = self._stream_for(client)
+        stream.clients.append(client)
+        stream.request_keyframe()
+
+    def _client_fps(self, client: Client) -> int:
+        # Clients can run slower than the capture rate, but not faster.
+        return min(client.fps or self._fps, self._fps)
+
+    def _stream_for(self, client: Client) -> Stream:
+        key = self._client_fps(client), client.settings, client.shared_memory
+        with self._lock:
+            if key not in self._streams:
+                self._streams[key] = self._create_stream(*key)
+            return self._streams[key]
+
+    def _create_stream(self, fps: int, settings: EncodeSettings, shared_memory: bool) -> Stream:
+        return Stream(fps, settings, shared_memory)
+
+    def _start_client(self, client: Client) -> None:
+        # Each client is served by a task on the network engine's loop, rather than its own threads.
+        client.wakeup = asyncio.Event()
+        client.task = asyncio.create_task(self._serve_client(client))
+
+    async def _broadcast(self) -> None:
+        # Input events get their own sockets, so key presses aren't queued behind frame data.
+        if self._use_input_channel:
+            self._input_server = InputChannelServer(self._handle_input_records)
+            await self._input_server.start()
+
+        for client in self._clients:
+            self._start_client(client)
+
+        try:
+            await self._produce_frames()
+        finally:
+            await self._shutdown()
+
+    async def _produce_frames(self) -> None:
+        # By default, frames are pushed in from elsewhere (with "_deliver") until the server is stopped.
+        while not self._stopped.is_set():
+            await asyncio.sleep(0.1)
+
+    async def _shutdown(self) -> None:
+        if self._input_server:
+            self._input_server.close()
+
+        # Wake up the client tasks, which finish once their queues are closed, and close their connections.
+        for client in self._clients:
+            client.queue.close()
+            if client.wakeup:
+                client.wakeup.set()
+            if client.writer:
+                client.writer.close()
+        await asyncio.gather(*(client.task for client in self._clients if client.task), return_exceptions=True)
+
+    def _deliver(self, packets: list[tuple[Stream, Packet]]) -> None:
+        for stream, packet in packets:
+            for client in list(stream.clients):
+                # Heartbeats are only sent to idle clients, so they never replace a real frame.
+                if packet.header.frame_type == FrameType.HEARTBEAT:
+                    if len(client.queue):
+                        continue
+                    client.queue.put(packet)
+
+                # Each client holds its own reference to the frame until it has been sent (or dropped). A delta frame
+                # can't be applied if the frame before it was dropped, so resync with a keyframe.
+                else:
+                    packet.retain()
+                    if client.queue.put(packet) and packet.header.frame_type == FrameType.TILES:
+                        self._request_keyframe(stream)
+
+                if client.wakeup:
+                    client.wakeup.set()
+
+    async def _serve_client(self, client: Client) -> None:
+        # asyncio already disables Nagle's algorithm on TCP connections, so small frames aren't held back.
+        try:
+            reader, client.writer = await asyncio.open_connection(client.host, client.port)
+        except OSError:
+            return
+
+        # Tell the client where to send its input events.
+        server = self._input_server
+        hello = INPUT_CHANNEL.pack(client.client_id, server.udp_port if server else 0, server.tcp_port if server else 0)
+        header = FrameHeader(FrameType.HELLO, FrameFlag.NONE, 0, time.time_ns(), len(hello))
+        client.writer.write(header.pack() + hello)
+
+        self._client_connected(client)
+
+        # Receive frame acknowledgements (and input events, if the client has no input channel) alongside the frames.
+        events = asyncio.create_task(
+            read_event_records(reader, lambda records: self._handle_event_records(client, records)))
+        try:
+            await self._send_frames(client)
+        finally:
+            events.cancel()
+            client.writer.close()
+            while client.unflushed:
+                client.unflushed.popleft()[1].release()
+
+    def _client_connected(self, client: Client) -> None:
+        # A newly connected client has nothing to display (or apply deltas to) yet.
+        self._request_keyframe(self._stream_for(client))
+
+    def _request_keyframe(self, stream: Stream) -> None:
+        stream.request_keyframe()
+
+    async def _send_frames(self, client: Client) -> None:
+        while True:
+            packet = client.queue.get(timeout=0)
+            if packet is None:
+                if client.queue.closed:
+                    return
+                client.wakeup.clear()
+                await client.wakeup.wait()
+                continue
+
+            # The header and the shared encoded frame go out in one scatter write, without being joined first.
+            start, cpu_start = time.perf_counter(), time.thread_time()
+            sent = self._write_packet(client, packet)
+            client.unflushed.append((client.bytes_written, packet))
+            self._stage_times.add("send", time.thread_time() - cpu_start)
+            try:
+                await client.writer.drain()
+            except OSError:
+                return
+            client.release_flushed()
+            client.frames_sent += 1
+
+            # How long the frame waited to be sent (since it was captured), and how long sending it took.
+            if client.stats and packet.header.frame_type != FrameType.HEARTBEAT:
+                client.stats.add_frame(len(packet.payload))
+                client.stats.add("wait", (sent - packet.header.timestamp) / 1e6)
+                client.stats.add("send", (time.perf_counter() - start) * 1000)
+
+            # Step the client's quality up or down, based on how well it's keeping up.
+            if client.controller:
+                in_flight = client.frames_sent - client.frames_acked
+                settings = client.controller.update(time.perf_counter() - start, in_flight, client.dropped_frames)
+                if settings:
+                    self._move_client(client, settings)
+
+    @staticmethod
+    def _write_packet(client: Client, packet: Packet) -> int:
+        # Frame timings and input echoes are written separately for each client, as they include when the frame was sent
+        # to that client, and that client's input. Returns when the frame was sent.
+        sent = time.time_ns()
+        if not packet.header.flags & (FrameFlag.TIMINGS | FrameFlag.INPUT_ECHO):
+            client.writer.writelines((packet.raw_header, packet.payload))
+            client.bytes_written += len(packet.raw_header) + len(packet.payload)
+            return sent
+
+        parts = [packet.raw_header]
+        if packet.header.flags & FrameFlag.TIMINGS:
+            parts.append(FRAME_TIMINGS.pack(packet.header.encoded, sent))
+        if packet.header.flags & FrameFlag.INPUT_ECHO:
+            # Echo the client's latest input applied before the frame was captured.
+            applied = client.applied_inputs
+            while applied and (packet.input_serial - applied[0][0]) & 0xFFFFFFFF < 0x80000000:
+                client.input_echo = applied.popleft()[1]
+            parts.append(INPUT_ECHO.pack(client.input_echo))
+        parts.append(packet.payload)
+        client.writer.writelines(parts)
+        client.bytes_written += sum(map(len, parts))
+        return sent
+
+    def _handle_input_records(self, client_id: int, host: str, records: memoryview) -> None:
+        # Only accept input from the client's own address.
+        client = self._clients_by_id.get(client_id)
+        if client is None or client.writer is None or client.writer.get_extra_info("peername")[0] != host:
+            return
+        self._handle_event_records(client, records)
+
+    def _handle_event_records(self, client: Client, records: memoryview) -> None:
+        for event_type, flags, key_code, sequence, timestamp in EventRecord.STRUCT.iter_unpack(records):
+            if event_type == EventProtocol.KEYBOARD:
+                # Input datagrams repeat recent events, so skip any that have already been applied.
+                last = client.last_input_sequence
+                if last is not None and not 0 < (sequence - last) & 0xFFFFFFFF < 0x80000000:
+                    continue
+                client.last_input_sequence = sequence
+                serial = self._handle_keyboard_event(key_code, bool(flags & EventFlag.KEY_DOWN))
+
+                # Remember which of the server's inputs this was, so frames captured after it can echo it back.
+                if self._instrument:
+                    client.applied_inputs.append((serial, sequence))
+
+            elif event_type == EventProtocol.ACK:
+                client.frames_acked += 1
+
+            elif event_type == EventProtocol.KEYFRAME_REQUEST:
+                self._request_keyframe(self._stream_for(client))
+
+    def _handle_keyboard_event(self, key_code: int, key_down: bool) -> int:
+        # Servers without anywhere to send input ignore key events. Returns the input's serial number, which increases
+        # (modulo 2^32) with every input applied.
+        return 0
@@ -0,0 +1,76 @@
+from collections import deque
+from threading import Condition
+from typing import Callable, Generic, Iterable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class FrameSlot(Generic[T]):
+    _frames: deque[T]
+    _condition: Condition
+    _depth: int
+    _closed: bool
+    _dropped_frames: int
+    _discard: Optional[Callable[[T], None]]
+
+    def __init__(self, depth: int = 1, discard: Optional[Callable[[T], None]] = None) -> None:
+        if depth < 1:
+            raise ValueError(f"Frame slot depth must be at least 1, got {depth}")
+
+        self._frames = deque()
+        self._condition = Condition()
+        self._depth = depth
+        self._closed = False
+        self._dropped_frames = 0
+
+        # Called with every frame that's dropped (or cleared) rather than taken, so pooled buffers can be released.
+        self._discard = discard
+
+    @property
+    def depth(self) -> int:
+        return self._depth
+
+    @property
+    def dropped_frames(self) -> int:
+        return self._dropped_frames
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+    def put(self, frame: T) -> bool:
+        # Add the newest frame, dropping the oldest one if the slot is full.
+        with self._condition:
+            if self._closed:
+                self._discard_frames([frame])
+                return False
+
+            dropped = len(self._frames) >= self._depth
+            if dropped:
+                self._discard_frames([self._frames.popleft()])
+                self._dropped_frames += 1
+
+            self._frames.append(frame)
+            self._condition.notify()
+            return dropped
+
+    def get(self, timeout: Optional[float] = None) -> Optional[T]:
+        # Wait for a frame; None is returned once the slot is closed (or the timeout expires).
+        with self._condition:
+            self._condition.wait_for(lambda: self._frames or self._closed, timeout)
+            return self._frames.popleft() if self._frames else None
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._discard_frames(self._frames)
+            self._frames.clear()
+            self._condition.notify_all()
+
+    def _discard_frames(self, frames: Iterable[T]) -> None:
+        if self._discard:
+            for frame in frames:
+                self._discard(frame)
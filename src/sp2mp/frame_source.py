@@ -0,0 +1,129 @@
+from abc import ABC, abstractmethod
+from typing import Sequence
+
+from PyQt6.QtGui import QColor, QImage, QLinearGradient, QPainter
+
+
+class FrameSource(ABC):
+    @abstractmethod
+    def capture(self) -> QImage:
+        # The returned image may share a buffer that is reused by the next capture, so it must be consumed (or
+        # copied) before capturing again.
+        ...
+
+    def send_key(self, key_code: int, key_down: bool) -> None:
+        # Sources that can't receive input ignore key events.
+        pass
+
+    def close(self) -> None:
+        pass
+
+    def __enter__(self) -> "FrameSource":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class SyntheticFrameSource(FrameSource):
+    _width: int
+    _height: int
+    _change_rate: float
+    _sprite_count: int
+    _sprite_size: int
+    _background: QImage
+    _canvas: QImage
+    _phase: float
+    _tick: int
+    _inputs: int
+    _drawn_inputs: int
+
+    def __init__(
+            self, width: int = 1280, height: int = 720, change_rate: float = 1.0, sprite_count: int = 2,
+            sprite_size: int = 64) -> None:
+        self._width = width
+        self._height = height
+        self._change_rate = change_rate
+        self._sprite_count = sprite_count
+        self._sprite_size = sprite_size
+        self._phase = 0.0
+        self._tick = 0
+        self._inputs = 0
+        self._drawn_inputs = 0
+
+        # A static background, like most of a 2D game's scene, with a few sprites moving over it.
+        self._background = QImage(width, height, QImage.Format.Format_ARGB32)
+        gradient = QLinearGradient(0, 0, width, height)
+        gradient.setColorAt(0, QColor(30, 60, 120))
+        gradient.setColorAt(1, QColor(200, 160, 80))
+        painter = QPainter(self._background)
+        painter.fillRect(0, 0, width, height, gradient)
+        painter.end()
+
+        self._canvas = self._background.copy()
+        self._draw()
+
+    @property
+    def tick(self) -> int:
+        return self._tick
+
+    def capture(self) -> QImage:
+        # Only "change_rate" of the frames move the animation on, so the same sequence is produced on every run. Input
+        # always changes the next frame, like it would in a game.
+        self._phase += self._change_rate
+        if self._phase >= 1 or self._inputs != self._drawn_inputs:
+            if self._phase >= 1:
+                self._phase -= int(self._phase)
+                self._tick += 1
+            self._draw()
+        return self._canvas
+
+    def send_key(self, key_code: int, key_down: bool) -> None:
+        # Called on the network thread; the input is drawn on the next capture.
+        self._inputs += 1
+
+    def _draw(self) -> None:
+        painter = QPainter(self._canvas)
+        painter.drawImage(0, 0, self._background)
+        for i in range(self._sprite_count):
+            x, y = self._sprite_position(i)
+            painter.fillRect(x, y, self._sprite_size, self._sprite_size, QColor.fromHsv((i * 67) % 360, 200, 240))
+
+        # A "player" that moves along the top edge with each input.
+        self._drawn_inputs = self._inputs
+        step = max(1, self._sprite_size // 4)
+        x = (self._drawn_inputs * step) % max(1, self._width - step)
+        painter.fillRect(x, 0, step, step, QColor(255, 255, 255))
+        painter.end()
+
+    def _sprite_position(self, i: int) -> tuple[int, int]:
+        # Each sprite bounces around the frame at its own speed.
+        span_x = max(1, self._width - self._sprite_size)
+        span_y = max(1, self._height - self._sprite_size)
+        x = (self._tick * (3 + i) + i * 97) % (2 * span_x)
+        y = (self._tick * (2 + i) + i * 53) % (2 * span_y)
+        return min(x, 2 * span_x - x), min(y, 2 * span_y - y)
+
+
+class FileFrameSource(FrameSource):
+    _frames: list[QImage]
+    _index: int
+
+    def __init__(self, paths: Sequence[str]) -> None:
+        # Frames are loaded (and converted to the capture format) up front, so replaying them costs nothing.
+        self._frames = []
+        for path in paths:
+            image = QImage(path)
+            if image.isNull():
+                raise ValueError(f"Could not load frame from {path}")
+            self._frames.append(image.convertToFormat(QImage.Format.Format_ARGB32))
+
+        if not self._frames:
+            raise ValueError("At least one frame is needed to replay")
+        self._index = 0
+
+    def capture(self) -> QImage:
+        # Replay the frames in a loop.
+        frame = self._frames[self._index]
+        self._index = (self._index + 1) % len(self._frames)
+        return frame
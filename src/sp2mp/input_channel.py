@@ -0,0 +1,161 @@
+import asyncio
+import socket
+import time
+from collections import deque
+from threading import Lock
+from typing import Callable, Optional
+
+from sp2mp.protocol import INPUT_CHANNEL, INPUT_DATAGRAM_HEADER, EventRecord, read_event_records
+
+
+class _InputDatagramProtocol(asyncio.DatagramProtocol):
+    _handler: Callable[[int, str, memoryview], None]
+
+    def __init__(self, handler: Callable[[int, str, memoryview], None]) -> None:
+        self._handler = handler
+
+    def datagram_received(self, data: bytes, address: tuple[str, int]) -> None:
+        if len(data) < INPUT_DATAGRAM_HEADER.size:
+            return
+
+        # Ignore any trailing partial record in a malformed datagram.
+        client_id, = INPUT_DATAGRAM_HEADER.unpack_from(data)
+        start = INPUT_DATAGRAM_HEADER.size
+        end = start + (len(data) - start) // EventRecord.STRUCT.size * EventRecord.STRUCT.size
+        self._handler(client_id, address[0], memoryview(data)[start:end])
+
+
+class InputChannelServer:
+    # Receives input events on their own sockets, so they are never queued behind frame data. UDP is preferred, with a
+    # TCP listener as the fallback for clients that can't use it. Both are served by the network engine's loop.
+    _udp_transport: Optional[asyncio.DatagramTransport]
+    _tcp_server: Optional[asyncio.Server]
+    _handler: Callable[[int, str, memoryview], None]
+    _host: str
+
+    def __init__(self, handler: Callable[[int, str, memoryview], None], host: str = "0.0.0.0") -> None:
+        self._handler = handler
+        self._host = host
+        self._udp_transport = None
+        self._tcp_server = None
+
+    @property
+    def udp_port(self) -> int:
+        return self._udp_transport.get_extra_info("sockname")[1] if self._udp_transport else 0
+
+    @property
+    def tcp_port(self) -> int:
+        return self._tcp_server.sockets[0].getsockname()[1] if self._tcp_server else 0
+
+    async def start(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            self._udp_transport, _ = await loop.create_datagram_endpoint(
+                lambda: _InputDatagramProtocol(self._handler), local_addr=(self._host, 0))
+        except OSError:
+            self._udp_transport = None
+
+        try:
+            self._tcp_server = await asyncio.start_server(self._handle_connection, self._host, 0)
+        except OSError:
+            self._tcp_server = None
+
+    def close(self) -> None:
+        if self._udp_transport:
+            self._udp_transport.close()
+        if self._tcp_server:
+            self._tcp_server.close()
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # The connection starts with the client's input channel id, followed by a stream of event records.
+        host = writer.get_extra_info("peername")[0]
+        try:
+            client_id, = INPUT_DATAGRAM_HEADER.unpack(await reader.readexactly(INPUT_DATAGRAM_HEADER.size))
+        except (asyncio.IncompleteReadError, OSError):
+            writer.close()
+            return
+
+        await read_event_records(reader, lambda records: self._handler(client_id, host, records))
+        writer.close()
+
+
+class InputChannelClient:
+    _client_id: int
+    _socket: socket.socket
+    _is_udp: bool
+    _recent_records: deque[bytes]
+    _last_event: float
+    _resend_window: float
+    _lock: Lock
+
+    def __init__(
+            self, client_id: int, sock: socket.socket, is_udp: bool, redundancy: int = 4,
+            resend_window: float = 0.25) -> None:
+        self._client_id = client_id
+        self._socket = sock
+        self._is_udp = is_udp
+        self._recent_records = deque(maxlen=redundancy)
+        self._last_event = 0.0
+        self._resend_window = resend_window
+        self._lock = Lock()
+
+    @classmethod
+    async def connect(cls, host: str, hello: bytes, timeout: float = 2.0) -> Optional["InputChannelClient"]:
+        # Use the server's UDP port if possible, otherwise fall back to a separate TCP connection without Nagle. Called
+        # on the network engine's loop, so the TCP connection is made without blocking it (giving up after "timeout" s).
+        client_id, udp_port, tcp_port = INPUT_CHANNEL.unpack(hello)
+        if udp_port:
+            try:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+                sock.connect((host, udp_port))
+                return cls(client_id, sock, True)
+            except OSError:
+                pass
+
+        if tcp_port:
+            loop = asyncio.get_running_loop()
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.setblocking(False)
+            try:
+                await asyncio.wait_for(loop.sock_connect(sock, (host, tcp_port)), timeout)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                await loop.sock_sendall(sock, INPUT_DATAGRAM_HEADER.pack(client_id))
+            except (OSError, asyncio.TimeoutError):
+                sock.close()
+            else:
+                # Events are then sent from any thread, so the socket goes back to blocking.
+                sock.setblocking(True)
+                return cls(client_id, sock, False)
+
+        return None
+
+    @property
+    def is_udp(self) -> bool:
+        return self._is_udp
+
+    def send(self, record: bytes) -> None:
+        with self._lock:
+            if not self._is_udp:
+                self._socket.sendall(record)
+                return
+
+            # Each datagram repeats the last few events, so a lost datagram is covered by the next one.
+            self._recent_records.append(record)
+            self._last_event = time.monotonic()
+            self._send_recent()
+
+    def resend_recent(self) -> None:
+        # Repeat recent events for a short while after they were sent, in case the last datagram was lost (which
+        # would otherwise leave a key held down).
+        with self._lock:
+            if self._is_udp and self._recent_records and time.monotonic() - self._last_event < self._resend_window:
+                self._send_recent()
+
+    def close(self) -> None:
+        self._socket.close()
+
+    def _send_recent(self) -> None:
+        try:
+            self._socket.send(INPUT_DATAGRAM_HEADER.pack(self._client_id) + b"".join(self._recent_records))
+        except OSError:
+            pass
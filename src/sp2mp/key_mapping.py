@@ -0,0 +1,164 @@
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+from typing import Iterable, Optional
+
+# Windows virtual-key codes fit in a byte, so a key table maps every one of them straight to the key sent on to the
+# captured window. An entry of 0 (which isn't a virtual key) drops the key instead.
+KEY_TABLE_SIZE = 256
+
+# Keys which would let a client control the server itself, rather than the captured window (like opening the start
+# menu). These are blocked unless a profile says otherwise.
+DEFAULT_BLOCKED_KEYS = frozenset({
+    0x5B,  # Left Windows key
+    0x5C,  # Right Windows key
+    0x5D,  # Applications key
+    0x5F,  # Sleep key
+})
+
+IDENTITY_KEY_TABLE = bytes(0 if key in DEFAULT_BLOCKED_KEYS else key for key in range(KEY_TABLE_SIZE))
+
+# Profiles saved by older versions recorded Qt key codes. Letters, digits and space are the same as virtual keys, and
+# these are the other keys which have one.
+_QT_TO_VIRTUAL_KEYS = {
+    0x01000000: 0x1B, 0x01000001: 0x09, 0x01000003: 0x08, 0x01000004: 0x0D, 0x01000005: 0x0D, 0x01000006: 0x2D,
+    0x01000007: 0x2E, 0x01000010: 0x24, 0x01000011: 0x23, 0x01000012: 0x25, 0x01000013: 0x26, 0x01000014: 0x27,
+    0x01000015: 0x28, 0x01000016: 0x21, 0x01000017: 0x22, 0x01000020: 0x10, 0x01000021: 0x11, 0x01000023: 0x12,
+    **{0x01000030 + i: 0x70 + i for i in range(24)}}
+
+_logger = logging.getLogger(__name__)
+
+_KEY_NAMES = {
+    0x08: "bksp", 0x09: "tab", 0x0D: "enter", 0x10: "shift", 0x11: "ctrl", 0x12: "alt", 0x1B: "esc", 0x20: "space",
+    0x25: "left", 0x26: "up", 0x27: "right", 0x28: "down",
+    **{key: f"f{key - 0x6F}" for key in range(0x70, 0x88)}}
+
+
+def key_name(key_code: int) -> str:
+    # Letter and digit virtual keys are their ASCII characters.
+    if 0x30 <= key_code <= 0x39 or 0x41 <= key_code <= 0x5A:
+        return chr(key_code).lower()
+    return _KEY_NAMES.get(key_code, f"{key_code:#04x}")
+
+
+def compile_key_table(
+        mapping: dict[int, int], allowed: Optional[Iterable[int]] = None,
+        blocked: Iterable[int] = DEFAULT_BLOCKED_KEYS) -> bytes:
+    # The allow and block lists apply to the keys sent to the window (after mapping), so they're folded into the table
+    # here, and looking a key up is all that's left to do per event.
+    allowed = set(allowed) if allowed is not None else None
+    blocked = set(blocked)
+
+    table = bytearray(KEY_TABLE_SIZE)
+    for key in range(1, KEY_TABLE_SIZE):
+        target = mapping.get(key, key)
+        if 0 < target < KEY_TABLE_SIZE and target not in blocked and (allowed is None or target in allowed):
+            table[key] = target
+    return bytes(table)
+
+
+class KeyMappingStore:
+    # The key mapping profiles for each application, loaded from the file once, and kept in memory. Changes are written
+    # back on a background thread, to a temporary file which then replaces the old one, so a crash mid-write can't
+    # leave the file half written.
+    _path: str
+    _key_maps: dict[str, dict]
+    _lock: Lock
+    _executor: ThreadPoolExecutor
+    _save_pending: bool
+
+    def __init__(self, path: str = "./data/key_mappings.json") -> None:
+        self._path = path
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sp2mp-key-mappings")
+        self._save_pending = False
+
+        try:
+            with open(path, "r") as fo:
+                self._key_maps = json.load(fo)
+        except FileNotFoundError:
+            self._key_maps = {}
+
+        if self._convert_qt_key_codes():
+            self._schedule_save()
+
+    def profiles(self, name: str) -> list[str]:
+        with self._lock:
+            return list(self._key_maps.get(name, {}).get("profiles", {}))
+
+    def mapping(self, name: str, profile: str) -> dict[int, int]:
+        # JSON object keys are always strings, so the key codes are converted back to integers.
+        with self._lock:
+            mapping = self._key_maps[name]["profiles"][profile]["mapping"]
+            return {int(k): int(v) for k, v in mapping.items()}
+
+    def key_table(self, name: str, profile: str) -> bytes:
+        # Profiles can also list the keys that are "allowed" (all others are dropped), and the keys that are "blocked".
+        with self._lock:
+            profile_data = self._key_maps[name]["profiles"][profile]
+            allowed, blocked = profile_data.get("allowed"), profile_data.get("blocked", DEFAULT_BLOCKED_KEYS)
+        return compile_key_table(self.mapping(name, profile), allowed, blocked)
+
+    def set_mapping(self, name: str, profile: str, mapping: dict[int, int]) -> None:
+        with self._lock:
+            profiles = self._key_maps.setdefault(name, {"profiles": {}})["profiles"]
+            profiles.setdefault(profile, {"name": profile})["mapping"] = {str(k): v for k, v in mapping.items()}
+        self._schedule_save()
+
+    def delete_profile(self, name: str, profile: str) -> None:
+        with self._lock:
+            self._key_maps.get(name, {}).get("profiles", {}).pop(profile, None)
+        self._schedule_save()
+
+    def close(self) -> None:
+        # Wait for any changes to be written.
+        self._executor.shutdown()
+
+    def _convert_qt_key_codes(self) -> bool:
+        # Keys outside the key table would otherwise be dropped without a word, so older profiles' Qt key codes are
+        # converted to virtual keys, and any without one are removed (with a warning). Returns whether any changed.
+        changed = False
+        for name, key_map in self._key_maps.items():
+            for profile, profile_data in key_map.get("profiles", {}).items():
+                mapping = {}
+                for key, target in profile_data.get("mapping", {}).items():
+                    key, target = _QT_TO_VIRTUAL_KEYS.get(int(key), int(key)), _QT_TO_VIRTUAL_KEYS.get(target, target)
+                    if key < KEY_TABLE_SIZE and target < KEY_TABLE_SIZE:
+                        mapping[str(key)] = target
+                    else:
+                        _logger.warning(
+                            f"Removed {name}'s {profile!r} mapping of {key:#x} to {target:#x}, which has no virtual key")
+
+                if mapping != profile_data.get("mapping", {}):
+                    profile_data["mapping"] = mapping
+                    changed = True
+        return changed
+
+    def _schedule_save(self) -> None:
+        # Several changes in quick succession are written together, by the save that's already waiting to run.
+        with self._lock:
+            if self._save_pending:
+                return
+            self._save_pending = True
+        self._executor.submit(self._write)
+
+    def _write(self) -> None:
+        with self._lock:
+            self._save_pending = False
+            data = json.dumps(self._key_maps, indent=4)
+
+        directory = os.path.dirname(os.path.abspath(self._path))
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".key_mappings.", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fo:
+                fo.write(data)
+                fo.flush()
+                os.fsync(fo.fileno())
+            os.replace(temp_path, self._path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
@@ -0,0 +1,180 @@
+import struct
+from dataclasses import dataclass, field
+from enum import IntEnum, IntFlag
+from typing import TYPE_CHECKING, Callable, ClassVar, Iterator, Optional, Union
+
+from sp2mp.buffer_pool import FrameBuffer
+
+# asyncio is only needed by the network modules, not by everything else using the protocol (like the decoder).
+if TYPE_CHECKING:
+    from asyncio import StreamReader
+
+FRAME_MAGIC = b"SP2M"
+PROTOCOL_VERSION = 1
+
+# Tile payloads: canvas width, canvas height and tile count, followed by (x, y, length, data) for each tile.
+TILES_HEADER = struct.Struct("!HHH")
+TILE_HEADER = struct.Struct("!HHI")
+
+# Hello payloads: the client's input channel id, and the server's UDP and TCP input ports (0 if unavailable).
+INPUT_CHANNEL = struct.Struct("!IHH")
+
+# Input datagrams: the client's input channel id, followed by the most recent event records.
+INPUT_DATAGRAM_HEADER = struct.Struct("!I")
+
+# Frames flagged with TIMINGS have the time they finished encoding, and the time they were sent to this client (both in
+# ns), between the header and the payload.
+FRAME_TIMINGS = struct.Struct("!QQ")
+
+# Frames flagged with INPUT_ECHO then have the sequence number of the latest of this client's input events applied before
+# the frame was captured, so the client can tell when its input shows up on screen.
+INPUT_ECHO = struct.Struct("!I")
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class EventProtocol(IntEnum):
+    KEYBOARD = 1
+    ACK = 2
+    KEYFRAME_REQUEST = 3
+
+
+class EventFlag(IntFlag):
+    NONE = 0
+    KEY_DOWN = 1
+
+
+@dataclass(frozen=True)
+class EventRecord:
+    # Fixed-size records sent back by the receiver: type, flags, key code, sequence number and timestamp (ns). Acks
+    # carry the acknowledged frame's sequence number.
+    STRUCT: ClassVar[struct.Struct] = struct.Struct("!BBHIQ")
+
+    event_type: EventProtocol
+    flags: EventFlag
+    key_code: int
+    sequence: int
+    timestamp: int
+
+    def pack(self) -> bytes:
+        return self.STRUCT.pack(self.event_type, self.flags, self.key_code, self.sequence, self.timestamp)
+
+
+class FrameType(IntEnum):
+    IMAGE = 1
+    TILES = 2
+    HEARTBEAT = 3
+    HELLO = 4
+    SHARED = 5
+
+
+class FrameFlag(IntFlag):
+    NONE = 0
+    KEYFRAME = 1
+    TIMINGS = 2
+    INPUT_ECHO = 4
+
+
+@dataclass(frozen=True)
+class FrameHeader:
+    # Layout: magic, version, type, flags, sequence number, capture timestamp (ns), payload length. The encode and send
+    # timestamps, and the input echo, aren't part of the header itself (see FRAME_TIMINGS and INPUT_ECHO).
+    STRUCT: ClassVar[struct.Struct] = struct.Struct("!4sBBHIQI")
+
+    frame_type: FrameType
+    flags: FrameFlag
+    sequence: int
+    timestamp: int
+    length: int
+    encoded: int = 0
+    sent: int = 0
+    input_sequence: int = 0
+
+    def pack(self) -> bytes:
+        return self.STRUCT.pack(
+            FRAME_MAGIC, PROTOCOL_VERSION, self.frame_type, self.flags, self.sequence, self.timestamp, self.length)
+
+    @classmethod
+    def unpack(cls, data: bytes | bytearray | memoryview) -> "FrameHeader":
+        magic, version, frame_type, flags, sequence, timestamp, length = cls.STRUCT.unpack(data)
+        if magic != FRAME_MAGIC:
+            raise ProtocolError(f"Invalid frame magic: {magic!r}")
+        if version != PROTOCOL_VERSION:
+            raise ProtocolError(f"Unsupported protocol version: {version}")
+        try:
+            frame_type = FrameType(frame_type)
+        except ValueError:
+            raise ProtocolError(f"Unknown frame type: {frame_type}") from None
+        return cls(frame_type, FrameFlag(flags), sequence, timestamp, length)
+
+
+@dataclass
+class Packet:
+    header: FrameHeader
+    payload: Union[bytes, memoryview, FrameBuffer]
+    # How many input events the server had applied when the frame was captured, used to fill in each client's echo.
+    input_serial: int = 0
+    raw_header: bytes = field(init=False)
+    buffer: Optional[FrameBuffer] = field(init=False, default=None)
+
+    def __post_init__(self) -> None:
+        # Pack the header once, as the same packet is sent to every client.
+        self.raw_header = self.header.pack()
+
+        # Pooled frames are sent straight from their buffer, which each client holds a reference to until it's sent.
+        if isinstance(self.payload, FrameBuffer):
+            self.buffer, self.payload = self.payload, self.payload.view
+
+    def retain(self) -> None:
+        if self.buffer is not None:
+            self.buffer.retain()
+
+    def release(self) -> None:
+        if self.buffer is not None:
+            self.buffer.release()
+
+
+def pack_tiles(width: int, height: int, tiles: list[tuple[int, int, bytes]]) -> bytes:
+    parts = [TILES_HEADER.pack(width, height, len(tiles))]
+    for x, y, data in tiles:
+        parts.append(TILE_HEADER.pack(x, y, len(data)))
+        parts.append(data)
+    return b"".join(parts)
+
+
+def unpack_tiles(payload: bytes) -> tuple[int, int, Iterator[tuple[int, int, memoryview]]]:
+    width, height, count = TILES_HEADER.unpack_from(payload)
+
+    def _tiles() -> Iterator[tuple[int, int, memoryview]]:
+        view = memoryview(payload)
+        offset = TILES_HEADER.size
+        for _ in range(count):
+            x, y, length = TILE_HEADER.unpack_from(view, offset)
+            offset += TILE_HEADER.size
+            yield x, y, view[offset:offset + length]
+            offset += length
+
+    return width, height, _tiles()
+
+
+async def read_event_records(reader: "StreamReader", handle: Callable[[memoryview], None]) -> None:
+    # Several fixed-size records can arrive in one read, so every complete record is handled together, and any
+    # partial record is kept for the next read. Returns on EOF or a connection error.
+    record_size = EventRecord.STRUCT.size
+    pending = b""
+    while True:
+        try:
+            data = await reader.read(record_size * 64)
+        except OSError:
+            return
+        if not data:
+            return
+
+        if pending:
+            data = pending + data
+        complete = len(data) - len(data) % record_size
+        if complete:
+            handle(memoryview(data)[:complete])
+        pending = data[complete:]
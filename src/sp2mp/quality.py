@@ -0,0 +1,93 @@
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+
+@dataclass(frozen=True)
+class EncodeSettings:
+    quality: int = 80
+    scale: float = 1.0
+    # The client's output resolution; frames are fitted within it (keeping their aspect ratio) before being scaled.
+    output_size: Optional[tuple[int, int]] = None
+
+
+# Ordered from best to cheapest; quality is lowered first, then the resolution.
+QUALITY_LADDER = [
+    EncodeSettings(90, 1.0),
+    EncodeSettings(80, 1.0),
+    EncodeSettings(70, 1.0),
+    EncodeSettings(60, 1.0),
+    EncodeSettings(60, 0.75),
+    EncodeSettings(50, 0.75),
+    EncodeSettings(50, 0.5),
+    EncodeSettings(40, 0.5),
+    EncodeSettings(30, 0.5),
+    EncodeSettings(30, 0.25)]
+
+
+class QualityController:
+    _level: int
+    _frame_interval: float
+    _max_in_flight: int
+    _step_down_cooldown: float
+    _step_up_after: float
+    _send_time: float
+    _last_dropped_frames: Optional[int]
+    _last_change: float
+    _healthy_since: Optional[float]
+    _clock: Callable[[], float]
+
+    def __init__(
+            self, fps: float, level: int = 1, max_in_flight: int = 3, step_down_cooldown: float = 0.5,
+            step_up_after: float = 3.0, clock: Callable[[], float] = time.monotonic) -> None:
+        self._level = level
+        self._frame_interval = 1 / fps
+        self._max_in_flight = max_in_flight
+        self._step_down_cooldown = step_down_cooldown
+        self._step_up_after = step_up_after
+        self._send_time = 0.0
+        self._last_dropped_frames = None
+        self._last_change = clock()
+        self._healthy_since = None
+        self._clock = clock
+
+    @property
+    def settings(self) -> EncodeSettings:
+        return QUALITY_LADDER[self._level]
+
+    def update(self, send_duration: float, in_flight: int, dropped_frames: int) -> Optional[EncodeSettings]:
+        # Returns the new settings when the client should be moved up or down the ladder, otherwise None.
+        now = self._clock()
+        self._send_time = 0.8 * self._send_time + 0.2 * send_duration
+
+        # Frames dropped while the client was still connecting don't count.
+        if self._last_dropped_frames is None:
+            self._last_dropped_frames = dropped_frames
+
+        # The client is falling behind if frames are dropped from its slot, too many frames are waiting to be
+        # acknowledged, or sending a frame takes most of the frame interval.
+        congested = (
+            dropped_frames > self._last_dropped_frames
+            or in_flight > self._max_in_flight
+            or self._send_time > 0.8 * self._frame_interval)
+        self._last_dropped_frames = dropped_frames
+
+        # Step down quickly (allowing the last change to take effect first), but only step up after a healthy period.
+        if congested:
+            self._healthy_since = None
+            if self._level < len(QUALITY_LADDER) - 1 and now - self._last_change >= self._step_down_cooldown:
+                return self._change_level(self._level + 1, now)
+
+        elif self._healthy_since is None:
+            self._healthy_since = now
+
+        elif self._level > 0 and now - self._healthy_since >= self._step_up_after:
+            self._healthy_since = now
+            return self._change_level(self._level - 1, now)
+
+        return None
+
+    def _change_level(self, level: int, now: float) -> EncodeSettings:
+        self._level = level
+        self._last_change = now
+        return self.settings
@@ -1,42 +1,272 @@
-import socket
-from threading import Thread
+import asyncio
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from threading import Lock
+from typing import Optional
 
-from PyQt6.QtCore import QObject, pyqtSignal
+from sp2mp.buffer_pool import BufferPool, FrameBuffer
+from sp2mp.callbacks import Callbacks
+from sp2mp.engine import NetworkEngine, get_engine
+from sp2mp.input_channel import InputChannelClient
+from sp2mp.protocol import FRAME_TIMINGS, INPUT_ECHO, EventFlag, EventProtocol, EventRecord, FrameFlag, FrameHeader, FrameType, \
+    ProtocolError
+from sp2mp.stats import FrameStats, StageTimes
 
 
-class Receiver(QObject):
+class _FrameProtocol(asyncio.BufferedProtocol):
+    # Reads each frame straight into where it's used from: the header (and its extensions) into a small buffer reused
+    # for every frame, and the payload into a buffer from the receiver's pool, so frames are never copied out of a
+    # stream buffer first.
+    _receiver: "Receiver"
+    _transport: Optional[asyncio.Transport]
+    _header_data: memoryview
+    _header: Optional[FrameHeader]
+    _payload: Optional[FrameBuffer]
+    _target: memoryview
+    _received: int
+
+    def __init__(self, receiver: "Receiver") -> None:
+        self._receiver = receiver
+        self._transport = None
+        self._header_data = memoryview(bytearray(FrameHeader.STRUCT.size + FRAME_TIMINGS.size + INPUT_ECHO.size))
+        self._payload = None
+        self._expect_header()
+
+    def connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+        self._receiver._connection_made(transport)
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if self._payload:
+            self._payload.release()
+            self._payload = None
+        self._receiver._connection_lost(self._transport)
+
+    def get_buffer(self, sizehint: int) -> memoryview:
+        # Only ever read up to the end of the current part, so the next part lands in its own buffer.
+        return self._target[self._received:]
+
+    def buffer_updated(self, nbytes: int) -> None:
+        self._received += nbytes
+        if self._received < len(self._target):
+            return
+        try:
+            self._part_received()
+        except ProtocolError:
+            self._transport.close()
+
+    def _expect(self, target: memoryview) -> None:
+        self._target = target
+        self._received = 0
+
+    def _expect_header(self) -> None:
+        self._header = None
+        self._expect(self._header_data[:FrameHeader.STRUCT.size])
+
+    def _part_received(self) -> None:
+        if self._header is None:
+            # The fixed-size header says which extensions, and exactly how many payload bytes, follow.
+            self._header = FrameHeader.unpack(self._target)
+            size = (FRAME_TIMINGS.size if self._header.flags & FrameFlag.TIMINGS else 0) + \
+                (INPUT_ECHO.size if self._header.flags & FrameFlag.INPUT_ECHO else 0)
+            if size:
+                self._expect(self._header_data[FrameHeader.STRUCT.size:FrameHeader.STRUCT.size + size])
+                return
+        elif self._payload is None:
+            self._header = self._unpack_extensions(self._header, self._target)
+
+        if self._payload is None:
+            self._payload = self._receiver.pool.acquire(self._header.length)
+            if self._header.length:
+                self._expect(memoryview(self._payload.data)[:self._header.length])
+                return
+
+        header, payload = self._header, self._payload
+        self._payload = None
+        self._expect_header()
+        try:
+            self._receiver._frame_received(self._transport, header, payload)
+        finally:
+            payload.release()
+
+    @staticmethod
+    def _unpack_extensions(header: FrameHeader, data: memoryview) -> FrameHeader:
+        offset = 0
+        if header.flags & FrameFlag.TIMINGS:
+            encoded, sent = FRAME_TIMINGS.unpack_from(data, offset)
+            header = replace(header, encoded=encoded, sent=sent)
+            offset += FRAME_TIMINGS.size
+        if header.flags & FrameFlag.INPUT_ECHO:
+            input_sequence, = INPUT_ECHO.unpack_from(data, offset)
+            header = replace(header, input_sequence=input_sequence)
+        return header
+
+
+class Receiver:
+    # Receives frames from a broadcaster (or relay) on the network engine's loop. Frames are passed to the callbacks
+    # registered on "frame_received" (and "data_received" or "tiles_received") on that loop, so they should be handed
+    # off quickly. "frame_received" gets the pooled buffer the payload was read into, which goes back to the pool once
+    # the callbacks return, so a callback keeping the frame holds its own reference (retain, then release once done);
+    # the other two get a view of it, only valid during the callback.
     _port: int
-    _socket: socket.socket
-    _receiver_thread: Thread
-    _send_to_socket: socket.socket
+    _engine: NetworkEngine
+    _server: asyncio.Server
+    _transport: Optional[asyncio.Transport]
+    _pool: BufferPool
+    _input_channel: Optional[InputChannelClient]
+    _input_channel_task: Optional[asyncio.Task]
+    _send_lock: Lock
+    _event_sequence: int
+    _stage_times: StageTimes
+    _stats: Optional[FrameStats]
+    _pending_inputs: OrderedDict[int, int]
+    _pending_input_limit: int
 
-    data_received = pyqtSignal(bytes)
+    frame_received: Callbacks
+    data_received: Callbacks
+    tiles_received: Callbacks
 
-    def __init__(self, port: int) -> None:
-        super().__init__()
+    def __init__(self, port: int, instrument: bool = False) -> None:
+        self.frame_received = Callbacks()
+        self.data_received = Callbacks()
+        self.tiles_received = Callbacks()
         self._port = port
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-        self._socket.bind(("", self._port))
-        self._socket.listen(5)
-
-        self._receiver_thread = Thread(target=self._accept_connection)
-        self._receiver_thread.start()
-
-    def _accept_connection(self) -> None:
-        conn, addr = self._socket.accept()
-        self._send_to_socket = conn
-        self.receive_data(conn)
-
-    def receive_data(self, conn: socket.socket) -> None:
-        data = bytearray()
-        chunk_size = pow(2, 24)
-        while True:
-            image = b""
-            while not image.endswith(b"\n"):
-                chunk = conn.recv(chunk_size)  # 64KB chunks
-                if not chunk:
+        self._transport = None
+        self._pool = BufferPool()
+        self._input_channel = None
+        self._input_channel_task = None
+        self._send_lock = Lock()
+        self._event_sequence = 0
+        self._stage_times = StageTimes()
+        self._stats = FrameStats() if instrument else None
+        self._pending_inputs = OrderedDict()
+        self._pending_input_limit = 256
+
+        # Listen on the network engine's loop; binding errors are still raised here.
+        self._engine = get_engine()
+        self._server = self._engine.run(self._start_server())
+
+    @property
+    def stage_times(self) -> StageTimes:
+        return self._stage_times
+
+    @property
+    def pool(self) -> BufferPool:
+        return self._pool
+
+    @property
+    def stats(self) -> Optional[FrameStats]:
+        # Shared with the decoder and display (if instrumented), which add the decode and paint stages.
+        return self._stats
+
+    def close(self) -> None:
+        self._engine.run(self._close())
+        if self._input_channel:
+            self._input_channel.close()
+
+    async def _start_server(self) -> asyncio.Server:
+        loop = asyncio.get_running_loop()
+        return await loop.create_server(lambda: _FrameProtocol(self), "", self._port)
+
+    async def _close(self) -> None:
+        self._server.close()
+        if self._transport:
+            self._transport.close()
+        if self._input_channel_task:
+            self._input_channel_task.cancel()
+        await self._server.wait_closed()
+
+    def _connection_made(self, transport: asyncio.Transport) -> None:
+        self._transport = transport
+
+    def _connection_lost(self, transport: asyncio.Transport) -> None:
+        if self._transport is transport:
+            self._transport = None
+
+    async def _connect_input_channel(self, host: str, hello: bytes) -> None:
+        self._input_channel = await InputChannelClient.connect(host, hello)
+
+    def _frame_received(self, transport: asyncio.Transport, header: FrameHeader, payload: FrameBuffer) -> None:
+        start = time.thread_time()
+
+        # The server says where to send input events; until then they go over this connection.
+        if header.frame_type == FrameType.HELLO:
+            host = transport.get_extra_info("peername")[0]
+            self._input_channel_task = asyncio.create_task(self._connect_input_channel(host, bytes(payload.view)))
+            return
+
+        # Acknowledge the frame, so the server can tell how far behind this client is.
+        transport.write(EventRecord(EventProtocol.ACK, EventFlag.NONE, 0, header.sequence, time.time_ns()).pack())
+        self._stage_times.add("receive", time.thread_time() - start)
+        if self._stats and header.frame_type != FrameType.HEARTBEAT:
+            self._record_stats(header, len(payload))
+
+        # Frames arrive steadily, so they're used to repeat the latest input events in case any were lost.
+        if self._input_channel:
+            self._input_channel.resend_recent()
+
+        self.frame_received.emit(header, payload)
+        if header.frame_type == FrameType.IMAGE:
+            self.data_received.emit(payload.view)
+        elif header.frame_type == FrameType.TILES:
+            self.tiles_received.emit(payload.view)
+
+    def _record_stats(self, header: FrameHeader, size: int) -> None:
+        # The stages between the server's timestamps and this one assume the clocks agree (like on the same host).
+        self._stats.add_frame(size)
+        if header.flags & FrameFlag.TIMINGS:
+            received = time.time_ns()
+            self._stats.add("encode", (header.encoded - header.timestamp) / 1e6)
+            self._stats.add("queue", (header.sent - header.encoded) / 1e6)
+            self._stats.add("network", (received - header.sent) / 1e6)
+
+    def frame_displayed(self, header: FrameHeader) -> list[float]:
+        # Called once a frame has been shown. Input events the frame's echo covers have now made it to the screen, so
+        # their input-to-photon latencies (in ms) are recorded, and returned.
+        if not self._stats or not header.flags & FrameFlag.INPUT_ECHO:
+            return []
+
+        now = time.time_ns()
+        latencies = []
+        with self._send_lock:
+            while self._pending_inputs:
+                sequence, sent = next(iter(self._pending_inputs.items()))
+                if (header.input_sequence - sequence) & 0xFFFFFFFF >= 0x80000000:
                     break
-                image += chunk
-            if not image:
-                break
-            self.data_received.emit(image)
+                del self._pending_inputs[sequence]
+                latencies.append((now - sent) / 1e6)
+
+        for latency in latencies:
+            self._stats.add("input", latency)
+        return latencies
+
+    def send_key_event(self, key_code: int, key_down: bool) -> int:
+        # Returns the event's sequence number.
+        with self._send_lock:
+            self._event_sequence = (self._event_sequence + 1) & 0xFFFFFFFF
+            sequence = self._event_sequence
+
+            # Remember when each event was sent, until a frame showing it is displayed.
+            if self._stats:
+                self._pending_inputs[sequence] = time.time_ns()
+                if len(self._pending_inputs) > self._pending_input_limit:
+                    self._pending_inputs.popitem(last=False)
+
+        # Key events skip the frame connection if the server gave us an input channel.
+        flags = EventFlag.KEY_DOWN if key_down else EventFlag.NONE
+        record = EventRecord(EventProtocol.KEYBOARD, flags, key_code, sequence, time.time_ns()).pack()
+        if self._input_channel:
+            self._input_channel.send(record)
+        else:
+            self._send_record(record)
+        return sequence
+
+    def request_keyframe(self) -> None:
+        # Ask the server to send a full frame next, like when frames have been lost.
+        self._send_record(EventRecord(EventProtocol.KEYFRAME_REQUEST, EventFlag.NONE, 0, 0, time.time_ns()).pack())
+
+    def _send_record(self, record: bytes) -> None:
+        # Writes to the frame connection have to happen on the network engine's loop.
+        if self._transport:
+            self._engine.call_soon(self._transport.write, record)
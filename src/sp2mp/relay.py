@@ -0,0 +1,86 @@
+from sp2mp.buffer_pool import FrameBuffer
+from sp2mp.frame_server import Client, FrameServer, Stream
+from sp2mp.protocol import FrameFlag, FrameHeader, FrameType, Packet
+from sp2mp.receiver import Receiver
+
+
+class Relay(FrameServer):
+    # Receives one encoded stream from a broadcaster (as a normal client), and sends it on to many downstream clients,
+    # so the broadcaster's upload bandwidth and encoding cost don't grow with the number of viewers. Frames are
+    # forwarded as they are; input events from downstream clients are passed back upstream.
+    _receiver: Receiver
+    _backlog: list[Packet]
+    _backlog_limit: int
+
+    def __init__(
+            self, port: int, hosts: list[str], ports: list[int], backlog_limit: int = 240,
+            instrument: bool = False) -> None:
+        super().__init__(hosts, ports, instrument=instrument)
+        self._backlog = []
+        self._backlog_limit = backlog_limit
+
+        # Frames are forwarded on the network engine's loop, as soon as they're received.
+        self._receiver = Receiver(port, instrument)
+        self._receiver.frame_received.connect(self._relay_frame)
+
+    def stats_snapshot(self) -> dict:
+        return {"upstream": self._receiver.stats.snapshot() if self._receiver.stats else {}, **super().stats_snapshot()}
+
+    def stop(self) -> None:
+        self._receiver.close()
+        super().stop()
+
+    def _relay_frame(self, header: FrameHeader, data: FrameBuffer) -> None:
+        # Shared memory frames only make sense on the broadcaster's host, so can't be relayed.
+        if header.frame_type == FrameType.SHARED:
+            return
+
+        # The broadcaster echoes this relay's input, which is mapped back to each client's own input when it's sent.
+        # Heartbeats aren't reference counted by the clients they're sent to (and have no payload anyway).
+        packet = Packet(header, b"" if header.frame_type == FrameType.HEARTBEAT else data, header.input_sequence)
+
+        # Keep the last keyframe, and the delta frames since, so new clients can be started straight away. The backlog
+        # holds its own reference to each frame's buffer, as does each client it's delivered to.
+        if header.frame_type in (FrameType.IMAGE, FrameType.TILES):
+            if header.flags & FrameFlag.KEYFRAME:
+                self._clear_backlog()
+                packet.retain()
+                self._backlog.append(packet)
+            elif self._backlog:
+                packet.retain()
+                self._backlog.append(packet)
+                if len(self._backlog) > self._backlog_limit:
+                    self._clear_backlog()
+                    self._receiver.request_keyframe()
+
+        self._deliver([(stream, packet) for stream in list(self._streams.values())])
+
+    def _add_client(self, client: Client) -> None:
+        # There are no raw frames to put in shared memory, only the broadcaster's encoded ones.
+        client.shared_memory = False
+        super()._add_client(client)
+
+    def _client_connected(self, client: Client) -> None:
+        # Start the new client from the last keyframe, rather than waiting for (or forcing) the broadcaster's next one.
+        if not self._backlog:
+            self._receiver.request_keyframe()
+            return
+
+        # Anything already queued for the client is in the backlog too.
+        while packet := client.queue.get(timeout=0):
+            packet.release()
+        for packet in self._backlog:
+            packet.retain()
+            self._write_packet(client, packet)
+            client.unflushed.append((client.bytes_written, packet))
+
+    def _clear_backlog(self) -> None:
+        while self._backlog:
+            self._backlog.pop().release()
+
+    def _request_keyframe(self, stream: Stream) -> None:
+        self._receiver.request_keyframe()
+
+    def _handle_keyboard_event(self, key_code: int, key_down: bool) -> int:
+        return self._receiver.send_key_event(key_code, key_down)
+
@@ -0,0 +1,76 @@
+import asyncio
+import time
+from typing import Callable, Optional
+
+
+class FrameScheduler:
+    _interval: float
+    _next_deadline: Optional[float]
+    _missed_frames: int
+    _clock: Callable[[], float]
+    _sleep: Callable[[float], None]
+
+    def __init__(self, fps: float, clock: Callable[[], float] = time.monotonic, sleep: Callable[[float], None] = time.sleep) -> None:
+        if fps <= 0:
+            raise ValueError(f"Target FPS must be positive, got {fps}")
+
+        self._interval = 1 / fps
+        self._next_deadline = None
+        self._missed_frames = 0
+        self._clock = clock
+        self._sleep = sleep
+
+    @property
+    def fps(self) -> float:
+        return 1 / self._interval
+
+    @property
+    def missed_frames(self) -> int:
+        return self._missed_frames
+
+    def reset(self) -> None:
+        self._next_deadline = None
+
+    def wait(self) -> float:
+        # Block until the next deadline, and return it. Deadlines are fixed multiples of the interval from the first
+        # frame, so the time spent capturing and encoding doesn't accumulate as drift.
+        deadline, delay = self._advance()
+        if delay > 0:
+            self._sleep(delay)
+        return deadline
+
+    async def wait_async(self) -> float:
+        # Same as "wait", but yields to the event loop rather than blocking it.
+        deadline, delay = self._advance()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        return deadline
+
+    def _advance(self) -> tuple[float, float]:
+        # Claim the next deadline, returning it and how long there is until it.
+        now = self._clock()
+        if self._next_deadline is None:
+            self._next_deadline = now
+        if now >= self._next_deadline:
+            self._skip_missed_deadlines(now)
+
+        deadline = self._next_deadline
+        self._next_deadline += self._interval
+        return deadline, deadline - now
+
+    def is_due(self, now: float) -> bool:
+        # Non-blocking version of "wait", used to run a lower frame rate off the ticks of a faster scheduler.
+        if self._next_deadline is None:
+            self._next_deadline = now
+        if now + 1e-6 < self._next_deadline:
+            return False
+
+        self._skip_missed_deadlines(now)
+        self._next_deadline += self._interval
+        return True
+
+    def _skip_missed_deadlines(self, now: float) -> None:
+        # If whole intervals have been missed, skip them rather than bursting frames to catch up.
+        missed = int((now - self._next_deadline) / self._interval)
+        self._missed_frames += missed
+        self._next_deadline += missed * self._interval
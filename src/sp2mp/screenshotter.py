@@ -1,14 +1,22 @@
+from __future__ import annotations
+
 import ctypes
+from typing import Optional
 
+import win32api
 import win32con
 import win32gui
 import win32ui
 from PyQt6.QtGui import QImage
 
+from sp2mp.buffer_pool import BufferPool, FrameBuffer
+from sp2mp.frame_source import FrameSource
+
 PW_RENDERFULLCONTENT = 0x00000002
 
 user32 = ctypes.windll.user32
 dwmapi = ctypes.windll.dwmapi
+gdi32 = ctypes.windll.gdi32
 
 
 class ScreenShotter:
@@ -66,3 +74,88 @@ class ScreenShotter:
         win32gui.ReleaseDC(hwnd, hwnd_dc)
         win32gui.DeleteObject(save_bitmap.GetHandle())
         return image
+
+
+class WindowCapturer(FrameSource):
+    _hwnd: int
+    _size: Optional[tuple[int, int]]
+    _hwnd_dc: Optional[int]
+    _src_dc: Optional[win32ui.PyCDC]
+    _save_dc: Optional[win32ui.PyCDC]
+    _save_bitmap: Optional[win32ui.PyCBitmap]
+    _buffer_pool: BufferPool
+    _buffer: Optional[FrameBuffer]
+    _buffer_pointer: Optional[ctypes.Array]
+
+    def __init__(self, hwnd: int, buffer_pool: Optional[BufferPool] = None) -> None:
+        self._hwnd = hwnd
+        self._size = None
+        self._hwnd_dc = None
+        self._src_dc = None
+        self._save_dc = None
+        self._save_bitmap = None
+        self._buffer_pool = buffer_pool or BufferPool(max_free=2)
+        self._buffer = None
+        self._buffer_pointer = None
+
+    @property
+    def hwnd(self) -> int:
+        return self._hwnd
+
+    def capture(self) -> QImage:
+        # The device contexts and bitmap are kept between frames, and only re-created when the window is resized.
+        l, t, r, b = win32gui.GetWindowRect(self._hwnd)
+        w, h = r - l, b - t
+        if (w, h) != self._size:
+            self._allocate(w, h)
+
+        # Try PrintWindow first
+        success = user32.PrintWindow(self._hwnd, self._save_dc.GetSafeHdc(), PW_RENDERFULLCONTENT)
+
+        if not success:
+            # Fallback: BitBlt from screen (works for layered/GPU apps)
+            self._save_dc.BitBlt((0, 0), (w, h), self._src_dc, (0, 0), win32con.SRCCOPY)
+
+        # Copy the bitmap bits straight into the reusable buffer, which the QImage wraps without another copy.
+        gdi32.GetBitmapBits(self._save_bitmap.GetHandle(), len(self._buffer), self._buffer_pointer)
+        return QImage(self._buffer.data, w, h, QImage.Format.Format_ARGB32)
+
+    def send_key(self, key_code: int, key_down: bool) -> None:
+        # Send key events to the captured window.
+        if key_down:
+            win32api.PostMessage(self._hwnd, win32con.WM_KEYDOWN, key_code, 0)
+        else:
+            win32api.PostMessage(self._hwnd, win32con.WM_KEYUP, key_code, 0)
+
+    def close(self) -> None:
+        if self._hwnd_dc is None:
+            return
+
+        # Cleanup
+        self._src_dc.DeleteDC()
+        self._save_dc.DeleteDC()
+        win32gui.ReleaseDC(self._hwnd, self._hwnd_dc)
+        win32gui.DeleteObject(self._save_bitmap.GetHandle())
+        self._hwnd_dc = self._src_dc = self._save_dc = self._save_bitmap = None
+        self._size = None
+
+        # The frame is only valid until the next capture anyway, so its buffer can go straight back to the pool.
+        self._buffer_pointer = None
+        self._buffer.release()
+        self._buffer = None
+
+    def _allocate(self, w: int, h: int) -> None:
+        self.close()
+
+        # Create device contexts
+        self._hwnd_dc = win32gui.GetWindowDC(self._hwnd)
+        self._src_dc = win32ui.CreateDCFromHandle(self._hwnd_dc)
+        self._save_dc = self._src_dc.CreateCompatibleDC()
+        self._save_bitmap = win32ui.CreateBitmap()
+        self._save_bitmap.CreateCompatibleBitmap(self._src_dc, w, h)
+        self._save_dc.SelectObject(self._save_bitmap)
+
+        # A window going back to a size it has been before (like leaving full screen) reuses that size's buffer.
+        self._buffer = self._buffer_pool.acquire(w * h * 4)
+        self._buffer_pointer = (ctypes.c_char * len(self._buffer)).from_buffer(self._buffer.data)
+        self._size = w, h
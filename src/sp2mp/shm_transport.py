@@ -0,0 +1,127 @@
+import ipaddress
+import os
+import socket
+import struct
+import sys
+from multiprocessing import resource_tracker, shared_memory
+from typing import Optional
+
+from PyQt6.QtGui import QImage
+
+# Shared frame payloads: the offset of the slot the frame was written to, its version (see below), and its geometry,
+# followed by the name of the ring's shared memory block.
+SHARED_FRAME = struct.Struct("!QQHHIH")
+
+# Each slot starts with a version counter, which is odd while the slot is being written. A reader checks it before and
+# after copying the frame out, so a frame overwritten mid-copy is dropped rather than shown torn.
+SLOT_VERSION = struct.Struct("=Q")
+
+# Names of the blocks created by this process, which this process is responsible for unlinking.
+_created_blocks: set[str] = set()
+
+
+def is_local_host(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+
+def _attach(name: str) -> shared_memory.SharedMemory:
+    # Before Python 3.13, attaching also registers the block to be unlinked when this process exits, which would pull it
+    # out from under the broadcaster (unless this process created it).
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    block = shared_memory.SharedMemory(name)
+    if os.name == "posix" and name not in _created_blocks:
+        resource_tracker.unregister(block._name, "shared_memory")
+    return block
+
+
+class SharedFrameRing:
+    # Raw frames for clients on the same host are written into a ring of slots in shared memory, and only the slot is
+    # sent over the connection, so there's no encoding, copying through the socket, or decoding.
+    _slot_count: int
+    _slot_size: int
+    _block: Optional[shared_memory.SharedMemory]
+    _next_slot: int
+
+    def __init__(self, slot_count: int = 4) -> None:
+        self._slot_count = slot_count
+        self._slot_size = 0
+        self._block = None
+        self._next_slot = 0
+
+    def write(self, image: QImage) -> bytes:
+        # Returns the payload telling the client where to find the frame.
+        size = image.sizeInBytes()
+        if size > self._slot_size:
+            self._allocate(size)
+
+        slot = self._next_slot
+        self._next_slot = (slot + 1) % self._slot_count
+        offset = slot * (SLOT_VERSION.size + self._slot_size)
+        buf = self._block.buf
+
+        version, = SLOT_VERSION.unpack_from(buf, offset)
+        SLOT_VERSION.pack_into(buf, offset, version + 1)
+        bits = image.constBits()
+        bits.setsize(size)
+        buf[offset + SLOT_VERSION.size:offset + SLOT_VERSION.size + size] = bits
+        SLOT_VERSION.pack_into(buf, offset, version + 2)
+
+        header = SHARED_FRAME.pack(
+            offset, version + 2, image.width(), image.height(), image.bytesPerLine(), image.format().value)
+        return header + self._block.name.encode()
+
+    def close(self) -> None:
+        if self._block:
+            self._release(self._block)
+            self._block = None
+
+    def _allocate(self, slot_size: int) -> None:
+        # A larger frame (like after the window is resized) needs a new block; clients switch to it by its name.
+        self.close()
+        self._slot_size = slot_size
+        self._block = shared_memory.SharedMemory(create=True, size=self._slot_count * (SLOT_VERSION.size + slot_size))
+        _created_blocks.add(self._block.name)
+
+    @staticmethod
+    def _release(block: shared_memory.SharedMemory) -> None:
+        _created_blocks.discard(block.name)
+        block.close()
+        block.unlink()
+
+
+class SharedFrameReader:
+    _block: Optional[shared_memory.SharedMemory]
+
+    def __init__(self) -> None:
+        self._block = None
+
+    def read(self, payload: bytes | memoryview) -> Optional[QImage]:
+        # Copy the frame out of the ring. None is returned if the block is gone, or the frame was overwritten first.
+        offset, version, width, height, bytes_per_line, image_format = SHARED_FRAME.unpack_from(payload)
+        name = bytes(payload[SHARED_FRAME.size:]).decode()
+        if self._block is None or self._block.name != name:
+            self.close()
+            try:
+                self._block = _attach(name)
+            except OSError:
+                return None
+
+        size = bytes_per_line * height
+        if SLOT_VERSION.unpack_from(self._block.buf, offset)[0] != version:
+            return None
+
+        view = self._block.buf[offset + SLOT_VERSION.size:offset + SLOT_VERSION.size + size]
+        image = QImage(view, width, height, bytes_per_line, QImage.Format(image_format)).copy()
+        view.release()
+        if SLOT_VERSION.unpack_from(self._block.buf, offset)[0] != version:
+            return None
+        return image
+
+    def close(self) -> None:
+        if self._block:
+            self._block.close()
+            self._block = None
@@ -0,0 +1,123 @@
+import asyncio
+import json
+import time
+from collections import deque
+from threading import Lock
+from typing import Callable
+
+from sp2mp.engine import NetworkEngine, get_engine
+
+
+class StageTimes:
+    _totals: dict[str, float]
+    _counts: dict[str, int]
+    _lock: Lock
+
+    def __init__(self) -> None:
+        self._totals = {}
+        self._counts = {}
+        self._lock = Lock()
+
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._totals[stage] = self._totals.get(stage, 0.0) + seconds
+            self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def snapshot(self) -> dict[str, tuple[float, int]]:
+        # Total seconds and number of samples for each stage.
+        with self._lock:
+            return {stage: (total, self._counts[stage]) for stage, total in self._totals.items()}
+
+
+class Histogram:
+    # The most recent samples, so percentiles reflect how things are going now, rather than since the start.
+    _samples: deque[float]
+
+    def __init__(self, size: int = 1000) -> None:
+        self._samples = deque(maxlen=size)
+
+    def add(self, value: float) -> None:
+        self._samples.append(value)
+
+    def snapshot(self) -> dict[str, float]:
+        samples = sorted(self._samples)
+        if not samples:
+            return {"count": 0}
+        return {
+            "count": len(samples),
+            "p50": samples[len(samples) // 2],
+            "p95": samples[min(len(samples) * 95 // 100, len(samples) - 1)],
+            "p99": samples[min(len(samples) * 99 // 100, len(samples) - 1)],
+            "max": samples[-1]}
+
+
+class FrameStats:
+    # Frame and byte counters, and rolling histograms of how long each stage took (in ms), for one client. Instrumented
+    # objects hold one of these; uninstrumented ones hold None, and skip all of this.
+    _frames: int
+    _bytes: int
+    _recent: deque[tuple[float, int]]
+    _histograms: dict[str, Histogram]
+    _lock: Lock
+
+    def __init__(self, window: int = 120) -> None:
+        self._frames = 0
+        self._bytes = 0
+        self._recent = deque(maxlen=window)
+        self._histograms = {}
+        self._lock = Lock()
+
+    def add_frame(self, size: int) -> None:
+        with self._lock:
+            self._frames += 1
+            self._bytes += size
+            self._recent.append((time.monotonic(), size))
+
+    def add(self, stage: str, milliseconds: float) -> None:
+        with self._lock:
+            if stage not in self._histograms:
+                self._histograms[stage] = Histogram()
+            self._histograms[stage].add(milliseconds)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = list(self._recent)
+            histograms = {stage: histogram.snapshot() for stage, histogram in self._histograms.items()}
+            frames, size = self._frames, self._bytes
+
+        # Rates are over the most recent frames.
+        fps = bits_per_second = 0.0
+        if len(recent) > 1 and (elapsed := recent[-1][0] - recent[0][0]) > 0:
+            fps = (len(recent) - 1) / elapsed
+            bits_per_second = sum(size for _, size in recent[1:]) * 8 / elapsed
+        return {"frames": frames, "bytes": size, "fps": fps, "bits_per_second": bits_per_second, "stages": histograms}
+
+
+class StatsEndpoint:
+    # Serves a JSON snapshot of the stats to anything connecting on the local port (like "curl localhost:PORT").
+    _snapshot: Callable[[], dict]
+    _engine: NetworkEngine
+    _server: asyncio.Server
+
+    def __init__(self, snapshot: Callable[[], dict], port: int, host: str = "127.0.0.1") -> None:
+        self._snapshot = snapshot
+        self._engine = get_engine()
+        self._server = self._engine.run(asyncio.start_server(self._serve, host, port))
+
+    def close(self) -> None:
+        self._server.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        # Any request gets the snapshot, as a minimal HTTP response.
+        try:
+            await asyncio.wait_for(reader.read(4096), 1.0)
+        except (asyncio.TimeoutError, OSError):
+            pass
+        body = json.dumps(self._snapshot(), indent=4).encode()
+        writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\nContent-Length: %d\r\n\r\n" % len(body))
+        writer.write(body)
+        try:
+            await writer.drain()
+        except OSError:
+            pass
+        writer.close()
@@ -1,52 +1,74 @@
 from __future__ import annotations
 
 import functools
-import json
-import pickle
 import socket
-from typing import Optional
-
-import psutil
-import win32con
-import win32gui
-import win32process
-from PyQt6.QtCore import QSize, QTimer, Qt, pyqtSlot
-from PyQt6.QtGui import QImage, QKeyEvent, QKeySequence, QPixmap
-from PyQt6.QtWidgets import QApplication, QComboBox, QDialog, QGroupBox, QHBoxLayout, QLabel, QLayoutItem, \
+import time
+from threading import Thread
+from typing import TYPE_CHECKING, Optional
+
+from PyQt6.QtCore import QPoint, QRect, QSize, QTimer, Qt, pyqtSignal, pyqtSlot
+from PyQt6.QtGui import QImage, QKeyEvent, QMouseEvent, QPixmap, QResizeEvent
+from PyQt6.QtWidgets import QApplication, QCheckBox, QComboBox, QDialog, QGroupBox, QHBoxLayout, QLabel, QLayoutItem, \
     QLineEdit, \
     QPushButton, \
+    QRubberBand, \
     QScrollArea, \
+    QSizePolicy, \
     QTabWidget, QVBoxLayout, \
     QWidget
 
-from sp2mp.broadcaster import Broadcaster, EventProtocol, KeyboardEvent
-from sp2mp.receiver import Receiver
-from sp2mp.screenshotter import ScreenShotter
+from sp2mp.key_mapping import IDENTITY_KEY_TABLE, KeyMappingStore, key_name
+from sp2mp.window_list import AppWindow, WindowEnumerator
+
+# Output resolutions offered for each client, for spectators on smaller screens.
+CLIENT_OUTPUT_SIZES = [("Full size", None), ("1080p", (1920, 1080)), ("720p", (1280, 720)), ("480p", (854, 480))]
+
+# The broadcaster, receiver, decoder and window capture modules (and the asyncio, multiprocessing and Windows modules
+# they pull in) are only imported when their feature is first used, so the window opens as quickly as possible.
+if TYPE_CHECKING:
+    from sp2mp.broadcaster import Broadcaster
+    from sp2mp.decoder import FrameDecoder
+    from sp2mp.receiver import Receiver
 
 
 class UI(QDialog):
-    _app_scan_timer: QTimer
+    _host_address_found = pyqtSignal(str)
+
+    _window_enumerator: WindowEnumerator
 
     _app_label: QLabel
-    _app_preview: QLabel
+    _app_preview: RegionSelector
     _client_addresses: QWidget
     _current_app_selection_data: Optional[tuple[int, int, str, str]]
     _key_mapping_profiles: QVBoxLayout
     _client_bind_port: QLineEdit
+    _delta_mode: QCheckBox
+    _adaptive_quality: QCheckBox
+    _frame_timings: QCheckBox
+    _show_stats: QCheckBox
 
     _current_key_mapping_name: QLabel
-    _current_key_mapping: dict[int, int]
+    _key_mappings: KeyMappingStore
+    _current_key_profile: Optional[tuple[str, str]]
+    _current_key_table: bytes
 
     _broadcaster: Optional[Broadcaster]
     _is_broadcasting: bool
     _receiver: Optional[Receiver]
-    _receiver_widget: ReceiverWidget
+    _receiver_widget: Optional[ReceiverWidget]
 
     def __init__(self, parent: Optional[QWidget] = None, *args, **kwargs) -> None:
         super().__init__(parent, *args, **kwargs)
-        self._app_scan_timer = QTimer(timeout=self._scan_apps, singleShot=False)
-        self._current_key_mapping = {}
+        self._window_enumerator = WindowEnumerator()
+        self._window_enumerator.windows_added.connect(self._add_apps)
+        self._window_enumerator.windows_removed.connect(self._remove_apps)
+        self._key_mappings = KeyMappingStore()
+        self._current_app_selection_data = None
+        self._current_key_profile = None
+        self._current_key_table = IDENTITY_KEY_TABLE
         self._is_broadcasting = False
+        self._receiver = None
+        self._receiver_widget = None
         self._setup_ui()
 
     def _setup_ui(self) -> None:
@@ -62,7 +84,8 @@ class UI(QDialog):
 
         self._app_selection = QComboBox(self)
         self._app_selection.currentIndexChanged.connect(self._select_app)
-        self._app_preview = QLabel(self)
+        self._app_preview = RegionSelector(self)
+        self._app_preview.region_selected.connect(self._select_capture_region)
         self._app_preview.setFixedSize(
             QApplication.primaryScreen().size().scaled(QSize(300, 300), Qt.AspectRatioMode.KeepAspectRatio))
 
@@ -80,8 +103,16 @@ class UI(QDialog):
         self._client_addresses.layout().addWidget(
             QPushButton("+", clicked=lambda: self._generate_new_client_addresses_widget()))
 
+        self._delta_mode = QCheckBox("Only send changed regions")
+        self._adaptive_quality = QCheckBox("Adapt quality to each client's connection")
+        self._adaptive_quality.setChecked(True)
+        self._frame_timings = QCheckBox("Send frame timings (for clients' statistics overlay)")
+
         network_settings_frame.layout().addWidget(QLabel("Client Address:"))
         network_settings_frame.layout().addWidget(self._client_addresses)
+        network_settings_frame.layout().addWidget(self._delta_mode)
+        network_settings_frame.layout().addWidget(self._adaptive_quality)
+        network_settings_frame.layout().addWidget(self._frame_timings)
 
         # Key mapping frame
         key_mapping_frame = QGroupBox()
@@ -109,13 +140,18 @@ class UI(QDialog):
         self._client_bind_port = QLineEdit()
         self._client_bind_port.setInputMask("00000;_")
         self._client_bind_port.setText("20000")
-        self._receiver_widget = ReceiverWidget()
 
-        my_ip_label = QLabel(f"My IP Address: {socket.gethostbyname(socket.gethostname())}")
+        # Looking up the host's address can block for seconds (like with misconfigured DNS), so it's done in the
+        # background, and the label is filled in when it's found.
+        my_ip_label = QLabel("My IP Address: ...")
+        self._host_address_found.connect(lambda address: my_ip_label.setText(f"My IP Address: {address}"))
+        Thread(target=self._find_host_address, daemon=True).start()
         confirm_bind_button = QPushButton("Bind", clicked=self._start_receiving)
+        self._show_stats = QCheckBox("Show statistics overlay")
 
         client_bind_frame.layout().addWidget(my_ip_label)
         client_bind_frame.layout().addWidget(self._client_bind_port)
+        client_bind_frame.layout().addWidget(self._show_stats)
         client_bind_frame.layout().addWidget(confirm_bind_button)
 
         # Server layout.
@@ -133,104 +169,113 @@ class UI(QDialog):
         self.setLayout(QVBoxLayout())
         self.layout().addWidget(tabs)
 
-        # Scan for applications.
-        self._app_scan_timer.start(1000)
+        # Scan for applications (in the background).
+        self._window_enumerator.start()
+
+    def done(self, result: int) -> None:
+        self._window_enumerator.stop()
+        self._key_mappings.close()
+        super().done(result)
+
+    def _find_host_address(self) -> None:
+        try:
+            address = socket.gethostbyname(socket.gethostname())
+        except OSError:
+            address = "unknown"
+        self._host_address_found.emit(address)
 
     def _start_broadcasting(self) -> None:
+        from sp2mp.screenshotter import WindowCapturer
+
         # Setup if not broadcasting yet.
         if not self._is_broadcasting:
-            self._broadcaster = Broadcaster(self._current_app_selection_data[0], [], [])
+            from sp2mp.broadcaster import Broadcaster
+
+            self._broadcaster = Broadcaster(
+                WindowCapturer(self._current_app_selection_data[0]), [], [], delta_mode=self._delta_mode.isChecked(),
+                adaptive_quality=self._adaptive_quality.isChecked(), instrument=self._frame_timings.isChecked())
+            self._broadcaster.set_key_table(self._current_key_table)
+            self._broadcaster.set_capture_region(self._app_preview.region)
 
             for client in self._client_addresses.layout().findChildren(QHBoxLayout):
                 address = client.itemAt(0).widget().text()
                 port = int(client.itemAt(1).widget().text())
+                output_size = client.itemAt(2).widget().currentData()
+                shared_memory = client.itemAt(3).widget().isChecked()
                 if not address or not port: continue
 
-                self._broadcaster.add_new_client(address, port)
+                self._broadcaster.add_new_client(address, port, output_size=output_size, shared_memory=shared_memory)
+
+            self._broadcaster.broadcast()
 
         else:
-            # Otherwise, just rest the hwnd to screenshot.
-            self._broadcaster.reset_hwnd(self._current_app_selection_data[0])
+            # Otherwise, just reset the window to screenshot.
+            self._broadcaster.reset_source(WindowCapturer(self._current_app_selection_data[0]))
+            self._broadcaster.set_capture_region(self._app_preview.region)
 
         self._is_broadcasting = True
-        self._broadcaster.broadcast()
 
     def _start_receiving(self) -> None:
-        self._receiver = Receiver(int(self._client_bind_port.text()))
-        self._receiver.data_received.connect(self._receiver_widget.show_image)
-        self._receiver_widget.showMaximized()
-        self._receiver_widget._receiver = self._receiver
+        from sp2mp.receiver import Receiver
 
-    def _fix_mapping(self, mapping: dict[int, int]) -> dict[int, int]:
-        # Convert keys to integers
-        return {int(k): int(v) for k, v in mapping.items()}
+        # The receiver widget (and its decoder thread) is only created when it's first needed.
+        if self._receiver_widget is None:
+            self._receiver_widget = ReceiverWidget()
+        self._receiver = Receiver(int(self._client_bind_port.text()), instrument=self._show_stats.isChecked())
+        self._receiver_widget.set_receiver(self._receiver)
+        self._receiver_widget.showMaximized()
 
     def _load_key_mappings(self, name: str) -> None:
-        with open("./data/key_mappings.json", "r") as fo:
-            key_maps = json.load(fo)
-
         while self._key_mapping_profiles.count() > 0:
             item = self._key_mapping_profiles.itemAt(0)
             self._key_mapping_profiles.removeItem(item)
 
-        if name in key_maps.keys():
-            profiles = key_maps[name]["profiles"]
-            for profile_name, profile in profiles.items():
-                # Create UI elements for each key mapping profile
-                profile_info = QHBoxLayout()
-                profile_info.addWidget(profile_label := QLabel(f"{profile_name}: "))
-                profile_info.addWidget(modify_profile_button := QPushButton("Modify", clicked=functools.partial(
-                    self._open_modify_keymapping_profile_dialog, name, profile_name)))
-                profile_info.addWidget(select_profile_button := QPushButton("Select", clicked=functools.partial(
-                    self._select_keymapping_profile, name, profile_name)))
-                profile_info.addWidget(delete_profile_button := QPushButton("Delete", clicked=functools.partial(
-                    self._delete_keymapping_profile, name, profile_name)))
-
-                self._key_mapping_profiles.addLayout(profile_info)
+        for profile_name in self._key_mappings.profiles(name):
+            # Create UI elements for each key mapping profile
+            profile_info = QHBoxLayout()
+            profile_info.addWidget(profile_label := QLabel(f"{profile_name}: "))
+            profile_info.addWidget(modify_profile_button := QPushButton("Modify", clicked=functools.partial(
+                self._open_modify_keymapping_profile_dialog, name, profile_name)))
+            profile_info.addWidget(select_profile_button := QPushButton("Select", clicked=functools.partial(
+                self._select_keymapping_profile, name, profile_name)))
+            profile_info.addWidget(delete_profile_button := QPushButton("Delete", clicked=functools.partial(
+                self._delete_keymapping_profile, name, profile_name)))
+
+            self._key_mapping_profiles.addLayout(profile_info)
 
     def _modify_keymapping_profile(self, name: str, profile: str, mapping: dict[int, int], *, reload: bool = False) -> None:
-        # Load the key mappings from the JSON file.
-        with open("./data/key_mappings.json", "r") as fo:
-            key_maps = json.load(fo)
-
-        # Update the profile with the new mapping.
-        if name not in key_maps:
-            key_maps[name] = {"profiles": {}}
-
-        # Check if the profile already exists
-        existing_profile = key_maps[name]["profiles"].get(profile, None)
-        if existing_profile:
-            existing_profile["mapping"] = mapping
-        else:
-            key_maps[name]["profiles"][profile] = {
-                "name": profile,
-                "mapping": mapping}
+        # The change is saved to the file in the background.
+        self._key_mappings.set_mapping(name, profile, mapping)
 
-        # Re-write the file with the updated key mappings.
-        with open("./data/key_mappings.json", "w") as fo:
-            json.dump(key_maps, fo, indent=4)
+        # A change to the profile in use takes effect straight away.
+        if self._current_key_profile == (name, profile):
+            self._select_keymapping_profile(name, profile)
 
         if reload:
             self._load_key_mappings(name)
 
     def _select_keymapping_profile(self, name: str, profile: str) -> None:
-        with open("./data/key_mappings.json", "r") as fo:
-            key_maps = json.load(fo)
-            mapping = self._fix_mapping(key_maps[name]["profiles"][profile]["mapping"])
-
         # Set the current key mapping to the selected profile.
         self._current_key_mapping_name.setText(f"Current Key Mapping: <span style='color: green; font-weight: bold;'>{profile}</span>")
-        self._current_key_mapping = mapping
+        self._current_key_profile = name, profile
+        self._current_key_table = self._key_mappings.key_table(name, profile)
+
+        if self._is_broadcasting:
+            self._broadcaster.set_key_table(self._current_key_table)
 
     def _delete_keymapping_profile(self, name: str, profile: str) -> None:
-        # Load the key mappings from the JSON file.
-        with open("./data/key_mappings.json", "r") as fo:
-            key_maps = json.load(fo)
+        self._key_mappings.delete_profile(name, profile)
+
+        # Deleting the profile in use goes back to sending keys unmapped.
+        if self._current_key_profile == (name, profile):
+            self._current_key_mapping_name.setText(
+                "Current Key Mapping: <span style='color: red; font-weight: bold;'>None</span>")
+            self._current_key_profile = None
+            self._current_key_table = IDENTITY_KEY_TABLE
+            if self._is_broadcasting:
+                self._broadcaster.set_key_table(self._current_key_table)
 
-        # Remove the profile from the key mappings and re-write the file.
-        key_maps[name].remove(profile)
-        with open("./data/key_mappings.json", "w") as fo:
-            json.dump(key_maps, fo, indent=4)
+        self._load_key_mappings(name)
 
     def _serialize_keymapping_profile(self, name: str, profile: str, layout: QVBoxLayout, *, reload: bool = False) -> None:
         mappings = {}
@@ -244,9 +289,7 @@ class UI(QDialog):
 
     def _open_modify_keymapping_profile_dialog(self, name: str, profile: str) -> None:
 
-        with open("./data/key_mappings.json", "r") as fo:
-            key_maps = json.load(fo)
-            mapping = self._fix_mapping(key_maps[name]["profiles"][profile]["mapping"])
+        mapping = self._key_mappings.mapping(name, profile)
 
         dialog = QDialog(self)
         dialog.setLayout(QVBoxLayout())
@@ -261,8 +304,8 @@ class UI(QDialog):
 
         for k, v in mapping.items():
             mapping = self._generate_new_key_mapping_widget(content.layout(), pre_checked=True)
-            mapping.property("old_key").setText(QKeySequence(k).toString(QKeySequence.SequenceFormat.NativeText).lower())
-            mapping.property("new_key").setText(QKeySequence(v).toString(QKeySequence.SequenceFormat.NativeText).lower())
+            mapping.property("old_key").setText(key_name(k))
+            mapping.property("new_key").setText(key_name(v))
             mapping.property("old_key")._captured_key_code = k
             mapping.property("new_key")._captured_key_code = v
 
@@ -345,9 +388,19 @@ class UI(QDialog):
         client_port.setInputMask("00000;_")
         client_port.setText("20000")
 
+        client_output_size = QComboBox()
+        for name, size in CLIENT_OUTPUT_SIZES:
+            client_output_size.addItem(name, size)
+
+        # Only a viewer on this computer can read uncompressed frames, so clients have to opt in.
+        client_shared_memory = QCheckBox("Uncompressed")
+        client_shared_memory.setToolTip("Send uncompressed frames through shared memory (for viewers on this computer)")
+
         client_info = QHBoxLayout()
         client_info.addWidget(client_address)
         client_info.addWidget(client_port)
+        client_info.addWidget(client_output_size)
+        client_info.addWidget(client_shared_memory)
 
         remove_client_button = QPushButton("-")
         remove_client_button.setFixedSize(QSize(32, 32))
@@ -362,55 +415,113 @@ class UI(QDialog):
         self._client_addresses.layout().removeItem(client_info)
         client_info.layout().deleteLater()
 
-    def _scan_apps(self) -> None:
-        def _callback(hwnd, _) -> None:
-            if not win32gui.IsWindowVisible(hwnd):
-                return
-            if not win32gui.GetWindowText(hwnd):
-                return
-            if win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE) & win32con.WS_EX_TOOLWINDOW:
-                return
+    @pyqtSlot(list)
+    def _add_apps(self, windows: list[AppWindow]) -> None:
+        for window in windows:
+            self._app_selection.addItem(window.name)
+            self._app_selection.setItemData(
+                self._app_selection.count() - 1,
+                (window.hwnd, window.pid, window.name, window.title),
+                role=Qt.ItemDataRole.UserRole)
+
+    @pyqtSlot(list)
+    def _remove_apps(self, windows: list[AppWindow]) -> None:
+        # Windows are only removed when they close, so this search is rare.
+        hwnds = {window.hwnd for window in windows}
+        for i in reversed(range(self._app_selection.count())):
+            if self._app_selection.itemData(i, role=Qt.ItemDataRole.UserRole)[0] in hwnds:
+                self._app_selection.removeItem(i)
 
-            rect = win32gui.GetWindowRect(hwnd)
-            if rect[2] - rect[0] <= 0 or rect[3] - rect[1] <= 0:
-                return
+    @pyqtSlot(int)
+    def _select_app(self, x: int) -> None:
+        if data := self._app_selection.itemData(x, role=Qt.ItemDataRole.UserRole):
+            from sp2mp.screenshotter import ScreenShotter
 
-            title = win32gui.GetWindowText(hwnd)
-            _, pid = win32process.GetWindowThreadProcessId(hwnd)
+            hwnd, pid, name, title = self._app_selection.itemData(x, role=Qt.ItemDataRole.UserRole)
 
-            # Check if the PID is already in the selection box
-            if any(self._app_selection.itemData(i, role=Qt.ItemDataRole.UserRole)[1] == pid for i in
-                   range(self._app_selection.count())):
+            # The index also changes when windows listed above this one close, which leaves the preview as it is.
+            if self._current_app_selection_data and self._current_app_selection_data[0] == hwnd:
                 return
+            self._current_app_selection_data = hwnd, pid, name, title
+            self._app_preview.set_image(ScreenShotter.take_screenshot(hwnd))
 
-            try:
-                self._app_selection.setEnabled(True)
+            self._load_key_mappings(name)
 
-                process = psutil.Process(pid)
-                exe = process.exe()
-                name = process.name()
+    @pyqtSlot(object)
+    def _select_capture_region(self, region: Optional[tuple[int, int, int, int]]) -> None:
+        # The region is applied straight away if already broadcasting.
+        if self._is_broadcasting:
+            self._broadcaster.set_capture_region(region)
 
-                self._app_selection.addItem(name)
-                self._app_selection.setItemData(
-                    self._app_selection.count() - 1,
-                    (hwnd, pid, name, title),
-                    role=Qt.ItemDataRole.UserRole)
 
-            except (psutil.NoSuchProcess, psutil.AccessDenied):
-                self._app_selection.setDisabled(True)
+class RegionSelector(QLabel):
+    # A preview of the window, which the capture region is dragged out on. The region is in the window's own pixels,
+    # and a click without dragging clears it, so the whole window is broadcast again. Only selections made on the
+    # preview are signalled, so they can be applied to a running broadcast straight away.
+    _scale: float
+    _origin: Optional[QPoint]
+    _rubber_band: QRubberBand
+    _region: Optional[tuple[int, int, int, int]]
 
-        win32gui.EnumWindows(_callback, None)
+    region_selected = pyqtSignal(object)
 
-    @pyqtSlot(int)
-    def _select_app(self, x: int) -> None:
-        if data := self._app_selection.itemData(x, role=Qt.ItemDataRole.UserRole):
-            hwnd, pid, name, title = self._app_selection.itemData(x, role=Qt.ItemDataRole.UserRole)
-            self._current_app_selection_data = hwnd, pid, name, title
-            screen_shot = ScreenShotter.take_screenshot(hwnd)
-            self._app_preview.setPixmap(
-                QPixmap.fromImage(screen_shot.scaled(300, 300, Qt.AspectRatioMode.KeepAspectRatio)))
+    def __init__(self, parent: Optional[QWidget] = None, *args, **kwargs) -> None:
+        super().__init__(parent, *args, **kwargs)
+        self.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        self._scale = 1.0
+        self._origin = None
+        self._rubber_band = QRubberBand(QRubberBand.Shape.Rectangle, self)
+        self._region = None
+
+    @property
+    def region(self) -> Optional[tuple[int, int, int, int]]:
+        return self._region
+
+    def set_image(self, image: QImage) -> None:
+        # A new window's preview clears the old window's region. This isn't signalled: a running broadcast keeps its
+        # region until it's switched to the new window.
+        pixmap = QPixmap.fromImage(image.scaled(self.size(), Qt.AspectRatioMode.KeepAspectRatio))
+        self.setPixmap(pixmap)
+        self._scale = image.width() / max(1, pixmap.width())
+        self._region = None
+        self._rubber_band.hide()
+
+    def mousePressEvent(self, event: QMouseEvent) -> None:
+        if self.pixmap().isNull():
+            return super().mousePressEvent(event)
+        self._origin = self._clamp(event.position().toPoint())
+        self._rubber_band.setGeometry(QRect(self._origin, QSize()))
+        self._rubber_band.show()
+
+    def mouseMoveEvent(self, event: QMouseEvent) -> None:
+        if self._origin is not None:
+            self._rubber_band.setGeometry(QRect(self._origin, self._clamp(event.position().toPoint())).normalized())
+
+    def mouseReleaseEvent(self, event: QMouseEvent) -> None:
+        if self._origin is None:
+            return super().mouseReleaseEvent(event)
+        selection = QRect(self._origin, self._clamp(event.position().toPoint())).normalized()
+        self._origin = None
+
+        # Tiny selections are taken as clicks.
+        if selection.width() < 4 or selection.height() < 4:
+            self._set_region(None)
+            return
+        self._rubber_band.setGeometry(selection)
+        self._set_region(
+            (round(selection.x() * self._scale), round(selection.y() * self._scale),
+             round(selection.width() * self._scale), round(selection.height() * self._scale)))
 
-            self._load_key_mappings(name)
+    def _clamp(self, point: QPoint) -> QPoint:
+        # Keep the selection on the preview image.
+        pixmap = self.pixmap()
+        return QPoint(min(max(point.x(), 0), pixmap.width() - 1), min(max(point.y(), 0), pixmap.height() - 1))
+
+    def _set_region(self, region: Optional[tuple[int, int, int, int]]) -> None:
+        self._region = region
+        if region is None:
+            self._rubber_band.hide()
+        self.region_selected.emit(region)
 
 
 class KeyCaptureButton(QPushButton):
@@ -435,8 +546,9 @@ class KeyCaptureButton(QPushButton):
 
     def keyPressEvent(self, event: QKeyEvent) -> None:
         if self._capture_next_key:
-            self._captured_key_code = event.key()
-            self.setText(event.text())
+            # Virtual key codes are recorded, as they're what clients send, and what the key table maps.
+            self._captured_key_code = event.nativeVirtualKey()
+            self.setText(key_name(self._captured_key_code))
             self._capture_next_key = False
             self._has_selection = True
             event.accept()
@@ -446,32 +558,82 @@ class KeyCaptureButton(QPushButton):
 
 class ReceiverWidget(QWidget):
     _image_display: QLabel
+    _stats_overlay: QLabel
+    _stats_timer: QTimer
     _receiver: Optional[Receiver]
+    _decoder: FrameDecoder
 
     def __init__(self, parent: Optional[QWidget] = None, *args, **kwargs) -> None:
+        from sp2mp.decoder import FrameDecoder
+
         super().__init__(parent, *args, **kwargs)
         self._receiver = None
+        self._decoder = FrameDecoder()
+        self._decoder.frame_decoded.connect(self._show_latest_frame)
+        self._stats_timer = QTimer(self, timeout=self._update_stats_overlay, singleShot=False)
         self._setup_ui()
 
     def _setup_ui(self) -> None:
         self._image_display = QLabel(self)
         self._image_display.setAlignment(Qt.AlignmentFlag.AlignCenter)
         self._image_display.setText("Loading...")
+        self._image_display.setSizePolicy(QSizePolicy.Policy.Ignored, QSizePolicy.Policy.Ignored)
+
+        # The statistics overlay sits over the top left of the frame.
+        self._stats_overlay = QLabel(self._image_display)
+        self._stats_overlay.setStyleSheet("background-color: rgba(0, 0, 0, 160); color: white; padding: 4px;")
+        self._stats_overlay.move(8, 8)
+        self._stats_overlay.hide()
 
         self.setLayout(QVBoxLayout())
         self.layout().addWidget(self._image_display)
         self.hide()
 
-    @pyqtSlot(bytes)
-    def show_image(self, image_data: bytes) -> None:
-        image = QImage.fromData(image_data)
+    def set_receiver(self, receiver: Receiver) -> None:
+        # Frames are handed straight to the decoder on the receiver thread, so decoding never blocks the GUI thread.
+        self._receiver = receiver
+        self._receiver.frame_received.connect(self._decoder.submit)
+
+        # The overlay is only shown for instrumented receivers.
+        self._decoder.set_stats(receiver.stats)
+        self._stats_overlay.setVisible(receiver.stats is not None)
+        if receiver.stats:
+            self._stats_timer.start(500)
+        else:
+            self._stats_timer.stop()
+
+    @pyqtSlot()
+    def _show_latest_frame(self) -> None:
+        # The decoder has already scaled the frame to fit the window, so only the pixmap conversion happens here.
+        if (latest := self._decoder.take_latest()) is None:
+            return
+
+        image, header = latest
+        start = time.perf_counter()
         self._image_display.setPixmap(QPixmap.fromImage(image))
 
+        if stats := self._receiver.stats:
+            stats.add("paint", (time.perf_counter() - start) * 1000)
+            stats.add("total", (time.time_ns() - header.timestamp) / 1e6)
+            self._receiver.frame_displayed(header)
+
+    def _update_stats_overlay(self) -> None:
+        snapshot = self._receiver.stats.snapshot()
+        lines = [f"{snapshot['fps']:.0f} fps, {snapshot['bits_per_second'] / 1e6:.1f} Mbit/s"]
+        for stage, histogram in snapshot["stages"].items():
+            if histogram["count"]:
+                lines.append(f"{stage}: {histogram['p50']:.1f} / {histogram['p95']:.1f} ms")
+        self._stats_overlay.setText("\n".join(lines))
+        self._stats_overlay.adjustSize()
+
+    def resizeEvent(self, event: QResizeEvent) -> None:
+        # Frames may have been downscaled for this client's connection, so they are fitted to the window.
+        self._decoder.set_target_size(self._image_display.size())
+        super().resizeEvent(event)
+
     def keyPressEvent(self, event: QKeyEvent) -> None:
         # Capture key press events and forward them to the server.
-        key = event.nativeVirtualKey()
-        mapped_event = KeyboardEvent(key_code=key, key_down=True)
-        self._receiver._send_to_socket.send(EventProtocol.KEYBOARD.value + pickle.dumps(mapped_event))
+        self._receiver.send_key_event(event.nativeVirtualKey(), True)
         super().keyPressEvent(event)
 
     def keyReleaseEvent(self, event: QKeyEvent) -> None:
@@ -479,7 +641,5 @@ class ReceiverWidget(QWidget):
             return
 
         # Capture key release events and forward them to the server.
-        key = event.nativeVirtualKey()
-        mapped_event = KeyboardEvent(key_code=key, key_down=False)
-        self._receiver._send_to_socket.send(EventProtocol.KEYBOARD.value + pickle.dumps(mapped_event))
+        self._receiver.send_key_event(event.nativeVirtualKey(), False)
         super().keyReleaseEvent(event)
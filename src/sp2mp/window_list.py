@@ -0,0 +1,115 @@
+from dataclasses import dataclass
+from threading import Event, Thread
+from typing import Optional
+
+from PyQt6.QtCore import QObject, pyqtSignal
+
+
+@dataclass(frozen=True)
+class AppWindow:
+    hwnd: int
+    pid: int
+    name: str
+    title: str
+
+
+class WindowEnumerator(QObject):
+    # Lists the capturable windows (one per process) on a background thread, and signals only the windows that have
+    # appeared or gone since the last scan. Process names are cached by pid, so each process is only looked up once.
+    _interval: float
+    _windows: dict[int, AppWindow]
+    _process_names: dict[int, Optional[str]]
+    _stopped: Event
+    _thread: Thread
+
+    windows_added = pyqtSignal(list)
+    windows_removed = pyqtSignal(list)
+
+    def __init__(self, interval: float = 1.0) -> None:
+        super().__init__()
+        self._interval = interval
+        self._windows = {}
+        self._process_names = {}
+        self._stopped = Event()
+
+        self._thread = Thread(target=self._scan_loop)
+        self._thread.daemon = True
+
+    def set_interval(self, interval: float) -> None:
+        self._interval = interval
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def _scan_loop(self) -> None:
+        # The Windows modules are only needed (and only available) once scanning starts.
+        import win32gui
+
+        while not self._stopped.is_set():
+            try:
+                visible = self._find_windows()
+            except win32gui.error:
+                # Windows can close part way through the enumeration, so just try again on the next scan.
+                pass
+            else:
+                self._update(visible)
+            self._stopped.wait(self._interval)
+
+    @staticmethod
+    def _find_windows() -> dict[int, tuple[int, str]]:
+        # The pid and title of every visible, titled, non-tool window, by hwnd.
+        import win32con
+        import win32gui
+        import win32process
+
+        def _callback(hwnd: int, visible: dict[int, tuple[int, str]]) -> None:
+            if not win32gui.IsWindowVisible(hwnd):
+                return
+            if win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE) & win32con.WS_EX_TOOLWINDOW:
+                return
+            if not (title := win32gui.GetWindowText(hwnd)):
+                return
+
+            l, t, r, b = win32gui.GetWindowRect(hwnd)
+            if r - l <= 0 or b - t <= 0:
+                return
+
+            visible[hwnd] = win32process.GetWindowThreadProcessId(hwnd)[1], title
+
+        visible = {}
+        win32gui.EnumWindows(_callback, visible)
+        return visible
+
+    def _process_name(self, pid: int) -> Optional[str]:
+        import psutil
+
+        # Processes that can't be queried (like elevated ones) are remembered too, so they aren't retried every scan.
+        if pid not in self._process_names:
+            try:
+                self._process_names[pid] = psutil.Process(pid).name()
+            except (psutil.NoSuchProcess, psutil.AccessDenied):
+                self._process_names[pid] = None
+        return self._process_names[pid]
+
+    def _update(self, visible: dict[int, tuple[int, str]]) -> None:
+        # A process keeps its window while that window is still open, so its entry doesn't change between scans.
+        windows = {pid: window for pid, window in self._windows.items() if visible.get(window.hwnd, (None,))[0] == pid}
+        for hwnd, (pid, title) in visible.items():
+            if pid not in windows and (name := self._process_name(pid)) is not None:
+                windows[pid] = AppWindow(hwnd, pid, name, title)
+
+        removed = [window for pid, window in self._windows.items() if windows.get(pid) != window]
+        added = [window for pid, window in windows.items() if self._windows.get(pid) != window]
+        self._windows = windows
+
+        # Forget processes that have exited, as their pids can be reused.
+        pids = {pid for pid, _ in visible.values()}
+        self._process_names = {pid: name for pid, name in self._process_names.items() if pid in pids}
+
+        if removed:
+            self.windows_removed.emit(removed)
+        if added:
+            self.windows_added.emit(added)
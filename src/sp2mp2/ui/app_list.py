@@ -1,69 +1,36 @@
-import psutil
-import win32con
-import win32gui
-import win32process
-from PyQt6.QtCore import QTimer, Qt
+from PyQt6.QtCore import Qt
 from PyQt6.QtWidgets import QComboBox, QWidget
 
+from sp2mp.window_list import AppWindow, WindowEnumerator
+
 
 class AppList(QWidget):
     _app_selection: QComboBox
-    _app_scan_timer: QTimer
+    _window_enumerator: WindowEnumerator
 
     def __init__(self, parent: QWidget, *args, **kwargs) -> None:
         super().__init__(parent, *args, **kwargs)
         self._app_selection = kwargs.get("app_selection")
-        self._app_scan_timer = QTimer(self, singleShot=False, timeout=self._scan_apps)
+        self._window_enumerator = WindowEnumerator()
+        self._window_enumerator.windows_added.connect(self._add_apps)
+        self._window_enumerator.windows_removed.connect(self._remove_apps)
 
     def begin_scanning(self, interval: int = 1000) -> None:
-        self._app_scan_timer.start(interval)
-
-    def _scan_apps(self) -> None:
-        def _callback(hwnd, _) -> None:
-            # Skip if the window is invisible.
-            if not win32gui.IsWindowVisible(hwnd):
-                return
-
-            # Skip if the window has no title.
-            if not win32gui.GetWindowText(hwnd):
-                return
-
-            # Skip if the window is a tool window (like task manager).
-            if win32gui.GetWindowLong(hwnd, win32con.GWL_EXSTYLE) & win32con.WS_EX_TOOLWINDOW:
-                return
-
-            # Skip if the window has no size.
-            rect = win32gui.GetWindowRect(hwnd)
-            if rect[2] - rect[0] <= 0 or rect[3] - rect[1] <= 0:
-                return
-
-            # Get the window title and process ID.
-            title = win32gui.GetWindowText(hwnd)
-            _, pid = win32process.GetWindowThreadProcessId(hwnd)
-
-            # Check if the PID is already in the selection box
-            if any(self._app_selection.itemData(i, role=Qt.ItemDataRole.UserRole)[1] == pid for i in range(self._app_selection.count())):
-                return
-
-            try:
-                # Ensure the combo box is enabled before adding items.
-                self._app_selection.setEnabled(True)
-
-                # Get the process information.
-                process = psutil.Process(pid)
-                exe = process.exe()
-                name = process.name()
-
-                # Add the information to the combo box.
-                self._app_selection.addItem(name)
-                self._app_selection.setItemData(self._app_selection.count() - 1, (hwnd, pid, name, title), role=Qt.ItemDataRole.UserRole)
-
-            except psutil.NoSuchProcess:
-                # If there is an error with the process, skip it.
-                self._app_selection.setDisabled(True)
-
-            except psutil.AccessDenied:
-                # If access is denied, disable the selection box.
-                self._app_selection.setDisabled(True)
-
-        win32gui.EnumWindows(_callback, None)
+        # Windows are listed on a background thread, and only the changes are applied to the combo box.
+        self._window_enumerator.set_interval(interval / 1000)
+        self._window_enumerator.start()
+
+    def _add_apps(self, windows: list[AppWindow]) -> None:
+        for window in windows:
+            # Add the information to the combo box.
+            self._app_selection.addItem(window.name)
+            self._app_selection.setItemData(
+                self._app_selection.count() - 1, (window.hwnd, window.pid, window.name, window.title),
+                role=Qt.ItemDataRole.UserRole)
+
+    def _remove_apps(self, windows: list[AppWindow]) -> None:
+        # Remove the windows that have closed.
+        hwnds = {window.hwnd for window in windows}
+        for i in reversed(range(self._app_selection.count())):
+            if self._app_selection.itemData(i, role=Qt.ItemDataRole.UserRole)[0] in hwnds:
+                self._app_selection.removeItem(i)
@@ -0,0 +1,180 @@
+import asyncio
+import socket
+import time
+from concurrent.futures import Future
+
+import pytest
+
+pytest.importorskip("PyQt6.QtGui")
+
+from sp2mp.broadcaster import Broadcaster, CaptureStream
+from sp2mp.frame_source import SyntheticFrameSource
+from sp2mp.protocol import FrameFlag, FrameHeader, FrameType
+from sp2mp.quality import EncodeSettings
+from sp2mp.receiver import Receiver
+from sp2mp.relay import Relay
+
+
+class _FailingSource(SyntheticFrameSource):
+    # Like a captured window that's closed after a few frames.
+    def __init__(self, frames: int) -> None:
+        super().__init__(320, 240, 1.0)
+        self.frames = frames
+
+    def capture(self):
+        if self.frames == 0:
+            raise OSError("The window was closed")
+        self.frames -= 1
+        return super().capture()
+
+
+def _free_ports(count: int) -> list[int]:
+    sockets = [socket.socket() for _ in range(count)]
+    for sock in sockets:
+        sock.bind(("", 0))
+    ports = [sock.getsockname()[1] for sock in sockets]
+    for sock in sockets:
+        sock.close()
+    return ports
+
+
+class _LoopbackClients:
+    # Receivers on loopback ports, recording the type of every frame they're sent.
+    def __init__(self, count: int) -> None:
+        self.ports = _free_ports(count)
+        self.receivers = [Receiver(port) for port in self.ports]
+        self.frame_types = [[] for _ in self.receivers]
+        for receiver, frame_types in zip(self.receivers, self.frame_types):
+            receiver.frame_received.connect(lambda header, data, types=frame_types: types.append(header.frame_type))
+
+    def wait_for(self, frames: int, timeout: float = 10.0) -> None:
+        end = time.monotonic() + timeout
+        while min(map(len, self.frame_types)) < frames and time.monotonic() < end:
+            time.sleep(0.01)
+
+    def close(self) -> None:
+        for receiver in self.receivers:
+            receiver.close()
+
+
+def _broadcast(source: SyntheticFrameSource, clients: _LoopbackClients, frames: int, **kwargs) -> Broadcaster:
+    broadcaster = Broadcaster(source, ["127.0.0.1"] * len(clients.ports), clients.ports, **kwargs)
+    broadcaster.broadcast()
+    try:
+        clients.wait_for(frames)
+    finally:
+        broadcaster.stop()
+        clients.close()
+    return broadcaster
+
+
+def test_clients_with_the_same_settings_share_one_encode() -> None:
+    clients = _LoopbackClients(4)
+    broadcaster = _broadcast(SyntheticFrameSource(320, 240, 1.0), clients, 20, fps=60)
+
+    assert broadcaster.frames_captured >= 20
+    assert broadcaster.encode_count == broadcaster.frames_captured
+    for frame_types in clients.frame_types:
+        assert len(frame_types) >= 20
+        assert set(frame_types) == {FrameType.IMAGE}
+
+
+def test_unchanged_frames_are_skipped_with_heartbeats() -> None:
+    clients = _LoopbackClients(1)
+    broadcaster = _broadcast(SyntheticFrameSource(320, 240, 0.0), clients, 3, fps=60)
+
+    # The first frame is sent whole (again if the client's keyframe request comes after it), then only heartbeats.
+    frame_types = clients.frame_types[0]
+    assert frame_types[0] == FrameType.IMAGE
+    first_heartbeat = frame_types.index(FrameType.HEARTBEAT)
+    assert set(frame_types[first_heartbeat:]) == {FrameType.HEARTBEAT}
+    assert broadcaster.encode_count <= 2
+    assert broadcaster.skip_ratio > 0.95
+
+
+def test_capture_errors_skip_frames_until_the_source_is_replaced() -> None:
+    clients = _LoopbackClients(1)
+    source = _FailingSource(10)
+    broadcaster = Broadcaster(source, ["127.0.0.1"], clients.ports, fps=60)
+    broadcaster.broadcast()
+    try:
+        end = time.monotonic() + 10
+        while source.frames and time.monotonic() < end:
+            time.sleep(0.01)
+        time.sleep(0.2)
+        received = len(clients.frame_types[0])
+        time.sleep(0.2)
+        assert len(clients.frame_types[0]) == received
+
+        broadcaster.reset_source(SyntheticFrameSource(320, 240, 1.0))
+        clients.wait_for(received + 10)
+    finally:
+        broadcaster.stop()
+        clients.close()
+
+    assert len(clients.frame_types[0]) >= received + 10
+
+
+def test_pool_encodes_add_worker_time_and_skip_failures() -> None:
+    broadcaster = Broadcaster(SyntheticFrameSource(320, 240, 1.0), [], [])
+    delivered = []
+    broadcaster._deliver_frames = delivered.extend
+
+    failed, encoded = Future(), Future()
+    failed.set_exception(RuntimeError("The worker died"))
+    encoded.set_result((b"frame", 0.025))
+    streams = [CaptureStream(60, EncodeSettings()), CaptureStream(60, EncodeSettings(quality=50))]
+    header = FrameHeader(FrameType.IMAGE, FrameFlag.KEYFRAME, 0, 0, 0)
+    asyncio.run(broadcaster._deliver_encoded([(streams[0], header, failed), (streams[1], header, encoded)], 0, None))
+    broadcaster.stop()
+
+    assert [(stream, packet.header.length, packet.payload) for stream, packet in delivered] == [
+        (streams[1], 5, b"frame")]
+    assert broadcaster.stage_times.snapshot()["encode"] == (0.025, 1)
+
+
+def test_only_clients_that_opt_in_are_sent_shared_memory_frames() -> None:
+    clients = _LoopbackClients(2)
+    broadcaster = Broadcaster(SyntheticFrameSource(320, 240, 1.0), [], [], fps=60)
+    broadcaster.add_new_client("127.0.0.1", clients.ports[0], shared_memory=True)
+    broadcaster.add_new_client("127.0.0.1", clients.ports[1])
+    broadcaster.broadcast()
+    try:
+        clients.wait_for(5)
+    finally:
+        broadcaster.stop()
+        clients.close()
+
+    assert set(clients.frame_types[0]) == {FrameType.SHARED}
+    assert set(clients.frame_types[1]) == {FrameType.IMAGE}
+
+
+def test_relay_on_the_same_host_is_sent_encoded_frames() -> None:
+    relay_port, = _free_ports(1)
+    clients = _LoopbackClients(1)
+    relay = Relay(relay_port, [], [])
+    relay.add_new_client("127.0.0.1", clients.ports[0], shared_memory=True)
+    relay.broadcast()
+    broadcaster = Broadcaster(SyntheticFrameSource(320, 240, 1.0), ["127.0.0.1"], [relay_port], fps=60)
+    broadcaster.broadcast()
+    try:
+        clients.wait_for(5)
+    finally:
+        broadcaster.stop()
+        relay.stop()
+        clients.close()
+
+    assert len(clients.frame_types[0]) >= 5
+    assert set(clients.frame_types[0]) == {FrameType.IMAGE}
+
+
+def test_capture_region_is_clipped_to_the_frame() -> None:
+    source = SyntheticFrameSource(320, 240, 1.0)
+    broadcaster = Broadcaster(source, [], [])
+    screenshot = source.capture()
+    assert broadcaster._crop(screenshot) is screenshot
+
+    broadcaster.set_capture_region((300, 200, 100, 100))
+    cropped = broadcaster._crop(screenshot)
+    broadcaster.stop()
+    assert cropped == screenshot.copy(300, 200, 20, 40)
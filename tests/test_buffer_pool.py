@@ -0,0 +1,67 @@
+import pytest
+
+from sp2mp.buffer_pool import BufferPool
+from sp2mp.protocol import FrameFlag, FrameHeader, FrameType, Packet
+
+
+def test_buffer_is_reused_after_last_release():
+    pool = BufferPool()
+    buffer = pool.acquire(1000)
+    buffer.retain()
+
+    buffer.release()
+    assert pool.acquire(1000) is not buffer
+
+    buffer.release()
+    assert pool.acquire(1000) is buffer
+    assert (pool.allocations, pool.reuses) == (2, 1)
+
+
+def test_similar_sizes_share_buffers():
+    pool = BufferPool()
+    buffer = pool.acquire(100_000)
+    capacity = buffer.capacity
+    assert 100_000 <= capacity <= 125_000
+    buffer.release()
+
+    reused = pool.acquire(capacity - 1)
+    assert reused is buffer
+    assert len(reused) == capacity - 1
+    assert pool.acquire(capacity + 1) is not buffer
+
+
+def test_pool_without_free_buffers_allocates_every_time():
+    pool = BufferPool(max_free=0)
+    buffer = pool.acquire(1000)
+    buffer.release()
+
+    assert pool.acquire(1000) is not buffer
+    assert pool.snapshot()["free_bytes"] == 0
+
+
+def test_write_and_view():
+    buffer = BufferPool().acquire(0)
+    buffer.write(memoryview(b"frame"))
+    assert bytes(buffer.view) == b"frame"
+
+    with pytest.raises(ValueError):
+        buffer.set_length(buffer.capacity + 1)
+
+
+def test_packet_holds_buffer_references():
+    pool = BufferPool()
+    buffer = pool.acquire(5)
+    buffer.write(memoryview(b"frame"))
+    packet = Packet(FrameHeader(FrameType.IMAGE, FrameFlag.KEYFRAME, 0, 0, 5), buffer)
+    assert packet.buffer is buffer
+    assert bytes(packet.payload) == b"frame"
+
+    # Two clients take a reference each, and the producer drops its own.
+    packet.retain()
+    packet.retain()
+    packet.release()
+    packet.release()
+    assert pool.snapshot()["free_bytes"] == 0
+
+    packet.release()
+    assert pool.snapshot()["free_bytes"] == buffer.capacity
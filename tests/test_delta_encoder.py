@@ -0,0 +1,83 @@
+import pytest
+
+pytest.importorskip("PyQt6.QtGui")
+
+from PyQt6.QtGui import QColor, QImage
+
+from sp2mp.encoder import DeltaEncoder, FrameChangeDetector, FrameEncoder, ScaledFrames, frame_checksum
+from sp2mp.protocol import FrameFlag, FrameType, unpack_tiles
+from sp2mp.quality import EncodeSettings
+
+
+def _image(width: int = 512, height: int = 256) -> QImage:
+    image = QImage(width, height, QImage.Format.Format_ARGB32)
+    image.fill(QColor(20, 40, 60))
+    return image
+
+
+def test_first_frame_is_a_keyframe() -> None:
+    encoder = DeltaEncoder(FrameEncoder(), tile_size=128)
+    frame_type, flags, data = encoder.encode(_image())
+    assert frame_type == FrameType.IMAGE
+    assert flags & FrameFlag.KEYFRAME
+    assert not QImage.fromData(data).isNull()
+
+
+def test_only_changed_tiles_are_sent() -> None:
+    encoder = DeltaEncoder(FrameEncoder(), tile_size=128)
+    encoder.encode(_image())
+
+    image = _image()
+    image.setPixelColor(200, 10, QColor(255, 255, 255))
+    frame_type, flags, data = encoder.encode(image)
+    assert frame_type == FrameType.TILES
+    assert not flags & FrameFlag.KEYFRAME
+
+    width, height, tiles = unpack_tiles(data)
+    assert (width, height) == (512, 256)
+    assert [(x, y) for x, y, _ in tiles] == [(128, 0)]
+
+
+def test_unchanged_frame_sends_no_tiles() -> None:
+    encoder = DeltaEncoder(FrameEncoder(), tile_size=128)
+    encoder.encode(_image())
+    frame_type, _, data = encoder.encode(_image())
+    assert frame_type == FrameType.TILES
+    assert list(unpack_tiles(data)[2]) == []
+
+
+def test_keyframes_on_resize_request_and_interval() -> None:
+    encoder = DeltaEncoder(FrameEncoder(), tile_size=128, keyframe_interval=2)
+    encoder.encode(_image())
+    assert encoder.encode(_image(256, 256))[0] == FrameType.IMAGE
+
+    encoder.request_keyframe()
+    assert encoder.encode(_image(256, 256))[0] == FrameType.IMAGE
+
+    # Two delta frames, then the interval forces a keyframe.
+    frame_types = [encoder.encode(_image(256, 256))[0] for _ in range(3)]
+    assert frame_types == [FrameType.TILES, FrameType.TILES, FrameType.IMAGE]
+
+
+def test_change_detector() -> None:
+    detector = FrameChangeDetector()
+    image = _image()
+    assert detector.has_changed(frame_checksum(image))
+    assert not detector.has_changed(frame_checksum(_image()))
+
+    image.setPixel(1, 1, 0xFFFFFFFF)
+    assert detector.has_changed(frame_checksum(image))
+    assert not detector.has_changed(frame_checksum(image))
+    assert detector.has_changed(frame_checksum(_image(512, 128)))
+
+    detector.reset()
+    assert detector.has_changed(frame_checksum(_image(512, 128)))
+
+
+def test_frames_are_scaled_once_per_output_size() -> None:
+    frames = ScaledFrames(_image())
+    scaled = frames.get(EncodeSettings(90, output_size=(256, 256)))
+    assert (scaled.width(), scaled.height()) == (256, 128)
+    assert frames.get(EncodeSettings(50, output_size=(256, 256))) is scaled
+    assert frames.get(EncodeSettings(90, 0.5)) is scaled
+    assert frames.get(EncodeSettings(90, output_size=(128, 128))) is not scaled
@@ -0,0 +1,49 @@
+import threading
+
+import pytest
+
+from sp2mp.frame_slot import FrameSlot
+
+
+def test_newest_frames_win() -> None:
+    slot = FrameSlot(depth=2)
+    assert not slot.put(1)
+    assert not slot.put(2)
+    assert slot.put(3)
+
+    assert slot.dropped_frames == 1
+    assert slot.get(timeout=0) == 2
+    assert slot.get(timeout=0) == 3
+    assert slot.get(timeout=0) is None
+
+
+def test_discarded_frames_are_reported() -> None:
+    discarded = []
+    slot = FrameSlot(depth=1, discard=discarded.append)
+    slot.put("a")
+    slot.put("b")
+    assert discarded == ["a"]
+
+    slot.close()
+    assert discarded == ["a", "b"]
+
+    # Frames put after the slot is closed are discarded straight away.
+    assert not slot.put("c")
+    assert discarded == ["a", "b", "c"]
+
+
+def test_close_wakes_waiting_getter() -> None:
+    slot = FrameSlot()
+    result = []
+    thread = threading.Thread(target=lambda: result.append(slot.get()))
+    thread.start()
+
+    slot.close()
+    thread.join(timeout=1)
+    assert result == [None]
+    assert slot.closed
+
+
+def test_invalid_depth() -> None:
+    with pytest.raises(ValueError):
+        FrameSlot(depth=0)
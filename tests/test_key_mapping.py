@@ -0,0 +1,82 @@
+import json
+
+from sp2mp.key_mapping import DEFAULT_BLOCKED_KEYS, IDENTITY_KEY_TABLE, KeyMappingStore, compile_key_table, key_name
+
+
+def test_identity_table_blocks_default_keys():
+    assert IDENTITY_KEY_TABLE[0x41] == 0x41
+    assert IDENTITY_KEY_TABLE[0] == 0
+    for key in DEFAULT_BLOCKED_KEYS:
+        assert IDENTITY_KEY_TABLE[key] == 0
+
+
+def test_mapping():
+    table = compile_key_table({0x57: 0x26, 0x41: 0x25})
+    assert table[0x57] == 0x26
+    assert table[0x41] == 0x25
+    assert table[0x42] == 0x42
+    assert table[0x5B] == 0
+
+
+def test_allowed_and_blocked_apply_after_mapping():
+    table = compile_key_table({0x57: 0x26, 0x26: 0x57}, allowed=[0x26, 0x28], blocked=[0x28])
+    assert table[0x57] == 0x26
+    assert table[0x26] == 0
+    assert table[0x28] == 0
+    assert table[0x41] == 0
+
+
+def test_mapping_to_a_blocked_key_is_dropped():
+    assert compile_key_table({0x41: 0x5B})[0x41] == 0
+    assert compile_key_table({0x41: 0x5B}, blocked=[])[0x41] == 0x5B
+
+
+def test_key_name():
+    assert key_name(0x41) == "a"
+    assert key_name(0x31) == "1"
+    assert key_name(0x25) == "left"
+    assert key_name(0x70) == "f1"
+    assert key_name(0xFF) == "0xff"
+
+
+def test_store_round_trip(tmp_path):
+    path = tmp_path / "data" / "key_mappings.json"
+    store = KeyMappingStore(str(path))
+    assert store.profiles("game.exe") == []
+
+    store.set_mapping("game.exe", "Player 2", {0x57: 0x26})
+    store.set_mapping("game.exe", "Other", {0x41: 0x25})
+    store.delete_profile("game.exe", "Other")
+    store.close()
+
+    loaded = KeyMappingStore(str(path))
+    assert loaded.profiles("game.exe") == ["Player 2"]
+    assert loaded.mapping("game.exe", "Player 2") == {0x57: 0x26}
+    assert loaded.key_table("game.exe", "Player 2")[0x57] == 0x26
+    loaded.close()
+
+
+def test_store_profile_key_lists(tmp_path):
+    path = tmp_path / "key_mappings.json"
+    path.write_text(json.dumps({"game.exe": {"profiles": {"P": {
+        "name": "P", "mapping": {"87": 38}, "allowed": [38, 91], "blocked": []}}}}))
+    store = KeyMappingStore(str(path))
+
+    table = store.key_table("game.exe", "P")
+    assert table[0x57] == 0x26
+    assert table[0x5B] == 0x5B
+    assert table[0x41] == 0
+    store.close()
+
+
+def test_store_converts_qt_key_codes(tmp_path, caplog):
+    # Left to Up, Escape to A, and Home to a Qt only key (which is dropped).
+    path = tmp_path / "key_mappings.json"
+    path.write_text(json.dumps({"game.exe": {"profiles": {"P": {
+        "name": "P", "mapping": {str(0x01000012): 0x01000013, str(0x01000000): 0x41, str(0x01000010): 0x01001103}}}}}))
+    store = KeyMappingStore(str(path))
+    store.close()
+
+    assert store.mapping("game.exe", "P") == {0x25: 0x26, 0x1B: 0x41}
+    assert "no virtual key" in caplog.text
+    assert json.loads(path.read_text())["game.exe"]["profiles"]["P"]["mapping"] == {"37": 0x26, "27": 0x41}
@@ -0,0 +1,59 @@
+import asyncio
+
+import pytest
+
+from sp2mp.protocol import EventFlag, EventProtocol, EventRecord, FrameFlag, FrameHeader, FrameType, ProtocolError, \
+    pack_tiles, read_event_records, unpack_tiles
+
+
+def test_frame_header_round_trip() -> None:
+    header = FrameHeader(FrameType.TILES, FrameFlag.KEYFRAME | FrameFlag.TIMINGS, 0xFFFFFFFF, 123456789, 4096)
+    data = header.pack()
+    assert len(data) == FrameHeader.STRUCT.size
+    assert FrameHeader.unpack(data) == header
+
+
+@pytest.mark.parametrize("offset, value", [(0, b"X"), (4, b"\x09"), (5, b"\x7f")])
+def test_frame_header_rejects_invalid_fields(offset: int, value: bytes) -> None:
+    # The magic, the protocol version and the frame type are checked.
+    data = bytearray(FrameHeader(FrameType.IMAGE, FrameFlag.NONE, 1, 2, 3).pack())
+    data[offset:offset + 1] = value
+    with pytest.raises(ProtocolError):
+        FrameHeader.unpack(data)
+
+
+def test_event_record_round_trip() -> None:
+    records = [
+        EventRecord(EventProtocol.KEYBOARD, EventFlag.KEY_DOWN, 0x41, 7, 1000),
+        EventRecord(EventProtocol.ACK, EventFlag.NONE, 0, 0xFFFFFFFF, 2000)]
+    data = b"".join(record.pack() for record in records)
+    unpacked = [
+        EventRecord(EventProtocol(event_type), EventFlag(flags), key_code, sequence, timestamp)
+        for event_type, flags, key_code, sequence, timestamp in EventRecord.STRUCT.iter_unpack(data)]
+    assert unpacked == records
+
+
+def test_tiles_round_trip() -> None:
+    tiles = [(0, 0, b"first"), (128, 64, b""), (256, 128, b"third tile")]
+    width, height, unpacked = unpack_tiles(pack_tiles(640, 480, tiles))
+    assert (width, height) == (640, 480)
+    assert [(x, y, bytes(data)) for x, y, data in unpacked] == tiles
+
+
+def test_read_event_records_reassembles_partial_records() -> None:
+    records = [EventRecord(EventProtocol.KEYBOARD, EventFlag.NONE, key, key, key).pack() for key in range(5)]
+    data = b"".join(records)
+
+    async def _read() -> list[bytes]:
+        reader = asyncio.StreamReader()
+        # Split the records at awkward points, so some arrive in pieces.
+        for start in range(0, len(data), 7):
+            reader.feed_data(data[start:start + 7])
+        reader.feed_eof()
+
+        handled = []
+        await read_event_records(reader, lambda view: handled.append(bytes(view)))
+        return handled
+
+    handled = b"".join(asyncio.run(_read()))
+    assert handled == data
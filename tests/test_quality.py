@@ -0,0 +1,69 @@
+from sp2mp.quality import QUALITY_LADDER, QualityController
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _controller(clock: FakeClock) -> QualityController:
+    return QualityController(60, level=1, step_down_cooldown=0.5, step_up_after=3.0, clock=clock)
+
+
+def test_steps_down_when_frames_are_dropped() -> None:
+    clock = FakeClock()
+    controller = _controller(clock)
+    assert controller.update(0.001, 0, 0) is None
+
+    clock.now = 1.0
+    assert controller.update(0.001, 0, 1) == QUALITY_LADDER[2]
+
+
+def test_step_down_waits_for_the_cooldown() -> None:
+    clock = FakeClock()
+    controller = _controller(clock)
+    controller.update(0.001, 0, 0)
+
+    clock.now = 1.0
+    assert controller.update(0.001, 10, 0) == QUALITY_LADDER[2]
+    clock.now = 1.2
+    assert controller.update(0.001, 10, 0) is None
+    clock.now = 1.6
+    assert controller.update(0.001, 10, 0) == QUALITY_LADDER[3]
+
+
+def test_slow_sends_count_as_congestion() -> None:
+    clock = FakeClock()
+    controller = _controller(clock)
+    clock.now = 1.0
+
+    # Sending takes longer than the frame interval. The send time is smoothed, so one slow send isn't enough.
+    assert controller.update(0.02, 0, 0) is None
+    results = [controller.update(0.02, 0, 0) for _ in range(5)]
+    assert QUALITY_LADDER[2] in results
+
+
+def test_steps_up_after_a_healthy_period() -> None:
+    clock = FakeClock()
+    controller = _controller(clock)
+    controller.update(0.001, 0, 0)
+
+    clock.now = 2.9
+    assert controller.update(0.001, 0, 0) is None
+    clock.now = 3.1
+    assert controller.update(0.001, 0, 0) == QUALITY_LADDER[0]
+
+    # Already at the best settings.
+    clock.now = 10.0
+    assert controller.update(0.001, 0, 0) is None
+
+
+def test_drops_before_connecting_are_ignored() -> None:
+    clock = FakeClock()
+    controller = _controller(clock)
+    clock.now = 1.0
+    assert controller.update(0.001, 0, 5) is None
+    assert controller.settings == QUALITY_LADDER[1]
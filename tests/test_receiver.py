@@ -0,0 +1,86 @@
+from sp2mp.buffer_pool import BufferPool
+from sp2mp.protocol import FRAME_TIMINGS, INPUT_ECHO, FrameFlag, FrameHeader, FrameType
+from sp2mp.receiver import _FrameProtocol
+
+
+class FakeTransport:
+    def __init__(self):
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeReceiver:
+    def __init__(self):
+        self.pool = BufferPool()
+        self.frames = []
+
+    def _connection_made(self, transport):
+        pass
+
+    def _connection_lost(self, transport):
+        pass
+
+    def _frame_received(self, transport, header, payload):
+        self.frames.append((header, bytes(payload.view)))
+
+
+def feed(protocol, data, chunk_size):
+    for offset in range(0, len(data), chunk_size):
+        chunk = data[offset:offset + chunk_size]
+        while chunk:
+            buffer = protocol.get_buffer(len(chunk))
+            size = min(len(buffer), len(chunk))
+            buffer[:size] = chunk[:size]
+            protocol.buffer_updated(size)
+            chunk = chunk[size:]
+
+
+def connect():
+    receiver, transport = FakeReceiver(), FakeTransport()
+    protocol = _FrameProtocol(receiver)
+    protocol.connection_made(transport)
+    return receiver, transport, protocol
+
+
+def test_frames_split_across_reads():
+    receiver, transport, protocol = connect()
+    stream = b""
+    for sequence, payload in enumerate([b"first", b"", b"x" * 10000]):
+        frame_type = FrameType.HEARTBEAT if not payload else FrameType.IMAGE
+        stream += FrameHeader(frame_type, FrameFlag.NONE, sequence, 1000, len(payload)).pack() + payload
+    feed(protocol, stream, 7)
+
+    assert [(header.sequence, header.frame_type, payload) for header, payload in receiver.frames] == [
+        (0, FrameType.IMAGE, b"first"), (1, FrameType.HEARTBEAT, b""), (2, FrameType.IMAGE, b"x" * 10000)]
+    assert not transport.closed
+
+
+def test_header_extensions():
+    receiver, _, protocol = connect()
+    flags = FrameFlag.KEYFRAME | FrameFlag.TIMINGS | FrameFlag.INPUT_ECHO
+    header = FrameHeader(FrameType.IMAGE, flags, 5, 1000, 3)
+    feed(protocol, header.pack() + FRAME_TIMINGS.pack(2000, 3000) + INPUT_ECHO.pack(42) + b"abc", 5)
+
+    received, payload = receiver.frames[0]
+    assert (received.encoded, received.sent, received.input_sequence, received.length) == (2000, 3000, 42, 3)
+    assert payload == b"abc"
+
+
+def test_payload_buffers_are_reused():
+    receiver, _, protocol = connect()
+    frame = FrameHeader(FrameType.IMAGE, FrameFlag.NONE, 0, 1000, 100).pack() + b"y" * 100
+    feed(protocol, frame * 10, 4096)
+
+    assert len(receiver.frames) == 10
+    assert receiver.pool.allocations == 1
+    assert receiver.pool.reuses == 9
+
+
+def test_invalid_header_closes_connection():
+    receiver, transport, protocol = connect()
+    feed(protocol, b"XXXX" + bytes(FrameHeader.STRUCT.size - 4), 64)
+
+    assert transport.closed
+    assert receiver.frames == []
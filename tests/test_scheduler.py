@@ -0,0 +1,77 @@
+import random
+
+import pytest
+
+from sp2mp.scheduler import FrameScheduler
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_wait_achieves_target_rate_with_variable_work() -> None:
+    clock = FakeClock()
+    scheduler = FrameScheduler(60, clock=clock, sleep=clock.sleep)
+    rng = random.Random(1)
+
+    start = clock()
+    frames = 600
+    for _ in range(frames):
+        scheduler.wait()
+        clock.now += rng.uniform(0.2, 0.9) / 60
+
+    achieved = frames / (clock() - start)
+    assert achieved == pytest.approx(60, rel=0.01)
+    assert scheduler.missed_frames == 0
+
+
+def test_wait_deadlines_do_not_drift() -> None:
+    clock = FakeClock()
+    scheduler = FrameScheduler(60, clock=clock, sleep=clock.sleep)
+
+    deadlines = []
+    for _ in range(120):
+        deadlines.append(scheduler.wait())
+        clock.now += 0.005
+
+    assert deadlines[-1] - deadlines[0] == pytest.approx(119 / 60)
+
+
+def test_wait_skips_missed_deadlines() -> None:
+    clock = FakeClock()
+    scheduler = FrameScheduler(60, clock=clock, sleep=clock.sleep)
+
+    first = scheduler.wait()
+    clock.now += 2.5 / 60
+
+    # The late frame runs straight away, but the whole interval missed before it is skipped, rather than being sent in
+    # a burst to catch up.
+    assert scheduler.wait() == pytest.approx(first + 2 / 60)
+    assert clock() == pytest.approx(first + 2.5 / 60)
+    assert scheduler.missed_frames == 1
+
+    # Then the schedule carries on from the original deadlines.
+    assert scheduler.wait() == pytest.approx(first + 3 / 60)
+    assert clock() == pytest.approx(first + 3 / 60)
+
+
+def test_is_due_runs_a_lower_rate_off_faster_ticks() -> None:
+    clock = FakeClock()
+    fast = FrameScheduler(60, clock=clock, sleep=clock.sleep)
+    slow = FrameScheduler(30, clock=clock, sleep=clock.sleep)
+
+    due = [slow.is_due(fast.wait()) for _ in range(120)]
+    assert sum(due) == 60
+    assert due[:4] == [True, False, True, False]
+
+
+def test_invalid_fps() -> None:
+    with pytest.raises(ValueError):
+        FrameScheduler(0)